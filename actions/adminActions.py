@@ -1,9 +1,13 @@
 import django_version
 from datetime import datetime
-from models import Quote, Goal, User, Habit, Project, Readable, Task, MiniJournal, HabitDay
+from models import Quote, Goal, User, Habit, Project, Readable, Task, MiniJournal, HabitDay, JournalTag, \
+    TrackingDay, UserVersioned
 import authorized
 import handlers
+from common import instrumentation, profiling
+import tools
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 
 class Init(handlers.BaseRequestHandler):
@@ -17,7 +21,7 @@ class Init(handlers.BaseRequestHandler):
             g.Update(text=["Get it done"])
             g2 = Goal.Create(u, str(today.year))
             g2.Update(text=["Make progress"])
-            ndb.put_multi([g, g2])
+            UserVersioned.PutMulti([g, g2])
             h = Habit.Create(u)
             h.Update(name="Run")
             h.put()
@@ -74,7 +78,7 @@ class Hacks(handlers.JsonRequestHandler):
                     hd.habit = ndb.Key('User', hd.key.parent().id(), 'Habit', int(habit_key.id()))
                     dbp.append(hd)
             res['habitdays'] = len(dbp)
-            ndb.put_multi(dbp)
+            UserVersioned.PutMulti(dbp)
             dbp = []
             for jrnl in MiniJournal.query().iter():
                 changes = False
@@ -86,8 +90,109 @@ class Hacks(handlers.JsonRequestHandler):
                 if changes:
                     dbp.append(jrnl)
             res['journals'] = len(dbp)
-            ndb.put_multi(dbp)
+            UserVersioned.PutMulti(dbp)
+
+        elif hack_id == 'backfill_journaltag_counts':
+            # Recompute tag usage counters from journals, per user
+            user_id = self.request.get_range('user_id')
+            user = User.get_by_id(user_id) if user_id else None
+            if user:
+                res['tags'] = JournalTag.Recount(user.key)
+            else:
+                res['result'] = 'user_id required'
+
+        elif hack_id == 'backfill_habit_counters':
+            # Recompute streak / week / month counters from habit days
+            cursor = self.request.get('cursor')
+            keys, next_cursor, more = Habit.query().fetch_page(100, keys_only=True,
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+            for key in keys:
+                Habit.Recount(key)
+            res['updated'] = len(keys)
+            res['cursor'] = next_cursor.urlsafe() if more and next_cursor else None
+
+        elif hack_id == 'backfill_reading_stats':
+            # Recount reading stats from readables, per user
+            user_id = self.request.get_range('user_id')
+            user = User.get_by_id(user_id) if user_id else None
+            if user:
+                from tasks import rebuildReadingStats
+                tools.safe_add_task(rebuildReadingStats, user.key.id())
+                res['result'] = 'queued'
+            else:
+                res['result'] = 'user_id required'
+
+        elif hack_id == 'backfill_github':
+            # Commits for the past year, from one contributions page fetch
+            from services.github import GithubClient
+            user_id = self.request.get_range('user_id')
+            user = User.get_by_id(user_id) if user_id else None
+            gh_client = GithubClient(user) if user else None
+            if gh_client and gh_client._can_run():
+                calendar = gh_client.get_contribution_calendar(refresh=True) or {}
+                tds, conflicts = TrackingDay.MergeMany(user, dict(
+                    (tools.fromISODate(iso_date).date(), {'commits': n}) for iso_date, n in calendar.items()))
+                res['days'] = len(tds)
+            else:
+                res['result'] = 'user_id of github user required'
+
+        elif hack_id == 'backfill_rand':
+            # Set sampling rand on readables and quotes put before it existed
+            kind = Quote if self.request.get('kind') == 'Quote' else Readable
+            cursor = self.request.get('cursor')
+            items, next_cursor, more = kind.query().fetch_page(500,
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+            dbp = [item for item in items if item.rand is None]
+            UserVersioned.PutMulti(dbp)  # rand set in _pre_put_hook
+            res['updated'] = len(dbp)
+            res['cursor'] = next_cursor.urlsafe() if more and next_cursor else None
+
+        elif hack_id == 'seed_synthetic':
+            # Dev server only: create synthetic users for load testing
+            # (see scripts/load_test.py)
+            if tools.on_dev_server():
+                from testing import synthetic
+                n_users = self.request.get_range('n_users', default=1, max_value=50)
+                size = self.request.get('size', default_value='small')
+                seed = self.request.get_range('seed', default=1)
+                seeded = synthetic.seed_users(n_users, size=size, seed=seed)
+                res['user_ids'] = [u.key.id() for u, counts in seeded]
+                res['counts'] = [counts for u, counts in seeded]
+            else:
+                res['result'] = 'dev server only'
 
         else:
             res['result'] = 'hack_id not found'
         self.json_out(res)
+
+
+class Instrumentation(handlers.JsonRequestHandler):
+    @authorized.role("admin")
+    def get(self, d):
+        # Rolling per-route latency / RPC percentiles (see common.instrumentation)
+        self.json_out({
+            'routes': instrumentation.route_stats()
+        }, pretty=self.request.get_range('pretty') == 1)
+
+
+class Profiles(handlers.JsonRequestHandler):
+    @authorized.role("admin")
+    def get(self, d):
+        # Captured request profiles (see common.profiling)
+        id = self.request.get('id')
+        if id and self.request.get_range('raw') == 1:
+            blob = profiling.get(id, raw=True)
+            if blob:
+                self.response.headers['Content-Type'] = 'application/octet-stream'
+                self.response.headers['Content-Disposition'] = str('attachment; filename="%s.pstats"' % id)
+                self.response.write(blob)
+            else:
+                self.response.set_status(404)
+        elif id:
+            profile = profiling.get(id)
+            self.response.headers['Content-Type'] = 'text/plain'
+            self.response.write(profile.get('stats') if profile else "Profile not found")
+        else:
+            self.json_out({
+                'profiles': profiling.recent()
+            })
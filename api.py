@@ -1,13 +1,15 @@
 
 from datetime import datetime, timedelta, time
 from models import Project, Habit, HabitDay, Goal, MiniJournal, User, Task, \
-    Readable, TrackingDay, Event, JournalTag, Report, Quote, Snapshot
+    Readable, TrackingDay, Event, JournalTag, Report, Quote, Snapshot, Import, ReadingStats, \
+    UserVersioned
 from constants import READABLE, GOAL
 from google.appengine.ext import ndb
 from google.appengine.api import mail
 from oauth2client import client
 import authorized
 import handlers
+from common import json_util
 import tools
 import logging
 import random
@@ -24,6 +26,53 @@ else:
     from settings import secrets
 
 
+def dashboard_data(user, habit_days=7):
+    '''
+    First-screen dashboard data (habits and recent habitdays, tasks,
+    active projects, current goals, today's journal, unread readables)
+
+    All datastore work is started as parallel futures. Serialized the same
+    way as the individual list endpoints.
+    '''
+    habits_f = Habit.ActiveAsync(user)
+    tasks_f = Task.RecentAsync(user, prefetch=['project'])
+    projects_f = Project.ActiveAsync(user)
+    goals_f = Goal.CurrentAsync(user)
+    journal_f = MiniJournal.GetAsync(user)
+    readables_f = Readable.FetchAsync(user, unread=True)
+    habits = habits_f.get_result()
+    habitdays_f = HabitDay.RangeAsync(user, habits, datetime.today() - timedelta(days=habit_days))
+    annual, monthly, longterm = goals_f.get_result()
+    journal = journal_f.get_result()
+    return {
+        'habits': [habit.json() for habit in habits],
+        'habitdays': tools.lookupDict(habitdays_f.get_result(),
+                keyprop="key_id",
+                valueTransform=lambda hd: hd.json()),
+        'tasks': [t.json(references=['project']) for t in tasks_f.get_result()],
+        'projects': [p.json() for p in projects_f.get_result()],
+        'goals': {
+            'annual': annual.json() if annual else None,
+            'monthly': monthly.json() if monthly else None,
+            'longterm': longterm.json() if longterm else None
+        },
+        'journal': journal.json() if journal else None,
+        'readables': [r.json() for r in readables_f.get_result()]
+    }
+
+
+class DashboardAPI(handlers.JsonRequestHandler):
+
+    @authorized.role('user')
+    def get(self, d):
+        '''
+        Batched dashboard bootstrap, replacing separate habit, task, project,
+        goal, journal and readable calls on page load
+        '''
+        days = self.request.get_range('days', default=7)
+        self.set_response(dashboard_data(self.user, habit_days=days), success=True)
+
+
 class ProjectAPI(handlers.JsonRequestHandler):
 
     @authorized.role('user')
@@ -35,6 +84,8 @@ class ProjectAPI(handlers.JsonRequestHandler):
 
     @authorized.role('user')
     def active(self, d):
+        if self.not_modified(['Project']):
+            return
         projects = Project.Active(self.user)
         self.set_response({
             'projects': [p.json() for p in projects]
@@ -94,6 +145,8 @@ class TaskAPI(handlers.JsonRequestHandler):
 
     @authorized.role('user')
     def list(self, d):
+        if self.not_modified(['Task', 'Project']):
+            return
         with_archived = self.request.get_range('with_archived') == 1
         project_id = self.request.get_range('project_id')
         page, limit, offset = tools.paging_params(self.request)
@@ -161,7 +214,7 @@ class TaskAPI(handlers.JsonRequestHandler):
                     t.archive()
                     to_archive.append(t)
             if to_archive:
-                ndb.put_multi(to_archive)
+                UserVersioned.PutMulti(to_archive)
                 res['archived_ids'] = [t.key.id() for t in to_archive]
                 self.message = "Archived %d %s" % (len(to_archive), tools.pluralize('task', count=len(to_archive)))
             else:
@@ -186,6 +239,8 @@ class HabitAPI(handlers.JsonRequestHandler):
         '''
         Return recent days of all active habits
         '''
+        if self.not_modified(['Habit', 'HabitDay']):
+            return
         self.success = True
         days = self.request.get_range('days', default=5)
         habits = Habit.Active(self.user)
@@ -212,7 +267,7 @@ class HabitAPI(handlers.JsonRequestHandler):
             'habitdays': tools.lookupDict(habitdays,
                     keyprop="key_id",
                     valueTransform=lambda hd: hd.json())
-        }, success=True)
+        }, success=True, stream=True)
 
     @authorized.role('user')
     def toggle(self, d):
@@ -251,6 +306,50 @@ class HabitAPI(handlers.JsonRequestHandler):
             'habitday': hd.json() if hd else None
         })
 
+    @authorized.role('user')
+    def batch(self, d):
+        '''
+        Apply multiple toggle / commit ops (e.g. offline changes from a client)
+
+        ops: JSON list of {habit_id, date (ISO), op ('toggle' or 'commit')}
+
+        Invalid ops are skipped and reported in errors (by index in ops)
+        '''
+        ops_json = tools.getJson(self.request.get('ops'), default=[])
+        if not isinstance(ops_json, list):
+            ops_json = [ops_json]
+        habit_ids = set(tools.safe_number(op.get('habit_id'), integer=True)
+                        for op in ops_json if isinstance(op, dict))
+        habit_ids.discard(None)
+        habits = ndb.get_multi([ndb.Key('Habit', id, parent=self.user.key) for id in habit_ids])
+        habit_lookup = dict((h.key.id(), h) for h in habits if h)
+        ops = []
+        errors = []
+        for i, op in enumerate(ops_json):
+            error = None
+            if not isinstance(op, dict):
+                error = "Malformed op"
+            else:
+                habit = habit_lookup.get(tools.safe_number(op.get('habit_id'), integer=True))
+                date = tools.fromISODate(op.get('date')) if isinstance(op.get('date'), basestring) else None
+                if not habit:
+                    error = "Habit not found"
+                elif not date:
+                    error = "YYYY-MM-DD formatted date required"
+                elif op.get('op') not in HabitDay.BATCH_OPS:
+                    error = "Op must be one of %s" % ', '.join(HabitDay.BATCH_OPS)
+            if error:
+                errors.append({'index': i, 'error': error})
+            else:
+                ops.append((habit, date, op.get('op')))
+        habitdays = HabitDay.ApplyBatch(ops) if ops else []
+        self.message = "%d habit day(s) updated" % len(habitdays)
+        self.success = not errors
+        self.set_response({
+            'habitdays': [hd.json() for hd in habitdays],
+            'errors': errors
+        })
+
     @authorized.role('user')
     def update(self, d):
         '''
@@ -319,6 +418,8 @@ class GoalAPI(handlers.JsonRequestHandler):
 
     @authorized.role('user')
     def current(self, d):
+        if self.not_modified(['Goal']):
+            return
         [annual, monthly, longterm] = Goal.Current(self.user)
         self.set_response({
             'annual': annual.json() if annual else None,
@@ -463,7 +564,7 @@ class ReadableAPI(handlers.JsonRequestHandler):
                         pocket.update_article(access_token, r.source_id, action='favorite')
                     if params.get('read') == 1:
                         pocket.update_article(access_token, r.source_id, action='archive')
-            r.put()
+            ReadingStats.Write(self.user, [r])
             self.success = True
         self.set_response({
             'readable': r.json() if r else None
@@ -473,15 +574,15 @@ class ReadableAPI(handlers.JsonRequestHandler):
     def batch_create(self, d):
         readings = json.loads(self.request.get('readings'))
         source = self.request.get('source', default_value='form')
-        dbp = []
+        items = []
         for r in readings:
             type_string = r.get('type')
             if type_string:
                 r['type'] = READABLE.LOOKUP.get(type_string.lower())
-            r = Readable.CreateOrUpdate(self.user, None, source=source, read=True, **r)
-            dbp.append(r)
+            r.update(source_id=None, source=source, read=True)
+            items.append(r)
+        dbp = [r for r in Readable.CreateOrUpdateMulti(self.user, items) if r]
         if dbp:
-            ndb.put_multi(dbp)
             self.success = True
             self.message = "Putting %d" % len(dbp)
         self.set_response()
@@ -492,14 +593,36 @@ class ReadableAPI(handlers.JsonRequestHandler):
         Return a random batch, optionally filtered
         '''
         BATCH_SIZE = 50
-        sample_keys = Readable.Fetch(self.user, with_notes=True, limit=500, keys_only=True)
-        if len(sample_keys) > BATCH_SIZE:
-            sample_keys = random.sample(sample_keys, BATCH_SIZE)
-        readables = ndb.get_multi(sample_keys)
+        filters = {}
+        if self.request.get_range('with_notes', default=1) == 1:
+            filters['has_notes'] = True
+        type = self.request.get_range('type')
+        if type:
+            filters['type'] = type
+        half_life_days = self.request.get_range('half_life_days') or None
+        readables = Readable.Sample(self.user, n=BATCH_SIZE, half_life_days=half_life_days, **filters)
         self.set_response({
             'readables': [r.json() for r in readables]
             }, success=True)
 
+    @authorized.role('user')
+    def stats(self, d):
+        '''
+        Reading counters for a year (default current), by day and week
+        '''
+        year = self.request.get_range('year') or datetime.today().year
+        stats = None
+        if ReadingStats.Rebuilt(self.user.key):
+            stats = ReadingStats.Get(self.user, year)
+            self.success = True
+        else:
+            from tasks import queueReadingStatsRebuild
+            queueReadingStatsRebuild(self.user)
+            self.message = "Counting your reading history, check back soon"
+        self.set_response({
+            'stats': stats.json() if stats else None
+            })
+
     @authorized.role('user')
     def search(self, d):
         term = self.request.get('term')
@@ -519,7 +642,7 @@ class ReadableAPI(handlers.JsonRequestHandler):
                 if access_token:
                     from services import pocket
                     pocket.update_article(access_token, r.source_id, action='delete')
-            r.key.delete()
+            ReadingStats.Write(self.user, [r], removed=True)
             self.success = True
             self.message = "Deleted item"
         else:
@@ -565,11 +688,13 @@ class QuoteAPI(handlers.JsonRequestHandler):
     def batch_create(self, d):
         quotes = json.loads(self.request.get('quotes'))
         dbp = []
+        sources = {}  # Readable resolutions, one lookup per distinct source
         for q in quotes:
             if 'dt_added' in q and isinstance(q['dt_added'], basestring):
                 q['dt_added'] = tools.fromISODate(q['dt_added'])
-            q = Quote.Create(self.user, **q)
-            dbp.append(q)
+            q = Quote.Create(self.user, sources=sources, **q)
+            if q:
+                dbp.append(q)
         if dbp:
             ndb.put_multi(dbp)
             self.success = True
@@ -582,10 +707,15 @@ class QuoteAPI(handlers.JsonRequestHandler):
         Return a random batch, optionally filtered
         '''
         BATCH_SIZE = 50
-        sample_keys = Quote.Fetch(self.user, limit=500, keys_only=True)
-        if len(sample_keys) > BATCH_SIZE:
-            sample_keys = random.sample(sample_keys, BATCH_SIZE)
-        quotes = ndb.get_multi(sample_keys)
+        filters = {}
+        tag = self.request.get('tag')
+        if tag:
+            filters['tags'] = tag.lower()
+        readable_id = self.request.get('readable_id')
+        if readable_id:
+            filters['readable'] = ndb.Key('Readable', readable_id, parent=self.user.key)
+        half_life_days = self.request.get_range('half_life_days') or None
+        quotes = Quote.Sample(self.user, n=BATCH_SIZE, half_life_days=half_life_days, **filters)
         self.set_response({
             'quotes': [q.json() for q in quotes]
             }, success=True)
@@ -606,7 +736,8 @@ class QuoteAPI(handlers.JsonRequestHandler):
         quote = self.user.get(Quote, id=id)
         if quote:
             if action == 'link_readable':
-                readable = quote.lookup_readable(self.user)
+                readable_key = quote.lookup_readable(self.user, refresh=True)
+                readable = readable_key.get() if readable_key else None
                 if readable:
                     quote.put()
                     self.success = True
@@ -638,9 +769,18 @@ class JournalTagAPI(handlers.JsonRequestHandler):
 
     @authorized.role('user')
     def list(self, d):
-        tags = JournalTag.All(self.user)
+        '''
+        Tags sorted by use count, paged with cursor
+        '''
+        from google.appengine.datastore.datastore_query import Cursor
+        _max = self.request.get_range('max', max_value=400, default=400)
+        _cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=_cursor) if _cursor else None
+        tags, next_cursor, more = JournalTag.Frequent(self.user, limit=_max, cursor=cursor)
         self.set_response({
-            'tags': [tag.json() for tag in tags]
+            'tags': [tag.json() for tag in tags],
+            'cursor': next_cursor.urlsafe() if more and next_cursor else None,
+            'more': more
         }, success=True)
 
 
@@ -653,15 +793,10 @@ class JournalAPI(handlers.JsonRequestHandler):
         _before_date = self.request.get('before_date')
         if _before_date:
             before_date = tools.fromISODate(_before_date)
-        cursor = before_date
-        journal_keys = []
-        for i in range(days):
-            iso_date = tools.iso_date(cursor)
-            journal_keys.append(ndb.Key('MiniJournal', iso_date, parent=self.user.key))
-            cursor -= timedelta(days=1)
-        journals = ndb.get_multi(journal_keys)
+        data_fields = json_util.parse_fields(self.request.get('data_fields'))
+        journals, iso_dates = MiniJournal.Fetch(self.user, before_date - timedelta(days=days), before_date)
         self.set_response({
-            'journals': [j.json() for j in journals if j]
+            'journals': [j.json(data_fields=data_fields) for j in reversed(journals)]
             }, success=True)
 
     @authorized.role('user')
@@ -669,7 +804,10 @@ class JournalAPI(handlers.JsonRequestHandler):
         '''
         Get today's journal (yesterday if early morning)
         '''
-        jrnl = MiniJournal.Get(self.user)
+        submission_date = MiniJournal.CurrentSubmissionDate()
+        if self.not_modified(['MiniJournal'], scope=tools.iso_date(submission_date)):
+            return
+        jrnl = MiniJournal.Get(self.user, date=submission_date)
         self.set_response({
             'journal': jrnl.json() if jrnl else None
         }, success=True)
@@ -728,7 +866,7 @@ class JournalAPI(handlers.JsonRequestHandler):
                     if t:
                         task = Task.Create(self.user, t)
                         tasks.append(task)
-                ndb.put_multi(tasks)
+                UserVersioned.PutMulti(tasks)
             self.success = True
             self.message = "Journal submitted!"
         else:
@@ -746,7 +884,7 @@ class SnapshotAPI(handlers.JsonRequestHandler):
         snapshots = Snapshot.Recent(self.user, limit=limit)
         self.set_response({
             'snapshots': [s.json() for s in snapshots if s]
-            }, success=True, debug=True)
+            }, success=True, stream=True)
 
     @authorized.role('user')
     def submit(self, d):
@@ -773,22 +911,34 @@ class TrackingAPI(handlers.JsonRequestHandler):
         '''
         Update a single TrackingDay() object with properties
         defined via JSON key(str) -> value(str)
+
+        With if_unmodified_since (ms), properties written since then are
+        left unchanged and returned as conflicts
         '''
         date = td = None
+        conflicts = []
         _date = self.request.get('date')
         if _date:
             date = tools.fromISODate(_date)
         data_json = tools.getJson(self.request.get('data'))  # JSON
-        if date:
-            td = TrackingDay.Create(self.user, date)  # Get or create
-            if data_json:
-                td.set_properties(data_json)
-                td.put()
+        if_unmodified_since = self.request.get_range('if_unmodified_since') or None
+        if date and not data_json:
+            # Nothing to write, return the stored day
+            td = TrackingDay.get_by_id(tools.iso_date(date), parent=self.user.key)
             self.success = True
+        elif date:
+            tds, conflicts = TrackingDay.MergeMany(self.user, {date: data_json},
+                                                   if_unmodified_since=if_unmodified_since)
+            td = tds[0]
+            if conflicts:
+                self.message = "Modified since: %s" % ', '.join(prop for iso_date, prop in conflicts)
+            else:
+                self.success = True
         else:
             self.message = "YYYY-MM-DD formatted date param is required"
         self.set_response({
-            'tracking_day': td.json() if td else None
+            'tracking_day': td.json() if td else None,
+            'conflicts': [prop for iso_date, prop in conflicts]
         })
 
 
@@ -1030,6 +1180,7 @@ class AnalysisAPI(handlers.JsonRequestHandler):
         date_start = self.request.get('date_start')
         date_end = self.request.get('date_end')
         dt_start, dt_end = tools.fromISODate(date_start), tools.fromISODate(date_end)
+        data_fields = json_util.parse_fields(self.request.get('data_fields'))  # Journal questions to include
         iso_dates = []
         habits = []
         today = datetime.today()
@@ -1048,7 +1199,7 @@ class AnalysisAPI(handlers.JsonRequestHandler):
             tasks = Task.DueInRange(self.user, dt_start, dt_end + timedelta(days=1), limit=100)
         self.set_response({
             'dates': iso_dates,
-            'journals': [j.json() for j in journals if j],
+            'journals': [j.json(data_fields=data_fields) for j in journals if j],
             'habits': [h.json() for h in habits],
             'goals': [g.json() for g in goals],
             'tasks': [t.json() for t in tasks],
@@ -1095,9 +1246,13 @@ class IntegrationsAPI(handlers.JsonRequestHandler):
         access_token = self.user.get_integration_prop('pocket_access_token')
         readables = []
         if access_token:
-            self.success, readables, latest_timestamp = pocket.sync(self.user, access_token)
-            self.user.put()
+            # One page in the request, the rest continue in the background
+            self.success, readables, latest_timestamp, more = pocket.sync(self.user, access_token, max_pages=1)
             self.update_session_user(self.user)
+            if self.success and more:
+                # Remaining pages synced in background
+                pocket.queue_continue_sync(self.user)
+                self.message = "Syncing remaining articles in the background"
         else:
             self.message = "Please link your Pocket account from the integrations page"
         self.set_response({
@@ -1200,41 +1355,17 @@ class IntegrationsAPI(handlers.JsonRequestHandler):
         Webhook request for note creation of the form:
         [base URL]/?userId=[user ID]&guid=[note GUID]&notebookGuid=[notebook GUID]&reason=create
         '''
-        from services import flow_evernote
-        from models import Quote
+        import tasks
         ENABLED_REASONS = ['create']
         note_guid = self.request.get('guid')
         evernote_id = self.request.get('userId')
         notebook_guid = self.request.get('notebookGuid')
         reason = self.request.get('reason')
         data = {}
-        if reason in ENABLED_REASONS:
-            user = User.query().filter(User.evernote_id == evernote_id).get()
-            if user:
-                config_notebook_ids = user.get_integration_prop('evernote_notebook_ids', default='').split(',')  # Comma sep
-                if not config_notebook_ids or notebook_guid in config_notebook_ids:
-                    uid, title, content, url = flow_evernote.get_note(user, note_guid)
-                    if title and content:
-                        max_quote_length = user.get_integration_prop('evernote_max_quote_length', 1200)
-                        # TODO: Tags (come in as guids)
-                        is_article = len(content) > max_quote_length or title in content
-                        if is_article:
-                            # Treat as article
-                            r = Readable.CreateOrUpdate(user, uid, source='evernote', url=url, title=title)
-                            r.put()
-                            self.success = True
-                        else:
-                            # Treat as quote/excerpt
-                            q = Quote.Create(user, source=title, content=content)
-                            q.Update(link=url)
-                            q.put()
-                            self.success = True
-                    else:
-                        self.message = "Failed to parse note"
-                else:
-                    logging.warning("Note from ignored notebook")
-            else:
-                logging.warning("User not found")
+        if reason in ENABLED_REASONS and evernote_id and note_guid:
+            # Fetched and saved by a coalescing worker (tasks.processEvernoteQueue)
+            tasks.queueEvernoteNote(evernote_id, note_guid, notebook_guid=notebook_guid)
+            self.success = True
         else:
             logging.debug("Ignoring, reason: %s not enabled" % reason)
         self.set_response(data=data, debug=True)
@@ -1367,7 +1498,6 @@ class ReportAPI(handlers.JsonRequestHandler):
     def generate(self, d):
         from constants import REPORT
         from handlers import APIError
-        from tasks import backgroundReportRun
         type = self.request.get_range('type')
         if not type:
             raise APIError("No type in report request")
@@ -1375,12 +1505,43 @@ class ReportAPI(handlers.JsonRequestHandler):
         specs_json = self.request.get('specs_json')
         specs = tools.getJson(specs_json)
         report = Report.Create(self.user, type=type, specs=specs, ftype=ftype)
+        self.generate_background(report)
+
+    def generate_background(self, report):
+        from tasks import backgroundReportRun
         report.put()
         tools.safe_add_task(backgroundReportRun, report.key.urlsafe(), _queue="report-queue")
         self.set_response(success=True, message="%s generating..." % report.title, data={
             'report': report.json() if report else None
         })
 
+    @authorized.role('user')
+    def export(self, d):
+        '''
+        Synchronous export with rows written straight to the response.
+        Exports too large to stream fall back to background generation
+        (same response as generate).
+        '''
+        from constants import REPORT
+        from handlers import APIError
+        type = self.request.get_range('type')
+        if not type:
+            raise APIError("No type in report request")
+        ftype = self.request.get_range('ftype', default=REPORT.CSV)
+        if ftype not in REPORT.EXTENSIONS:
+            self.set_response(success=False, status=400, message="Unsupported export format")
+            return
+        specs = tools.getJson(self.request.get('specs_json'))
+        report = Report.Create(self.user, type=type, specs=specs, ftype=ftype)
+        worker = report.worker(stream=self.response.out)
+        if worker and worker.fits_stream():
+            self.response.headers['Content-Type'] = Report.content_type(report.extension)
+            self.response.headers['Content-Disposition'] = str('attachment; filename="%s"' % report.filename())
+            worker.stream()
+        else:
+            report.status = REPORT.CREATED
+            self.generate_background(report)
+
     @authorized.role('user')
     def serve(self, d):
         import cloudstorage as gcs
@@ -1421,6 +1582,58 @@ class ReportAPI(handlers.JsonRequestHandler):
         self.set_response()
 
 
+class ImportAPI(handlers.JsonRequestHandler):
+    @authorized.role('user')
+    def list(self, d):
+        _max = self.request.get_range('max', max_value=100, default=20)
+        imports = Import.Fetch(self.user, limit=_max)
+        self.set_response({
+            'imports': [import_job.json() for import_job in imports]
+        }, success=True)
+
+    @authorized.role('user')
+    def upload(self, d):
+        '''
+        Store an uploaded file (field 'file') in GCS and import it in the
+        background (see imports.py). Progress via status.
+        '''
+        from constants import IMPORT
+        from handlers import APIError
+        from tasks import backgroundImportRun
+        import imports
+        kind = self.request.get_range('kind', default=IMPORT.READABLES)
+        ftype = self.request.get_range('ftype', default=IMPORT.JSON)
+        upload = self.request.POST.get('file')
+        if kind not in IMPORT.KIND_LABELS or ftype not in IMPORT.EXTENSIONS:
+            raise APIError("Unsupported import")
+        if not hasattr(upload, 'file'):
+            raise APIError("No file uploaded")
+        if ftype == IMPORT.KINDLE and kind != IMPORT.QUOTES:
+            raise APIError("Kindle clippings import as quotes")
+        import_job = Import.Create(self.user, kind=kind, ftype=ftype, filename=upload.filename,
+                            source=self.request.get('source', default_value='import'))
+        import_job.put()
+        imports.store_upload(import_job, upload.file)
+        import_job.put()
+        tools.safe_add_task(backgroundImportRun, import_job.key.urlsafe(), _queue="import-queue")
+        self.set_response({
+            'import': import_job.json()
+        }, success=True, message="Importing %s..." % import_job.filename)
+
+    @authorized.role('user')
+    def status(self, d):
+        from imports import MC_IMPORT_STATUS
+        from google.appengine.api import memcache
+        import_job = Import.GetAccessible(self.request.get('key'), self.user, urlencoded_key=True)
+        if import_job:
+            self.set_response({
+                'import': import_job.json(),
+                'progress': memcache.get(MC_IMPORT_STATUS % import_job.key)
+            }, success=True)
+        else:
+            self.set_response(success=False, status=404, message="Import not found")
+
+
 class FeedbackAPI(handlers.JsonRequestHandler):
     @authorized.role('user')
     def submit(self, d):
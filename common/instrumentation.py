@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Per-request RPC and latency instrumentation
+#
+# apiproxy pre/post call hooks count and time every RPC (datastore_v3,
+# memcache, search, urlfetch, ...) made while a request is being tracked.
+# BaseRequestHandler.dispatch wraps tracked requests (see requested) with
+# begin() / end(), and record() keeps a rolling sample of latencies and RPC
+# counts per route in memcache (read by the admin instrumentation endpoint).
+
+import json
+import random
+import logging
+import threading
+from time import time
+from google.appengine.api import apiproxy_stub_map, memcache
+from constants import INSTRUMENT_REQUESTS, INSTRUMENT_SAMPLE_RATE
+import tools
+
+HOOK_NAME = 'flow_instrumentation'
+ROUTES_MCK = "instrumentation:routes"
+ROUTE_COUNT_MCK = "instrumentation:route:%s:n"
+ROUTE_SAMPLE_MCK = "instrumentation:route:%s:%d"  # Route, slot
+MAX_SAMPLES = 200  # Rolling samples kept per route
+CAS_RETRIES = 5
+PERCENTILES = [50, 90, 99]
+
+# Datastore calls whose responses carry entities
+ENTITY_READ_CALLS = {
+    'Get': 'entity_size',
+    'RunQuery': 'result_size',
+    'Next': 'result_size'
+}
+
+_local = threading.local()
+_installed_on = None
+
+
+def _pre_call(service, call, request, response, rpc=None):
+    counts = getattr(_local, 'counts', None)
+    if counts is not None:
+        _local.started[id(response)] = time()
+
+
+def _post_call(service, call, request, response, rpc=None, error=None):
+    counts = getattr(_local, 'counts', None)
+    if counts is None:
+        return
+    started = _local.started.pop(id(response), None)
+    stats = counts.setdefault(service, {'calls': 0, 'ms': 0.})
+    stats['calls'] += 1
+    if started:
+        stats['ms'] += (time() - started) * 1000.
+    if service == 'datastore_v3' and call in ENTITY_READ_CALLS:
+        size = getattr(response, ENTITY_READ_CALLS[call], None)
+        if size:
+            _local.entities += size()
+
+
+def verbose():
+    '''
+    Whether every request is tracked, with timing headers
+    '''
+    return INSTRUMENT_REQUESTS or tools.on_dev_server()
+
+
+def requested():
+    '''
+    Whether to track this request (in production, a sampled fraction)
+    '''
+    return verbose() or (INSTRUMENT_SAMPLE_RATE > 0 and random.random() < INSTRUMENT_SAMPLE_RATE)
+
+
+def install():
+    '''
+    Register apiproxy hooks (once per apiproxy, testbed activation
+    swaps in a fresh one)
+    '''
+    global _installed_on
+    apiproxy = apiproxy_stub_map.apiproxy
+    if apiproxy is _installed_on:
+        return
+    apiproxy.GetPreCallHooks().Append(HOOK_NAME, _pre_call)
+    apiproxy.GetPostCallHooks().Append(HOOK_NAME, _post_call)
+    _installed_on = apiproxy
+
+
+def begin():
+    install()
+    _local.counts = {}
+    _local.started = {}
+    _local.entities = 0
+    _local.start = time()
+
+
+def end():
+    '''
+    Stop tracking the current request
+
+    Returns:
+        dict: total_ms, rpcs (total count), entities (datastore entities
+        read), services {service: {calls, ms}}
+    '''
+    counts = getattr(_local, 'counts', None)
+    if counts is None:
+        return None
+    _local.counts = None
+    _local.started = {}
+    _local.last = {
+        'total_ms': round((time() - _local.start) * 1000., 1),
+        'rpcs': sum(s['calls'] for s in counts.values()),
+        'entities': _local.entities,
+        'services': counts
+    }
+    return _local.last
+
+
+def last():
+    '''
+    Summary of the most recent request tracked on this thread
+    '''
+    return getattr(_local, 'last', None)
+
+
+def timing_header(summary):
+    '''
+    Compact header value, e.g. "total=41.2;datastore_v3=3/12.0;memcache=2/1.1"
+    (service=calls/ms)
+
+    >>> timing_header({'total_ms': 10.0, 'services': {'memcache': {'calls': 2, 'ms': 1.25}}})
+    'total=10.0;memcache=2/1.2'
+    '''
+    parts = ["total=%.1f" % summary.get('total_ms')]
+    for service, stats in sorted(summary.get('services').items()):
+        parts.append("%s=%d/%.1f" % (service, stats['calls'], stats['ms']))
+    return ';'.join(parts)
+
+
+def log(route, user_id, summary):
+    logging.info("request_timing %s" % json.dumps({
+        'route': route,
+        'user': user_id,
+        'total_ms': summary.get('total_ms'),
+        'rpcs': summary.get('rpcs'),
+        'entities': summary.get('entities'),
+        'services': summary.get('services')
+    }, sort_keys=True))
+
+
+def record(route, summary):
+    '''
+    Write this request's sample to the rolling per-route window in memcache
+
+    Samples go in MAX_SAMPLES slots per route, picked by an atomic counter,
+    so concurrent requests don't overwrite each other's samples (2 RPCs)
+    '''
+    n = memcache.incr(ROUTE_COUNT_MCK % route, initial_value=0)
+    if n is None:
+        return
+    memcache.set(ROUTE_SAMPLE_MCK % (route, n % MAX_SAMPLES), [summary.get('total_ms'), summary.get('rpcs')])
+    if n % MAX_SAMPLES == 1:
+        # First sample (or window wrapped), make sure route is listed
+        _add_route(route)
+
+
+def _add_route(route):
+    client = memcache.Client()
+    for i in range(CAS_RETRIES):
+        routes = client.gets(ROUTES_MCK)
+        if routes is None:
+            if client.add(ROUTES_MCK, [route]):
+                return
+        elif route in routes or client.cas(ROUTES_MCK, routes + [route]):
+            return
+
+
+def percentile(values, p):
+    '''
+    Nearest-rank percentile
+
+    >>> percentile([5, 1, 3, 2, 4], 50)
+    3
+    >>> percentile([], 90)
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100. * (len(values) - 1)))
+    return values[rank]
+
+
+def route_stats():
+    '''
+    Returns:
+        list of dicts: per-route sample count and latency / RPC percentiles,
+        slowest p90 first
+    '''
+    routes = memcache.get(ROUTES_MCK) or []
+    res = []
+    for route in routes:
+        samples = memcache.get_multi([ROUTE_SAMPLE_MCK % (route, i) for i in range(MAX_SAMPLES)]).values()
+        if not samples:
+            continue
+        latencies = [s[0] for s in samples]
+        rpcs = [s[1] for s in samples]
+        stats = {'route': route, 'n': len(samples)}
+        for p in PERCENTILES:
+            stats['ms_p%d' % p] = percentile(latencies, p)
+            stats['rpcs_p%d' % p] = percentile(rpcs, p)
+        res.append(stats)
+    return sorted(res, key=lambda s: s.get('ms_p90'), reverse=True)
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+# JSON encoding for API responses
+# Uses the stdlib encoder with compact separators (it uses the _json C
+# speedups when called without indent / sort_keys). Third party C encoders
+# aren't available on the GAE py27 runtime.
+
+import json
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+def dumps(data, pretty=False):
+    '''
+    Encode data compactly
+
+    >>> dumps({'id': 1})
+    '{"id":1}'
+    >>> dumps([1, "/a"])
+    '[1,"/a"]'
+    >>> json.loads(dumps([37.774929501234567, -122.41941550123456])) == [37.774929501234567, -122.41941550123456]
+    True
+    '''
+    if pretty:
+        return json.dumps(data, indent=4)
+    return json.dumps(data, separators=COMPACT_SEPARATORS)
+
+
+def _key(key):
+    # Object keys must be strings (as json.dumps coerces them)
+    return dumps(key if isinstance(key, basestring) else str(key))
+
+
+def iterencode(data):
+    '''
+    Generator yielding encoded chunks for a (dict) response.
+    Top-level lists and lookup dicts are encoded item by item, so very
+    large collections are never encoded as a single string (callers
+    writing to a buffered response still hold the whole body).
+
+    >>> ''.join(iterencode({'items': [{'id': 1}, {'id': 2}]}))
+    '{"items":[{"id":1},{"id":2}]}'
+    >>> ''.join(iterencode({'lookup': {1: {'id': 1}}}))
+    '{"lookup":{"1":{"id":1}}}'
+    '''
+    if not isinstance(data, dict):
+        yield dumps(data)
+        return
+    yield '{'
+    first = True
+    for key, value in data.items():
+        if not first:
+            yield ','
+        first = False
+        yield _key(key) + ':'
+        if isinstance(value, list):
+            yield '['
+            for i, item in enumerate(value):
+                if i:
+                    yield ','
+                yield dumps(item)
+            yield ']'
+        elif isinstance(value, dict) and 'id' not in value:
+            yield '{'
+            for i, (k, item) in enumerate(value.items()):
+                if i:
+                    yield ','
+                yield _key(k) + ':' + dumps(item)
+            yield '}'
+        else:
+            yield dumps(value)
+    yield '}'
+
+
+def parse_fields(raw):
+    '''
+    Parse comma-separated fields param
+
+    >>> parse_fields('name, color,,id')
+    ['name', 'color', 'id']
+    >>> parse_fields(None)
+    '''
+    if raw:
+        return [f.strip() for f in raw.split(',') if f.strip()]
+    return None
+
+
+def select_fields(value, fields):
+    '''
+    Restrict serialized entities (dicts with an 'id') to the requested
+    fields ('id' is always kept). Lists and lookup dicts (e.g. habitdays
+    keyed by id) are walked until an entity is reached. Applied to the
+    output of json(), so it trims the response, not serialization work.
+
+    >>> select_fields([{'id': 1, 'color': 'red'}], ['name'])
+    [{'id': 1}]
+    >>> select_fields({'h1': {'id': 'h1', 'ts_created': 0}}, ['done'])
+    {'h1': {'id': 'h1'}}
+    '''
+    if not fields:
+        return value
+    if isinstance(value, list):
+        return [select_fields(v, fields) for v in value]
+    if isinstance(value, dict):
+        if 'id' in value:
+            return dict((k, v) for k, v in value.items() if k == 'id' or k in fields)
+        return dict((k, select_fields(v, fields)) for k, v in value.items())
+    return value
@@ -2,9 +2,25 @@ from datetime import datetime
 import jinja2
 import json
 
+# Characters that could end an inline <script> or a JS string literal
+SCRIPT_ESCAPES = [
+    (u'&', u'\\u0026'),
+    (u'<', u'\\u003c'),
+    (u'>', u'\\u003e'),
+    (u'\u2028', u'\\u2028'),
+    (u'\u2029', u'\\u2029')
+]
+
 
 def printjson(d):
+    '''
+    JSON safe to embed in an inline <script> (user content can't close
+    the tag)
+    '''
     if d:
-        return jinja2.Markup(json.dumps(d))
+        s = json.dumps(d)
+        for char, escaped in SCRIPT_ESCAPES:
+            s = s.replace(char, escaped)
+        return jinja2.Markup(s)
     else:
         return 'null';
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Opt-in cProfile capture for sampled requests
+#
+# A request is profiled when an admin sends the X-Flow-Profile header, when
+# its route is listed in PROFILE_ROUTES, or at random with probability
+# PROFILE_SAMPLE_RATE. The top-N cumulative stats (and optionally the raw
+# pstats data) are stored in memcache by request id, bounded in size and
+# expiring after PROFILE_EXPIRY, and listed at /admin/gauth/profiles.
+
+import os
+import uuid
+import random
+import marshal
+import pstats
+import cProfile
+import StringIO
+from google.appengine.api import memcache
+from constants import PROFILE_SAMPLE_RATE, PROFILE_ROUTES
+import tools
+
+HEADER = 'X-Flow-Profile'
+PROFILE_MCK = "profile:%s"
+INDEX_MCK = "profile:index"
+PROFILE_EXPIRY = 60 * 60 * 24
+TOP_N = 40
+MAX_STATS_CHARS = 50000
+MAX_RAW_BYTES = 900000  # Under memcache 1MB value limit
+MAX_INDEX = 50
+
+
+def requested(handler, route):
+    '''
+    Whether this request should run under the profiler
+    '''
+    if handler.request.headers.get(HEADER):
+        if tools.on_dev_server():
+            return True
+        user = handler.session.get('user') if handler.session else None
+        if user and user.admin():
+            return True
+    if route in PROFILE_ROUTES:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def request_id():
+    return os.environ.get('REQUEST_LOG_ID') or uuid.uuid4().hex
+
+
+def run(fn, *args):
+    '''
+    Call fn under the profiler
+
+    Returns:
+        cProfile.Profile()
+    '''
+    profiler = cProfile.Profile()
+    profiler.runcall(fn, *args)
+    return profiler
+
+
+def save(profiler, route, raw=False):
+    '''
+    Store top-N cumulative stats for a finished profile
+
+    Returns:
+        str: profile (request) id
+    '''
+    id = request_id()
+    out = StringIO.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(TOP_N)
+    profile = {
+        'id': id,
+        'route': route,
+        'ts': tools.unixtime(),
+        'total_calls': stats.total_calls,
+        'total_tt': stats.total_tt,
+        'stats': out.getvalue()[:MAX_STATS_CHARS]
+    }
+    if raw:
+        blob = marshal.dumps(pstats.Stats(profiler).stats)
+        if len(blob) <= MAX_RAW_BYTES:
+            memcache.set(PROFILE_MCK % id + ":raw", blob, time=PROFILE_EXPIRY)
+            profile['raw'] = True
+    memcache.set(PROFILE_MCK % id, profile, time=PROFILE_EXPIRY)
+    index = memcache.get(INDEX_MCK) or []
+    index.insert(0, id)
+    memcache.set(INDEX_MCK, index[:MAX_INDEX], time=PROFILE_EXPIRY)
+    return id
+
+
+def get(id, raw=False):
+    if raw:
+        return memcache.get(PROFILE_MCK % id + ":raw")
+    return memcache.get(PROFILE_MCK % id)
+
+
+def recent():
+    '''
+    Returns:
+        list of dicts: recent profiles (without stats text), newest first
+    '''
+    index = memcache.get(INDEX_MCK) or []
+    lookup = memcache.get_multi([PROFILE_MCK % id for id in index])
+    res = []
+    for id in index:
+        profile = lookup.get(PROFILE_MCK % id)
+        if profile:
+            res.append(dict((k, v) for k, v in profile.items() if k != 'stats'))
+    return res
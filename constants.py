@@ -14,10 +14,16 @@ SENDER_EMAIL = APP_OWNER
 NOTIF_EMAILS = [APP_OWNER]
 
 GCS_REPORT_BUCKET = "/flow_reports"
+GCS_IMPORT_BUCKET = "/flow_imports"
 BACKGROUND_SERVICE = "default"
 
 # Flags
 NEW_USER_NOTIFICATIONS = False
+PRELOAD_DASHBOARD = False  # Embed first-screen dashboard data in index.html
+INSTRUMENT_REQUESTS = False  # Count / time RPCs for every request, with X-Flow-Timing header (always on dev server)
+INSTRUMENT_SAMPLE_RATE = 0.0  # Otherwise, fraction of requests tracked (see common.instrumentation)
+PROFILE_SAMPLE_RATE = 0.0  # Fraction of requests run under cProfile (see common.profiling)
+PROFILE_ROUTES = []  # Always profile these, e.g. ['AnalysisAPI.get']
 
 DEFAULT_USER_SETTINGS = {
     'journals': {
@@ -185,6 +191,7 @@ class REPORT():
 
     # Ftypes
     CSV = 1
+    NDJSON = 2
 
     TYPE_LABELS = {
         HABIT_REPORT: "Habit Report",
@@ -202,4 +209,28 @@ class REPORT():
         ERROR: "Error"
     }
 
-    EXTENSIONS = {CSV: "csv"}
+    EXTENSIONS = {CSV: "csv", NDJSON: "ndjson"}
+
+
+class IMPORT():
+    # Kinds
+    READABLES = 1
+    QUOTES = 2
+
+    # Ftypes
+    JSON = 1  # One object per line, or a JSON array
+    CSV = 2  # Header row of field names
+    KINDLE = 3  # Kindle "My Clippings.txt" (quotes)
+
+    # Status
+    CREATED = 1
+    RUNNING = 2
+    DONE = 3
+    ERROR = 4
+
+    KIND_LABELS = {
+        READABLES: "Readables",
+        QUOTES: "Quotes"
+    }
+
+    EXTENSIONS = {JSON: "json", CSV: "csv", KINDLE: "txt"}
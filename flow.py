@@ -47,8 +47,11 @@ app = webapp2.WSGIApplication(
         # Admin Actions
         webapp2.Route('/admin/gauth/initialize', handler=adminActions.Init, name="aInit"),
         webapp2.Route('/admin/gauth/hacks', handler=adminActions.Hacks),
+        webapp2.Route('/admin/gauth/instrumentation', handler=adminActions.Instrumentation),
+        webapp2.Route('/admin/gauth/profiles', handler=adminActions.Profiles),
 
         # API
+        webapp2.Route('/api/dashboard', handler=api.DashboardAPI, handler_method="get", methods=["GET"]),
         webapp2.Route('/api/user/me', handler=api.UserAPI, handler_method="update_self", methods=["POST"]),
         webapp2.Route('/api/user', handler=api.UserAPI, handler_method="list", methods=["GET"]),
         webapp2.Route('/api/project/active', handler=api.ProjectAPI, handler_method="active", methods=["GET"]),
@@ -60,6 +63,7 @@ app = webapp2.WSGIApplication(
         webapp2.Route('/api/habit/range', handler=api.HabitAPI, handler_method="range", methods=["GET"]),
         webapp2.Route('/api/habit/toggle', handler=api.HabitAPI, handler_method="toggle", methods=["POST"]),
         webapp2.Route('/api/habit/commit', handler=api.HabitAPI, handler_method="commit", methods=["POST"]),
+        webapp2.Route('/api/habit/batch', handler=api.HabitAPI, handler_method="batch", methods=["POST"]),
         webapp2.Route('/api/habit', handler=api.HabitAPI, handler_method="update", methods=["POST"]),
         webapp2.Route('/api/habit/delete', handler=api.HabitAPI, handler_method="delete", methods=["POST"]),
         webapp2.Route('/api/habit/<id>', handler=api.HabitAPI, handler_method="detail", methods=["GET"]),
@@ -87,6 +91,7 @@ app = webapp2.WSGIApplication(
         webapp2.Route('/api/readable/batch', handler=api.ReadableAPI, handler_method="batch_create", methods=["POST"]),
         webapp2.Route('/api/readable/random', handler=api.ReadableAPI, handler_method="random_batch", methods=["GET"]),
         webapp2.Route('/api/readable/search', handler=api.ReadableAPI, handler_method="search", methods=["GET"]),
+        webapp2.Route('/api/readable/stats', handler=api.ReadableAPI, handler_method="stats", methods=["GET"]),
         webapp2.Route('/api/quote', handler=api.QuoteAPI, handler_method="list", methods=["GET"]),
         webapp2.Route('/api/quote', handler=api.QuoteAPI, handler_method="update", methods=["POST"]),
         webapp2.Route('/api/quote/batch', handler=api.QuoteAPI, handler_method="batch_create", methods=["POST"]),
@@ -98,8 +103,12 @@ app = webapp2.WSGIApplication(
         webapp2.Route('/api/journaltag', handler=api.JournalTagAPI, handler_method="list", methods=["GET"]),
         webapp2.Route('/api/report', handler=api.ReportAPI, handler_method="list", methods=["GET"]),
         webapp2.Route('/api/report/generate', handler=api.ReportAPI, handler_method="generate", methods=["POST"]),
+        webapp2.Route('/api/report/export', handler=api.ReportAPI, handler_method="export", methods=["GET"]),
         webapp2.Route('/api/report/serve', handler=api.ReportAPI, handler_method="serve", methods=["GET"]),
         webapp2.Route('/api/report/delete', handler=api.ReportAPI, handler_method="delete", methods=["POST"]),
+        webapp2.Route('/api/import', handler=api.ImportAPI, handler_method="list", methods=["GET"]),
+        webapp2.Route('/api/import/upload', handler=api.ImportAPI, handler_method="upload", methods=["POST"]),
+        webapp2.Route('/api/import/status', handler=api.ImportAPI, handler_method="status", methods=["GET"]),
         webapp2.Route('/api/feedback', handler=api.FeedbackAPI, handler_method="submit", methods=["POST"]),
 
         webapp2.Route('/api/auth/google_login', handler=api.AuthenticationAPI, handler_method="google_login"),
@@ -7,11 +7,12 @@ import traceback
 import webapp2
 from webapp2_extras import jinja2
 from google.appengine.api import memcache, mail
-from common import my_filters
+from common import my_filters, json_util, instrumentation, profiling
 from webapp2_extras import sessions
 from constants import SITENAME, ADMIN_EMAIL, SENDER_EMAIL
 from datetime import datetime
-import json
+import hashlib
+import tools
 
 
 class APIError(Exception):
@@ -41,14 +42,23 @@ class BaseRequestHandler(webapp2.RequestHandler):
     def render_template(self, filename, **template_args):
         self.response.write(self.jinja2.render_template(filename, **template_args))
 
-    def json_out(self, data, pretty=False, debug=False):
-        indent = 4 if pretty else None
-        _json = json.dumps(data, indent=indent)
+    def json_out(self, data, pretty=False, debug=False, stream=False):
+        '''
+        Write data as JSON. With stream, top-level lists are encoded and
+        written item by item, skipping the single encoded string. The
+        response body is still buffered (webapp2), so this isn't streamed
+        to the client and the whole body is held in memory.
+        '''
+        self.response.headers['Content-Type'] = 'application/json'
+        if stream and not pretty:
+            for chunk in json_util.iterencode(data):
+                self.response.write(chunk)
+            return
+        _json = json_util.dumps(data, pretty=pretty)
         if pretty:
             _json = "<pre>%s</pre>" % _json
         if debug:
             logging.debug(_json)
-        self.response.headers['Content-Type'] = 'application/json'
         self.response.write(_json)
 
     def handle_exception(self, exception, debug_mode):
@@ -86,15 +96,42 @@ class BaseRequestHandler(webapp2.RequestHandler):
         logging.debug([(arg, self.request.get_all(arg)) for arg in self.request.arguments()])
 
     def dispatch(self):
+        self.instrumented = instrumentation.requested()
+        if self.instrumented:
+            instrumentation.begin()
         # Get a session store for this request.
         self.session_store = sessions.get_store(request=self.request)
 
         try:
             # Dispatch the request.
-            webapp2.RequestHandler.dispatch(self)
+            if profiling.requested(self, self.route_name()):
+                profiler = profiling.run(webapp2.RequestHandler.dispatch, self)
+                raw = self.request.headers.get(profiling.HEADER) == 'raw'
+                self.response.headers['X-Flow-Profile-Id'] = profiling.save(profiler, self.route_name(), raw=raw)
+            else:
+                webapp2.RequestHandler.dispatch(self)
         finally:
             # Save all sessions.
             self.session_store.save_sessions(self.response)
+            if self.instrumented:
+                self.finish_instrumentation()
+
+    def route_name(self):
+        route = self.request.route
+        if route:
+            method = route.handler_method or self.request.method.lower()
+            return "%s.%s" % (self.__class__.__name__, method)
+        return self.request.path
+
+    def finish_instrumentation(self):
+        summary = instrumentation.end()
+        if summary:
+            route = self.route_name()
+            user = getattr(self, 'user', None)
+            if instrumentation.verbose():
+                self.response.headers['X-Flow-Timing'] = instrumentation.timing_header(summary)
+            instrumentation.log(route, user.key.id() if user else None, summary)
+            instrumentation.record(route, summary)
 
     @webapp2.cached_property
     def session(self):
@@ -119,13 +156,49 @@ class JsonRequestHandler(BaseRequestHandler):
         self.success = False
         self.message = None
 
+    @webapp2.cached_property
+    def fields(self):
+        '''
+        Optional `fields` param (comma-separated) restricting the properties
+        of serialized entities returned to the client. Entities are trimmed
+        after serialization, so this only shrinks the response.
+        '''
+        return json_util.parse_fields(self.request.get('fields'))
+
+    def not_modified(self, kinds, scope=None):
+        '''
+        Conditional GET support
+
+        Sets an ETag derived from the user's versions of the given collections
+        (kinds), the request URL and the user's local date (or scope), and
+        returns True after writing a 304 if the client's copy is current.
+        Handlers should return immediately (no datastore work) when True.
+        '''
+        from models import UserVersioned
+        if not self.user:
+            return False
+        versions = UserVersioned.Versions(self.user.key, kinds)
+        if scope is None:
+            scope = tools.iso_date(self.user.local_time())
+        seed = [self.request.path_qs, str(self.user.key.id()), scope]
+        seed.extend(["%s:%s" % (kind, versions.get(kind)) for kind in sorted(kinds)])
+        etag = hashlib.md5('|'.join(seed)).hexdigest()
+        self.response.etag = etag
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        if etag in self.request.if_none_match:
+            self.response.set_status(304)
+            return True
+        return False
+
     def set_response(self, data=None, debug=False, success=None, status=None,
-                     message=None):
+                     message=None, stream=False):
         res = {
             'success': self.success if success is None else success,
             'message': self.message if message is None else message
         }
         if data:
+            if self.fields:
+                data = json_util.select_fields(data, self.fields)
             res.update(data)
         self.response.set_status(status if status else 200)
-        self.json_out(res, debug=debug)
+        self.json_out(res, debug=debug and not stream, stream=stream)
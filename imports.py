@@ -0,0 +1,311 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Bulk imports of readables and quotes from uploaded files
+#
+# Uploads are copied to GCS (ImportAPI.upload) and parsed as a stream by
+# ImportWorker in a background task. Records are read BATCH_SIZE at a time,
+# deduped against existing entities with one get_multi per batch (readables
+# by source id, quotes by their md5 id, as when created one by one) and new
+# ones written with put_multi. After each batch the file position and
+# counters are saved, so a run continues in a new task when it nears the
+# request deadline, and re-running a batch after a failure creates nothing
+# twice.
+
+import re
+import csv
+import json
+import logging
+import traceback
+import cloudstorage as gcs
+from datetime import datetime
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+from models import Readable, Quote, ReadingStats, UserVersioned
+from constants import IMPORT, READABLE
+import tools
+
+MC_IMPORT_STATUS = "MC_IMPORT_STATUS_%s"
+BATCH_SIZE = 200
+MAX_REQUEST_SECONDS = 40*3
+UPLOAD_CHUNK_BYTES = 256 * 1024
+MAX_JSON_ARRAY_BYTES = 10 * 1024 * 1024  # JSON arrays are loaded whole, prefer one object per line
+BOM = '\xef\xbb\xbf'
+
+READABLE_FIELDS = ['source_id', 'title', 'author', 'url', 'type', 'tags', 'notes', 'excerpt',
+                   'image_url', 'read', 'favorite', 'word_count', 'dt_added', 'dt_read']
+QUOTE_FIELDS = ['source', 'content', 'location', 'link', 'tags', 'dt_added']
+
+KINDLE_SEPARATOR = "=========="
+KINDLE_DATE_FMT = "%A, %B %d, %Y %I:%M:%S %p"
+
+
+def store_upload(imp, fileobj):
+    '''
+    Copy an uploaded file to the import's GCS file in chunks
+    '''
+    imp.gcs_file = imp.gcs_filename()
+    with gcs.open(imp.gcs_file, 'w') as f:
+        while True:
+            chunk = fileobj.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            f.write(chunk)
+    return imp.gcs_file
+
+
+def parse_kindle_clipping(lines):
+    '''
+    Quote fields from the lines of one Kindle "My Clippings" entry
+
+    >>> q = parse_kindle_clipping(["Crony Beliefs (Kevin Simler)", "- Your Highlight on page 3 | Location 40-42 | Added on Monday, March 6, 2017 10:10:10 PM", "", "Beliefs hired for kickbacks."])
+    >>> sorted(q.items())
+    [('content', u'Beliefs hired for kickbacks.'), ('dt_added', datetime.datetime(2017, 3, 6, 22, 10, 10)), ('location', u'Location 40-42'), ('source', u'Crony Beliefs (Kevin Simler)')]
+    >>> parse_kindle_clipping(["Book (Author)", "- Your Bookmark on Location 80 | Added on Monday, March 6, 2017 10:10:10 PM", ""])
+    '''
+    lines = [line.replace(BOM, '').decode('utf-8') if isinstance(line, str) else line for line in lines]
+    lines = [line.strip() for line in lines if line.strip()]
+    if len(lines) < 3:
+        return None  # Bookmarks (no content) or malformed
+    source, meta, content = lines[0], lines[1], ' '.join(lines[2:])
+    location = None
+    m = re.search(r'(Location|location|page) ([\w-]+)', meta)
+    if m:
+        m_loc = re.search(r'[Ll]ocation ([\w-]+)', meta)
+        location = u"Location %s" % m_loc.group(1) if m_loc else u"Page %s" % m.group(2)
+    dt_added = None
+    m = re.search(r'Added on (.*)$', meta)
+    if m:
+        try:
+            dt_added = datetime.strptime(m.group(1).strip(), KINDLE_DATE_FMT)
+        except ValueError:
+            pass
+    return {
+        'source': source,
+        'content': content,
+        'location': location,
+        'dt_added': dt_added
+    }
+
+
+def _to_list(value):
+    if isinstance(value, basestring):
+        value = re.split(r'[;,]', value)
+    return [v.strip().lower() for v in (value or []) if v and v.strip()]
+
+
+def _to_bool(value):
+    if isinstance(value, basestring):
+        return value.strip().lower() in ['1', 'true', 'yes', 'y']
+    return bool(value)
+
+
+def _to_dt(value):
+    if isinstance(value, basestring) and value:
+        return tools.fromISODate(value[:10])
+    return value if isinstance(value, datetime) else None
+
+
+class ImportWorker(object):
+
+    def __init__(self, imp):
+        self.imp = imp
+        self.user = imp.key.parent().get()
+        self.counters = imp.get_counters() or {
+            'read': 0,
+            'created': 0,
+            'duplicates': 0,
+            'invalid': 0,
+            'batches': 0,
+            'continuations': 0
+        }
+        self.sources = {}  # Quote readable resolutions (see Quote.lookup_readable)
+        self.worker_start = tools.unixtime()
+        self.progress_mckey = MC_IMPORT_STATUS % imp.key
+
+    def run(self):
+        '''
+        Process the file from the saved position until done or near the
+        request deadline
+
+        Returns:
+            bool: done (False if a continuation is needed)
+        '''
+        self.imp.status = IMPORT.RUNNING
+        try:
+            f = gcs.open(self.imp.gcs_file)
+            try:
+                done = self.process(f)
+            finally:
+                f.close()
+        except Exception, e:
+            traceback.print_exc()
+            logging.error("Import error: %s" % e)
+            self.imp.status = IMPORT.ERROR
+            self.imp.error = str(e)
+            self.save()
+            return True
+        if done:
+            self.imp.status = IMPORT.DONE
+            self.imp.dt_done = datetime.now()
+            logging.debug("Import finished. Counters: %s" % self.counters)
+        else:
+            self.counters['continuations'] += 1
+        self.save()
+        return done
+
+    def process(self, f):
+        batch = []
+        for record, position in self.records(f):
+            batch.append(record)
+            if len(batch) >= BATCH_SIZE:
+                self.write(batch)
+                batch = []
+                self.imp.position = position
+                self.save()
+                elapsed = (tools.unixtime() - self.worker_start) / 1000
+                if elapsed >= MAX_REQUEST_SECONDS:
+                    logging.debug("Elapsed %ss, continuing in next task" % elapsed)
+                    return False
+        if batch:
+            self.write(batch)
+        return True
+
+    def records(self, f):
+        '''
+        Yields (record dict or None if unparseable, position after record)
+        '''
+        if self.imp.ftype == IMPORT.CSV:
+            return self._csv_records(f)
+        elif self.imp.ftype == IMPORT.KINDLE:
+            return self._kindle_records(f)
+        else:
+            return self._json_records(f)
+
+    def _json_records(self, f):
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first == '[':
+            # Array: loaded whole, position counts items
+            f.seek(0)
+            content = f.read(MAX_JSON_ARRAY_BYTES + 1)
+            if len(content) > MAX_JSON_ARRAY_BYTES:
+                raise ValueError("JSON array too large, upload one object per line")
+            items = json.loads(content)
+            for i in range(self.imp.position, len(items)):
+                yield (items[i] if isinstance(items[i], dict) else None, i + 1)
+            return
+        f.seek(self.imp.position)
+        for line in iter(f.readline, ''):
+            line = line.strip()
+            if line:
+                try:
+                    record = json.loads(line.replace(BOM, ''))
+                except ValueError:
+                    record = None
+                yield (record if isinstance(record, dict) else None, f.tell())
+
+    def _csv_records(self, f):
+        f.seek(0)
+        header = csv.reader([f.readline().replace(BOM, '')]).next()
+        columns = [c.strip().lower() for c in header]
+        if self.imp.position > f.tell():
+            f.seek(self.imp.position)
+        for row in csv.reader(iter(f.readline, '')):
+            if row:
+                values = [v.decode('utf-8') for v in row]
+                yield (dict((c, v) for c, v in zip(columns, values) if v != ''), f.tell())
+
+    def _kindle_records(self, f):
+        f.seek(self.imp.position)
+        lines = []
+        for line in iter(f.readline, ''):
+            if line.strip() == KINDLE_SEPARATOR:
+                yield (parse_kindle_clipping(lines), f.tell())
+                lines = []
+            else:
+                lines.append(line)
+        if [line for line in lines if line.strip()]:
+            yield (parse_kindle_clipping(lines), f.tell())
+
+    def write(self, records):
+        '''
+        Write new entities for a batch of records, skipping duplicates
+        (within the batch or already stored)
+        '''
+        self.counters['read'] += len(records)
+        self.counters['batches'] += 1
+        if self.imp.kind == IMPORT.READABLES:
+            model, build = Readable, self._readable
+        else:
+            model, build = Quote, self._quote
+        entities = {}
+        for record in records:
+            entity = build(record) if record else None
+            if not entity:
+                self.counters['invalid'] += 1
+            elif entity.key in entities:
+                self.counters['duplicates'] += 1
+            else:
+                entities[entity.key] = entity
+        keys = entities.keys()
+        existing = [key for key, e in zip(keys, ndb.get_multi(keys)) if e]
+        for key in existing:
+            del entities[key]
+        self.counters['duplicates'] += len(existing)
+        new = entities.values()
+        if new:
+            if model is Readable:
+                ReadingStats.Write(self.user, new)
+            else:
+                UserVersioned.PutMulti(new)
+            model.put_sd_batch(new)
+        self.counters['created'] += len(new)
+
+    def _readable(self, record):
+        fields = dict((f, record.get(f)) for f in READABLE_FIELDS if record.get(f) not in [None, ''])
+        if isinstance(fields.get('type'), basestring):
+            fields['type'] = READABLE.LOOKUP.get(fields['type'].lower(), READABLE.ARTICLE)
+        if 'tags' in fields:
+            fields['tags'] = _to_list(fields['tags'])
+        for prop in ['read', 'favorite']:
+            if prop in fields:
+                fields[prop] = _to_bool(fields[prop])
+        if 'word_count' in fields:
+            fields['word_count'] = tools.safe_number(fields['word_count'], integer=True) or 0
+        for prop in ['dt_added', 'dt_read']:
+            if prop in fields:
+                fields[prop] = _to_dt(fields[prop])
+        if 'source_id' in fields:
+            fields['source_id'] = unicode(fields['source_id'])
+        id_props = Readable._Props(fields.pop('source_id', None), source=self.imp.source, **fields)
+        if id_props:
+            id, props = id_props
+            r = Readable(id=id, parent=self.user.key, **props)
+            r.generate_slug()
+            r.has_notes = bool(r.notes)
+            return r
+
+    def _quote(self, record):
+        fields = dict((f, record.get(f)) for f in QUOTE_FIELDS if record.get(f) not in [None, ''])
+        if 'dt_added' in fields:
+            fields['dt_added'] = _to_dt(fields['dt_added'])
+        q = Quote.Create(self.user, sources=self.sources,
+                         source=fields.get('source'), content=fields.get('content'),
+                         location=fields.get('location'), dt_added=fields.get('dt_added'))
+        if q:
+            q.link = fields.get('link')
+            if 'tags' in fields:
+                q.tags = _to_list(fields['tags'])
+        return q
+
+    def save(self):
+        self.imp.set_counters(self.counters)
+        self.imp.put()
+        memcache.set(self.progress_mckey, {
+            'val': self.counters['read'],
+            'status': self.imp.status,
+            'counters': self.counters,
+            'error': self.imp.error
+        })
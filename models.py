@@ -3,8 +3,8 @@
 
 from datetime import datetime, timedelta, time
 from google.appengine.ext import ndb
-from google.appengine.api import mail, search
-from constants import EVENT, USER, TASK, READABLE, JOURNALTAG, REPORT, NEW_USER_NOTIFICATIONS, HABIT
+from google.appengine.api import mail, search, memcache
+from constants import EVENT, USER, TASK, READABLE, JOURNALTAG, REPORT, NEW_USER_NOTIFICATIONS, HABIT, IMPORT
 import tools
 import json
 import random
@@ -12,6 +12,8 @@ import logging
 import re
 import imp
 import hashlib
+import math
+import threading
 from common.decorators import auto_cache
 try:
     imp.find_module('secrets', ['settings'])
@@ -44,6 +46,83 @@ class UserAccessible(ndb.Model):
         return self.key.parent() == user.key
 
 
+class UserVersioned(UserAccessible):
+    '''
+    Parent class for items whose collection version is tracked per user
+    Version is bumped on every put/delete, and used to answer conditional GETs
+    without querying the collection
+    '''
+    VERSION_MCK = "user:%s:collection:%s:version"
+    _batch = threading.local()  # Collections written during PutMulti
+
+    def _post_put_hook(self, future):
+        UserVersioned.BumpVersion(self.key.parent(), self._get_kind())
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        UserVersioned.BumpVersion(key.parent(), key.kind())
+
+    @staticmethod
+    def BumpVersion(user_key, kind):
+        '''
+        In a transaction, bumps once per collection after it commits, and
+        within PutMulti once per collection after the batch is written
+        '''
+        if not user_key:
+            return
+        mck = UserVersioned.VERSION_MCK % (user_key.id(), kind)
+        if ndb.in_transaction():
+            ctx = ndb.get_context()
+            pending = getattr(ctx, 'pending_versions', None)
+            if pending is None:
+                pending = ctx.pending_versions = set()
+                ctx.call_on_commit(lambda: UserVersioned._Bump(pending))
+            pending.add(mck)
+        elif getattr(UserVersioned._batch, 'pending', None) is not None:
+            UserVersioned._batch.pending.add(mck)
+        else:
+            UserVersioned._Bump([mck])
+
+    @staticmethod
+    def _Bump(mcks):
+        if mcks:
+            memcache.offset_multi(dict((mck, 1) for mck in mcks), initial_value=tools.unixtime())
+
+    @staticmethod
+    def PutMulti(entities):
+        '''
+        ndb.put_multi, with one version bump (memcache RPC) for all
+        collections written
+        '''
+        UserVersioned._batch.pending = set()
+        try:
+            keys = ndb.put_multi(entities)
+        finally:
+            pending = UserVersioned._batch.pending
+            UserVersioned._batch.pending = None
+        UserVersioned._Bump(pending)
+        return keys
+
+    @staticmethod
+    def Versions(user_key, kinds):
+        '''
+        Returns dict kind -> current version
+
+        Versions missing from memcache (never written, or evicted) are
+        initialized to the current timestamp, so a stale client copy can't match
+        '''
+        lookup = dict((UserVersioned.VERSION_MCK % (user_key.id(), kind), kind) for kind in kinds)
+        versions = memcache.get_multi(lookup.keys())
+        missing = dict((mck, tools.unixtime()) for mck in lookup if mck not in versions)
+        if missing:
+            not_added = memcache.add_multi(missing)
+            versions.update(missing)
+            if not_added:
+                # Initialized concurrently
+                versions.update(memcache.get_multi(not_added))
+        return dict((kind, versions.get(mck)) for mck, kind in lookup.items())
+
+
 class UserSearchable(UserAccessible):
     '''
     Parent class for items that can be searched via FTS
@@ -127,6 +206,93 @@ class UserSearchable(UserAccessible):
         return (success, message, items)
 
 
+class UserSampleable(UserSearchable):
+    '''
+    Parent class for items drawn in random samples
+
+    Each item stores a uniform random value (rand, set on first put) so a
+    sample is a few short indexed queries from random starting points,
+    whatever the collection size. Items put before rand existed are only
+    reached by the keys query fallback until the backfill_rand hack runs.
+    '''
+    rand = ndb.FloatProperty()
+
+    SAMPLE_SEGMENTS = 5  # Random starting points per sample
+    SAMPLE_OVERSAMPLE = 3  # Candidates per item for recency-weighted samples
+    SAMPLE_FALLBACK_LIMIT = 500  # Keys read when the rand index comes up short
+
+    def _pre_put_hook(self):
+        if self.rand is None:
+            self.rand = random.random()
+
+    @classmethod
+    def Sample(cls, user, n=50, half_life_days=None, **filters):
+        '''
+        Random sample of the user's items
+
+        Args:
+            n (int): sample size
+            half_life_days (int): weigh by recency (dt_added), an item this
+                many days old being half as likely as a new one. Uniform if
+                not set.
+            filters: equality filters on indexed properties, e.g.
+                has_notes=True (each needs a composite index with rand)
+
+        Returns:
+            list of items (up to n)
+        '''
+        q = cls.query(ancestor=user.key)
+        for prop, value in filters.items():
+            q = q.filter(getattr(cls, prop) == value)
+        n_fetch = n * cls.SAMPLE_OVERSAMPLE if half_life_days else n
+        segments = min(cls.SAMPLE_SEGMENTS, n_fetch)
+        per_segment = int(math.ceil(n_fetch / float(segments)))
+        pivots = [random.random() for i in range(segments)]
+        futures = [q.filter(cls.rand >= pivot).order(cls.rand).fetch_async(per_segment)
+                   for pivot in pivots]
+        items = {}
+        for future in futures:
+            for item in future.get_result():
+                items[item.key] = item
+        if len(items) < n_fetch:
+            # Segments ran past the end of the rand range, wrap around
+            for item in q.order(cls.rand).fetch(n_fetch):
+                items[item.key] = item
+        if len(items) < n_fetch:
+            # Items without rand (not yet backfilled) aren't in the rand
+            # index, top up from a plain keys query
+            keys = [key for key in q.fetch(cls.SAMPLE_FALLBACK_LIMIT, keys_only=True) if key not in items]
+            keys = random.sample(keys, min(len(keys), n_fetch - len(items)))
+            for item in ndb.get_multi(keys):
+                if item:
+                    items[item.key] = item
+        items = items.values()
+        if half_life_days:
+            items = cls._WeighByRecency(items, n, half_life_days)
+        random.shuffle(items)
+        return items[:n]
+
+    @staticmethod
+    def _WeighByRecency(items, n, half_life_days):
+        '''
+        Rejection sampling: keep each candidate with probability halving
+        every half_life_days of age, topped up with the newest rejected
+        '''
+        now = datetime.now()
+        kept = []
+        rejected = []
+        for item in items:
+            age_days = (now - item.dt_added).days if item.dt_added else 0
+            if random.random() < 0.5 ** (max(age_days, 0) / float(half_life_days)):
+                kept.append(item)
+            else:
+                rejected.append(item)
+        if len(kept) < n:
+            rejected.sort(key=lambda item: item.dt_added, reverse=True)
+            kept.extend(rejected[:n - len(kept)])
+        return kept
+
+
 class User(ndb.Model):
     """
     Key - ID
@@ -149,6 +315,8 @@ class User(ndb.Model):
     fb_id = ndb.StringProperty()
     evernote_id = ndb.StringProperty()
 
+    EVERNOTE_MCK = "evernote:%s:user"
+
     def __str__(self):
         parts = [x for x in [self.name, self.email] if x]
         return ' - '.join(parts)
@@ -181,6 +349,22 @@ class User(ndb.Model):
         u = User.query().filter(User.g_id == id).get()
         return u
 
+    @staticmethod
+    def GetByEvernoteId(evernote_id):
+        '''
+        User for an Evernote user id, via a cached evernote_id -> user id map
+        '''
+        mck = User.EVERNOTE_MCK % evernote_id
+        user_id = memcache.get(mck)
+        if user_id:
+            user = User.get_by_id(user_id)
+            if user and user.evernote_id == evernote_id:
+                return user
+        user = User.query().filter(User.evernote_id == evernote_id).get()
+        if user:
+            memcache.set(mck, user.key.id())
+        return user
+
     @staticmethod
     def SyncActive(sync_integration_id, limit=100):
         multi = type(sync_integration_id) is list
@@ -320,7 +504,7 @@ class User(ndb.Model):
             return loaded.get('user_id')
 
 
-class Project(UserAccessible):
+class Project(UserVersioned):
     """
     Ongoing projects with links
 
@@ -359,7 +543,11 @@ class Project(UserAccessible):
 
     @staticmethod
     def Active(user):
-        return Project.query(ancestor=user.key).filter(Project.archived == False).order(Project.starred).order(-Project.dt_created).fetch(limit=20)
+        return Project.ActiveAsync(user).get_result()
+
+    @staticmethod
+    def ActiveAsync(user):
+        return Project.query(ancestor=user.key).filter(Project.archived == False).order(Project.starred).order(-Project.dt_created).fetch_async(limit=20)
 
     @staticmethod
     def Fetch(user):
@@ -412,7 +600,7 @@ class Project(UserAccessible):
         return self.progress == 10
 
 
-class Task(UserAccessible):
+class Task(UserVersioned):
     """
     Tasks (currently not linked with projects)
     For tracking daily 'top tasks'
@@ -467,17 +655,23 @@ class Task(UserAccessible):
 
     @staticmethod
     def Recent(user, limit=10, offset=0, with_archived=False, project_id=None, prefetch=None):
+        return Task.RecentAsync(user, limit=limit, offset=offset, with_archived=with_archived,
+                                project_id=project_id, prefetch=prefetch).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def RecentAsync(user, limit=10, offset=0, with_archived=False, project_id=None, prefetch=None):
         q = Task.query(ancestor=user.key).order(-Task.dt_created)
         if not with_archived:
             q = q.filter(Task.archived == False)
         if project_id:
             q = q.filter(Task.project == ndb.Key('User', user.key.id(), 'Project', project_id))
-        tasks = q.fetch(limit=limit, offset=offset)
+        tasks = yield q.fetch_async(limit=limit, offset=offset)
         if prefetch:
             for t in tasks:
                 if 'project' in prefetch and t.project:
                     t.project.get_async()
-        return tasks
+        raise ndb.Return(tasks)
 
     @staticmethod
     def DueInRange(user, start, end, limit=100):
@@ -562,7 +756,7 @@ class Task(UserAccessible):
         self.wip = False
 
 
-class Habit(UserAccessible):
+class Habit(UserVersioned):
     """
     Key - ID
     """
@@ -573,8 +767,20 @@ class Habit(UserAccessible):
     tgt_weekly = ndb.IntegerProperty(indexed=False)
     archived = ndb.BooleanProperty(default=False)
     icon = ndb.TextProperty()
+    # Counters maintained by HabitDay toggles (see update_counters)
+    last_done = ndb.DateProperty(indexed=False)
+    streak_start = ndb.DateProperty(indexed=False)  # First day of streak ending last_done
+    streak_longest = ndb.IntegerProperty(indexed=False, default=0)
+    streak_longest_start = ndb.DateProperty(indexed=False)
+    done_week = ndb.IntegerProperty(indexed=False, default=0)
+    week_of = ndb.DateProperty(indexed=False)  # Monday of week counted in done_week
+    done_month = ndb.IntegerProperty(indexed=False, default=0)
+    month_of = ndb.DateProperty(indexed=False)  # First day of month counted in done_month
+
+    COUNTER_WINDOW_DAYS = 35  # Covers the current week and month
 
     def json(self):
+        today = self.local_today()
         return {
             'id': self.key.id(),
             'ts_created': tools.unixtime(self.dt_created),
@@ -583,19 +789,164 @@ class Habit(UserAccessible):
             'color': self.color,
             'archived': self.archived,
             'tgt_weekly': self.tgt_weekly,
-            'icon': self.icon
+            'icon': self.icon,
+            'streak': self.current_streak(today),
+            'streak_longest': self.streak_longest,
+            'done_week': self.done_this_week(today),
+            'done_month': self.done_this_month(today),
+            'last_done': tools.iso_date(self.last_done)
         }
 
+    def local_today(self):
+        '''
+        Today in the owner's timezone, as habit days are local dates
+        '''
+        user = self.key.parent().get()
+        return (user.local_time() if user else datetime.now()).date()
+
+    def current_streak(self, today=None):
+        '''
+        Streak is current if last done today or yesterday
+        '''
+        if not today:
+            today = self.local_today()
+        if self.last_done and self.streak_start and self.last_done >= today - timedelta(days=1):
+            return (self.last_done - self.streak_start).days + 1
+        return 0
+
+    def done_this_week(self, today=None):
+        if not today:
+            today = self.local_today()
+        monday = today - timedelta(days=today.weekday())
+        return self.done_week if self.week_of == monday else 0
+
+    def done_this_month(self, today=None):
+        if not today:
+            today = self.local_today()
+        return self.done_month if self.month_of == today.replace(day=1) else 0
+
+    def update_counters(self, changed, today=None, full=False):
+        '''
+        Recompute streak, week and month counters from recent habit days.
+        Call in the transaction that writes the changed days.
+
+        Reads the keys of done days in the COUNTER_WINDOW_DAYS ending today
+        (the owner's local date). The habit's full history (keys) is read only when the window can't settle the counters: a change
+        outside it, an undo inside the longest streak, a newly done day in
+        a run reaching past the window, or undoing the last done day with
+        nothing else done in the window.
+
+        Args:
+            changed (list of HabitDay()): days just modified (possibly
+                unsaved), taking precedence over stored entities
+            full (bool): always read the full history (backfill)
+        '''
+        if not today:
+            today = self.local_today()
+        window_start = today - timedelta(days=Habit.COUNTER_WINDOW_DAYS - 1)
+        q = HabitDay.query(ancestor=self.key.parent()).filter(HabitDay.habit == self.key, HabitDay.done == True)
+
+        def done_dates(keys):
+            # Stored done days, with the changed days taking precedence
+            dates = set(HabitDay.DateOf(key) for key in keys)
+            for hd in changed:
+                if hd.done:
+                    dates.add(tools.to_date(hd.date))
+                else:
+                    dates.discard(tools.to_date(hd.date))
+            return dates
+
+        window_q = q.filter(HabitDay.date >= window_start, HabitDay.date <= today)
+        window_done = set(day for day in done_dates(window_q.fetch(Habit.COUNTER_WINDOW_DAYS, keys_only=True))
+                          if window_start <= day <= today)
+        done = window_done
+        # Current streak ends today, or yesterday if today isn't done yet
+        streak_end = today if today in done else today - timedelta(days=1)
+
+        def run_start(day):
+            while day - timedelta(days=1) in done:
+                day -= timedelta(days=1)
+            if day == window_start and not full and self.streak_start and self.streak_start < window_start:
+                # Run reaches past the window, only known for the current streak
+                return self.streak_start if run_end(day) == streak_end else None
+            return day if day > window_start or full else None
+
+        def run_end(day):
+            while day + timedelta(days=1) in done:
+                day += timedelta(days=1)
+            return day
+
+        longest_end = None
+        if self.streak_longest and self.streak_longest_start:
+            longest_end = self.streak_longest_start + timedelta(days=self.streak_longest - 1)
+        if not full:
+            full = bool(not window_done and self.last_done and self.last_done >= window_start)
+            full = full or (streak_end in done and run_start(streak_end) is None)
+        for hd in changed:
+            day = tools.to_date(hd.date)
+            if full:
+                break
+            if not window_start <= day <= today:
+                full = True
+            elif not hd.done:
+                full = bool(self.streak_longest) and (not longest_end or self.streak_longest_start <= day <= longest_end)
+            else:
+                full = run_start(day) is None
+        if full:
+            done = done_dates(q.iter(keys_only=True))
+            self.streak_longest, self.streak_longest_start = 0, None
+            self.last_done = max(done) if done else None
+        elif window_done:
+            self.last_done = max(window_done)
+
+        # Longest streak over runs with newly done days (every run on a full read)
+        if full:
+            starts = set(day for day in done if day - timedelta(days=1) not in done)
+        else:
+            starts = set(run_start(tools.to_date(hd.date)) for hd in changed if hd.done)
+        for start in sorted(starts):
+            length = (run_end(start if full else max(start, window_start)) - start).days + 1
+            if length > (self.streak_longest or 0):
+                self.streak_longest, self.streak_longest_start = length, start
+
+        if streak_end in done:
+            self.streak_start = run_start(streak_end)
+            length = (streak_end - self.streak_start).days + 1
+            if length >= (self.streak_longest or 0):
+                self.streak_longest, self.streak_longest_start = length, self.streak_start
+        else:
+            self.streak_start = None
+        self.week_of = today - timedelta(days=today.weekday())
+        self.done_week = len([d for d in window_done if d >= self.week_of])
+        self.month_of = today.replace(day=1)
+        self.done_month = len([d for d in window_done if d >= self.month_of])
+
     def slug_name(self):
         return tools.strip_symbols(self.name.replace(' ','')).lower().strip()
 
+    @staticmethod
+    @ndb.transactional()
+    def Recount(habit_key):
+        '''
+        Recompute counters from the habit's full history
+        '''
+        habit = habit_key.get()
+        if habit:
+            habit.update_counters([], full=True)
+            habit.put()
+        return habit
+
     @staticmethod
     def All(user):
         return Habit.query(ancestor=user.key).fetch(limit=20)
 
     @staticmethod
     def Active(user):
-        return Habit.query(ancestor=user.key).filter(Habit.archived == False).fetch(limit=HABIT.ACTIVE_LIMIT)
+        return Habit.ActiveAsync(user).get_result()
+
+    @staticmethod
+    def ActiveAsync(user):
+        return Habit.query(ancestor=user.key).filter(Habit.archived == False).fetch_async(limit=HABIT.ACTIVE_LIMIT)
 
     @staticmethod
     def Create(user):
@@ -616,10 +967,16 @@ class Habit(UserAccessible):
             self.tgt_weekly = params.get('tgt_weekly')
 
 
-class HabitDay(UserAccessible):
+class HabitDay(UserVersioned):
     """
     Key - ID: habit:[habit_id]_day:[iso_date]
     """
+    BATCH_SIZE = 500  # Max entities per put_multi
+    BATCH_OPS = ['toggle', 'commit']
+    FILL_MCK = "user:%s:habitday:fill"  # Observed fraction of habit-days with an entity
+    DEFAULT_FILL = 0.5
+    QUERY_OVERHEAD = 20  # Query cost vs key gets, in entity reads
+
     dt_created = ndb.DateTimeProperty(auto_now_add=True)
     dt_updated = ndb.DateTimeProperty(auto_now_add=True)
     habit = ndb.KeyProperty(Habit)
@@ -638,35 +995,70 @@ class HabitDay(UserAccessible):
         }
 
     @staticmethod
-    def Range(user, habits, since_date, until_date=None):
+    def Range(user, habits, since_date, until_date=None, keyed=False):
         '''
         Fetch habit days for specified habits in date range
 
         Args:
             habits (list of Habit() objects)
+            keyed (bool): return dict keyed by (habit id, iso date)
             ...
 
         Returns:
             list: HabitDay() ordered sequentially
 
         '''
-        today = datetime.today()
+        return HabitDay.RangeAsync(user, habits, since_date, until_date=until_date, keyed=keyed).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def RangeAsync(user, habits, since_date, until_date=None, keyed=False):
+        '''
+        Reads either every (habit, day) key, or runs an ancestor query on
+        habit and date, whichever the cost model says reads fewer entities:
+        a key get pays for missing days too, a query only for the days that
+        exist (estimated from the user's observed fill ratio) plus overhead
+        for each habit (IN runs one query per value).
+        '''
         if not until_date:
-            until_date = today
-        cursor = since_date
-        ids = []
-        while cursor <= until_date:
-            for h in habits:
-                ids.append(ndb.Key('HabitDay', HabitDay.ID(h, cursor), parent=user.key))
-            cursor += timedelta(days=1)
-        if ids:
-            return [hd for hd in ndb.get_multi(ids) if hd]
-        return []
+            until_date = datetime.today()
+        n_days = (until_date - since_date).days + 1 if since_date <= until_date else 0
+        n_keys = n_days * len(habits)
+        habitdays = []
+        if n_keys:
+            ctx = ndb.get_context()
+            fill_mck = HabitDay.FILL_MCK % user.key.id()
+            fill = yield ctx.memcache_get(fill_mck)
+            if fill is None:
+                fill = HabitDay.DEFAULT_FILL
+            dates = [since_date + timedelta(days=i) for i in range(n_days)]
+            if HabitDay.QUERY_OVERHEAD * len(habits) + fill * n_keys < n_keys:
+                q = HabitDay.query(ancestor=user.key).filter(HabitDay.habit.IN([h.key for h in habits]))
+                q = q.filter(HabitDay.date >= tools.to_date(dates[0]))
+                q = q.filter(HabitDay.date <= tools.to_date(dates[-1])).order(HabitDay.date)
+                habitdays = yield q.fetch_async(limit=n_keys)
+            else:
+                iso_dates = [tools.iso_date(date) for date in dates]
+                habit_ids = [h.key.id() for h in habits]
+                ids = [ndb.Key('HabitDay', "habit:%s_day:%s" % (hid, iso_date), parent=user.key)
+                       for iso_date in iso_dates for hid in habit_ids]
+                results = yield ndb.get_multi_async(ids)
+                habitdays = [hd for hd in results if hd]
+            # Smooth observed fill so one odd range doesn't flip the strategy
+            observed = len(habitdays) / float(n_keys)
+            yield ctx.memcache_set(fill_mck, round((fill + observed) / 2., 3))
+        if keyed:
+            raise ndb.Return(dict(((hd.habit.id(), tools.iso_date(hd.date)), hd) for hd in habitdays))
+        raise ndb.Return(habitdays)
 
     @staticmethod
     def ID(habit, date):
         return "habit:%s_day:%s" % (habit.key.id(), tools.iso_date(date))
 
+    @staticmethod
+    def DateOf(key):
+        return tools.fromISODate(key.id().rsplit('_day:', 1)[1]).date()
+
     @staticmethod
     def Create(user, habit, date):
         id = HabitDay.ID(habit, date)
@@ -678,31 +1070,100 @@ class HabitDay(UserAccessible):
         self.dt_updated = datetime.now()
 
     @staticmethod
+    @ndb.transactional()
     def Toggle(habit, date, force_done=False):
-        id = HabitDay.ID(habit, date)
-        hd = HabitDay.get_or_insert(id,
-                                    habit=habit.key,
-                                    date=date,
-                                    parent=habit.key.parent())
+        '''
+        Toggle done, updating the habit's counters in the same transaction
+        '''
+        hd = HabitDay._GetOrCreate(habit, date)
         if not force_done or not hd.done:
             # If force_done, only toggle if not done
             hd.toggle()
-        hd.put()
+        habit = habit.key.get()
+        habit.update_counters([hd])
+        ndb.put_multi([hd, habit])
         return (hd.done, hd)
 
     @staticmethod
+    @ndb.transactional()
     def Commit(habit, date=None):
         if not date:
             date = datetime.today()
-        id = HabitDay.ID(habit, date)
-        hd = HabitDay.get_or_insert(id,
-                                    habit=habit.key,
-                                    date=date,
-                                    parent=habit.key.parent())
-        hd.commit()
+        hd = HabitDay._GetOrCreate(habit, date)
+        hd.commit()  # Done status unchanged, so no counter updates
         hd.put()
         return hd
 
+    @staticmethod
+    def _GetOrCreate(habit, date):
+        # Within a transaction (get_or_insert can't nest)
+        id = HabitDay.ID(habit, date)
+        hd = HabitDay.get_by_id(id, parent=habit.key.parent())
+        if not hd:
+            hd = HabitDay(id=id, habit=habit.key, date=date, parent=habit.key.parent())
+        return hd
+
+    @staticmethod
+    def ApplyBatch(ops):
+        '''
+        Apply a list of toggle / commit operations in bulk
+
+        Ops are applied in order, so repeated ops on the same day compose as
+        the equivalent sequence of single calls would. All ops must be for
+        one user's habits (a single entity group). Days are fetched and
+        written with one get_multi + put_multi per transaction, chunked by
+        distinct day to stay within datastore batch limits.
+
+        Args:
+            ops (list of tuples): (Habit(), date, op), op in HabitDay.BATCH_OPS
+
+        Returns:
+            list: updated HabitDay() objects (one per distinct day)
+        '''
+        chunk_ops = []
+        chunk_of = {}  # HabitDay ID -> index in chunk_ops
+        for habit, date, op in ops:
+            id = HabitDay.ID(habit, date)
+            if id not in chunk_of:
+                chunk_of[id] = len(chunk_of) / HabitDay.BATCH_SIZE
+                if chunk_of[id] == len(chunk_ops):
+                    chunk_ops.append([])
+            chunk_ops[chunk_of[id]].append((habit, date, op))
+        habitdays = []
+        for chunk in chunk_ops:
+            habitdays.extend(HabitDay._apply_ops(chunk))
+        return habitdays
+
+    @staticmethod
+    @ndb.transactional()
+    def _apply_ops(ops):
+        # Single entity group
+        parent = ops[0][0].key.parent()
+        keys = []
+        seen = set()
+        for habit, date, op in ops:
+            key = ndb.Key('HabitDay', HabitDay.ID(habit, date), parent=parent)
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+        lookup = dict((key.id(), hd) for key, hd in zip(keys, ndb.get_multi(keys)) if hd)
+        for habit, date, op in ops:
+            id = HabitDay.ID(habit, date)
+            hd = lookup.get(id)
+            if not hd:
+                hd = lookup[id] = HabitDay(id=id, habit=habit.key, date=date, parent=parent)
+            if op == 'toggle':
+                hd.toggle()
+            elif op == 'commit':
+                hd.commit()
+        habitdays = [lookup[key.id()] for key in keys]
+        habits = ndb.get_multi(list(set(hd.habit for hd in habitdays)))
+        for habit in habits:
+            if habit:
+                habit.update_counters([hd for hd in habitdays if hd.habit == habit.key])
+        ndb.put_multi(habitdays + [h for h in habits if h])
+        return habitdays
+
     def toggle(self):
         self.dt_updated = datetime.now()
         self.done = not self.done
@@ -722,18 +1183,99 @@ class JournalTag(UserAccessible):
     dt_added = ndb.DateTimeProperty(auto_now_add=True)
     name = ndb.TextProperty()
     type = ndb.IntegerProperty(default=JOURNALTAG.PERSON)
+    # Usage, updated as journals are tagged (see record_use)
+    count = ndb.IntegerProperty(default=0)
+    first_used = ndb.DateProperty(indexed=False)
+    last_used = ndb.DateProperty(indexed=False)
+    recent_dates = ndb.DateProperty(repeated=True, indexed=False)  # Use dates within RECENT_DAYS
+
+    RECENT_DAYS = 90
 
     def json(self):
         return {
             'id': self.key.id(),
             'name': self.name,
-            'type': self.type
+            'type': self.type,
+            'count': self.count,
+            'first_used': tools.iso_date(self.first_used),
+            'last_used': tools.iso_date(self.last_used),
+            'recent_count': self.recent_count()
         }
 
     @staticmethod
     def All(user, limit=400):
         return JournalTag.query(ancestor=user.key).fetch(limit=limit)
 
+    @staticmethod
+    def Frequent(user, limit=100, cursor=None):
+        '''
+        Tags most used first
+
+        Tags put before count existed are missing from its index until the
+        backfill_journaltag_counts hack runs.
+
+        Returns:
+            tuple: (list of JournalTag(), next cursor, more)
+        '''
+        q = JournalTag.query(ancestor=user.key).order(-JournalTag.count)
+        return q.fetch_page(limit, start_cursor=cursor)
+
+    def recent_count(self, today=None):
+        if not today:
+            today = datetime.today().date()
+        since = today - timedelta(days=JournalTag.RECENT_DAYS)
+        return len([d for d in self.recent_dates if d > since])
+
+    def record_use(self, date, today=None):
+        '''
+        Count one (newly tagged) journal on date
+        '''
+        date = tools.to_date(date)
+        if not today:
+            today = datetime.today().date()
+        self.count = (self.count or 0) + 1
+        if not self.first_used or date < self.first_used:
+            self.first_used = date
+        if not self.last_used or date > self.last_used:
+            self.last_used = date
+        since = today - timedelta(days=JournalTag.RECENT_DAYS)
+        self.recent_dates = sorted(d for d in self.recent_dates + [date] if d > since)
+
+    @staticmethod
+    @ndb.transactional()
+    def Recount(user_key):
+        '''
+        Recompute all of a user's tag counters from their journals, in one
+        transaction so concurrent uses (RecordUses) aren't overwritten
+
+        Returns:
+            int: number of tags
+        '''
+        tags = dict((tag.key, tag) for tag in JournalTag.query(ancestor=user_key).fetch())
+        for tag in tags.values():
+            tag.count = 0
+            tag.first_used = tag.last_used = None
+            tag.recent_dates = []
+        for jrnl in MiniJournal.query(ancestor=user_key).iter():
+            for tag_key in set(jrnl.tags):
+                if tag_key in tags:
+                    tags[tag_key].record_use(jrnl.date)
+        ndb.put_multi(tags.values())
+        return len(tags)
+
+    @staticmethod
+    @ndb.transactional()
+    def RecordUses(tags, date):
+        '''
+        Count one use of each tag on date, re-reading stored tags in the
+        transaction (new, unsaved tags are put as given)
+        '''
+        stored = ndb.get_multi([tag.key for tag in tags])
+        tags = [stored_tag or tag for stored_tag, tag in zip(stored, tags)]
+        for tag in tags:
+            tag.record_use(date)
+        ndb.put_multi(tags)
+
     @staticmethod
     def Key(user, name, prefix='@'):
         if name:
@@ -741,7 +1283,7 @@ class JournalTag(UserAccessible):
             return ndb.Key('JournalTag', prefix+name, parent=user.key)
 
     @staticmethod
-    def CreateFromText(user, text):
+    def CreateFromText(user, text, put=True):
         people = re.findall(r'@([a-zA-Z]{3,30})', text)
         hashtags = re.findall(r'#([a-zA-Z]{3,30})', text)
         new_jts = []
@@ -758,14 +1300,15 @@ class JournalTag(UserAccessible):
                 all_jts.append(jt)
             else:
                 all_jts.append(existing_tag)
-        ndb.put_multi(new_jts)
+        if put:
+            ndb.put_multi(new_jts)
         return all_jts
 
     def person(self):
         return self.type == JOURNALTAG.PERSON
 
 
-class MiniJournal(UserAccessible):
+class MiniJournal(UserVersioned):
     """
     Key - ID: [ISO_date]
     Capture some basic data points from the day via 1-2 questions?
@@ -773,17 +1316,29 @@ class MiniJournal(UserAccessible):
 
     Optionally collect and track completion of top 3 tasks (decided tonight for tomorrow)
     """
+    QUERY_MIN_DAYS = 60  # Longer ranges are queried on date instead of key gets
+    GET_CHUNK = 50  # Keys per get_multi_async
+
     date = ndb.DateProperty()  # Date for entry
     dt_created = ndb.DateTimeProperty(auto_now_add=True)
     data = ndb.TextProperty()  # JSON (keys are data names, values are responses)
     tags = ndb.KeyProperty(repeated=True)  # IDs of JournalTags()
     location = ndb.GeoPtProperty()
 
-    def json(self):
+    def json(self, data_fields=None):
+        '''
+        Args:
+            data_fields (list): keys of data to include (default all).
+                data is one unindexed JSON blob, so this trims the response
+                only; the whole entity is still read.
+        '''
+        data = tools.getJson(self.data)
+        if data_fields and data:
+            data = dict((k, v) for k, v in data.items() if k in data_fields)
         res = {
             'id': self.key.id(),
             'iso_date': tools.iso_date(self.date),
-            'data': tools.getJson(self.data),
+            'data': data,
             'tags': [tag.id() for tag in self.tags]
         }
         if self.location:
@@ -802,23 +1357,47 @@ class MiniJournal(UserAccessible):
 
     @staticmethod
     def Fetch(user, start, end):
-        journal_keys = []
-        iso_dates = []
+        '''
+        Journals for days after start, up to and including end
+
+        Returns:
+            tuple: (list of MiniJournal() ordered by date, list of iso dates in range)
+        '''
+        return MiniJournal.FetchAsync(user, start, end).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def FetchAsync(user, start, end):
+        '''
+        Long ranges use an ancestor query on date (missing days cost
+        nothing), short ranges key gets in parallel chunks
+        '''
+        dates = []
         if start < end:
-            date_cursor = start
-            while date_cursor < end:
-                date_cursor += timedelta(days=1)
-                iso_date = tools.iso_date(date_cursor)
-                journal_keys.append(ndb.Key('MiniJournal', iso_date, parent=user.key))
-                iso_dates.append(iso_date)
-        return ([j for j in ndb.get_multi(journal_keys) if j], iso_dates)
+            n_days = (tools.to_date(end) - tools.to_date(start)).days
+            dates = [start + timedelta(days=i) for i in range(1, n_days + 1)]
+        iso_dates = [tools.iso_date(date) for date in dates]
+        journals = []
+        if len(dates) > MiniJournal.QUERY_MIN_DAYS:
+            q = MiniJournal.query(ancestor=user.key).filter(MiniJournal.date >= tools.to_date(dates[0]))
+            q = q.filter(MiniJournal.date <= tools.to_date(dates[-1])).order(MiniJournal.date)
+            journals = yield q.fetch_async(limit=len(dates))
+        elif dates:
+            keys = [ndb.Key('MiniJournal', iso_date, parent=user.key) for iso_date in iso_dates]
+            chunks = yield [ndb.get_multi_async(chunk) for chunk in tools.chunks(keys, MiniJournal.GET_CHUNK)]
+            journals = [j for chunk in chunks for j in chunk if j]
+        raise ndb.Return((journals, iso_dates))
 
     @staticmethod
     def Get(user, date=None):
+        return MiniJournal.GetAsync(user, date=date).get_result()
+
+    @staticmethod
+    def GetAsync(user, date=None):
         if not date:
             date = MiniJournal.CurrentSubmissionDate()
         id = tools.iso_date(date)
-        return MiniJournal.get_by_id(id, parent=user.key)
+        return MiniJournal.get_by_id_async(id, parent=user.key)
 
     @staticmethod
     def CurrentSubmissionDate():
@@ -843,10 +1422,15 @@ class MiniJournal(UserAccessible):
         for q in parse_questions:
             response_text = tools.getJson(self.data).get(q)
             if response_text:
-                tags.extend(JournalTag.CreateFromText(user, response_text))
+                tags.extend(JournalTag.CreateFromText(user, response_text, put=False))
+        used = []
         for tag in tags:
             if tag.key not in self.tags:
+                # Newly tagged, count the use (puts new tags too)
                 self.tags.append(tag.key)
+                used.append(tag)
+        if used:
+            JournalTag.RecordUses(used, self.date)
 
     def get_data_value(self, prop):
         data = tools.getJson(self.data, {})
@@ -987,7 +1571,7 @@ class Event(UserAccessible):
         return self.date_start == self.date_end
 
 
-class Goal(UserAccessible):
+class Goal(UserVersioned):
     """
     Key - ID: [YYYY] if annual goal, [YYYY-MM] if monthly goal
 
@@ -1029,6 +1613,11 @@ class Goal(UserAccessible):
 
     @staticmethod
     def Current(user, which="all"):
+        return Goal.CurrentAsync(user, which=which).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def CurrentAsync(user, which="all"):
         date = tools.local_time(user.get_timezone(), datetime.today())
         keys = []
         if which in ["all", "year"]:
@@ -1040,8 +1629,8 @@ class Goal(UserAccessible):
         if which in ["all", "longterm"]:
             monthly_id = ndb.Key('Goal', datetime.strftime(date, "longterm"), parent=user.key)
             keys.append(monthly_id)
-        goals = ndb.get_multi(keys)
-        return [g for g in goals]
+        goals = yield ndb.get_multi_async(keys)
+        raise ndb.Return([g for g in goals])
 
     @staticmethod
     def Create(user, id, date=None):
@@ -1096,18 +1685,53 @@ class TrackingDay(UserAccessible):
     date = ndb.DateProperty()
     dt_created = ndb.DateTimeProperty(auto_now_add=True)
     data = ndb.TextProperty()  # Flat JSON object
+    key_ts = ndb.TextProperty()  # JSON: data key -> ms timestamp of last write
 
     def json(self):
         return {
             'id': self.key.id(),
             'iso_date': tools.iso_date(self.date),
-            'data': tools.getJson(self.data)
+            'data': tools.getJson(self.data),
+            'key_ts': tools.getJson(self.key_ts, default={})
         }
 
     @staticmethod
-    def Create(user, date):
-        id = tools.iso_date(date)
-        return TrackingDay.get_or_insert(id, date=date, parent=user.key)
+    @ndb.transactional()
+    def MergeMany(user, date_props, if_unmodified_since=None):
+        '''
+        Merge properties into many days, with one get_multi and put_multi
+
+        Runs in a transaction, so concurrent merges into the same days
+        (e.g. Fit and GitHub syncs) are retried on the latest data rather
+        than overwriting each other's properties.
+
+        Args:
+            date_props: dict of date -> properties dict
+            if_unmodified_since (int): ms timestamp. Properties written
+                since are conflicts, and kept as stored
+
+        Returns:
+            tuple: (list of TrackingDay(), list of (ISO date, key) conflicts)
+        '''
+        dates = sorted(date_props.keys())
+        keys = [ndb.Key('TrackingDay', tools.iso_date(date), parent=user.key) for date in dates]
+        tds = []
+        conflicts = []
+        for date, key, td in zip(dates, keys, ndb.get_multi(keys)):
+            props = dict(date_props[date])
+            if not td:
+                td = TrackingDay(id=key.id(), date=tools.to_date(date), parent=user.key)
+            elif if_unmodified_since:
+                key_ts = tools.getJson(td.key_ts, default={})
+                for prop in props.keys():
+                    if key_ts.get(prop, 0) > if_unmodified_since:
+                        conflicts.append((key.id(), prop))
+                        del props[prop]
+            td.set_properties(props)
+            tds.append(td)
+        if tds:
+            ndb.put_multi(tds)
+        return (tds, conflicts)
 
     @staticmethod
     def Range(user, dt_start, dt_end):
@@ -1125,9 +1749,13 @@ class TrackingDay(UserAccessible):
         data = tools.getJson(self.data, default={})
         data.update(property_dict)
         self.data = json.dumps(data)
+        now = tools.unixtime()
+        key_ts = tools.getJson(self.key_ts, default={})
+        key_ts.update((prop, now) for prop in property_dict.keys())
+        self.key_ts = json.dumps(key_ts)
 
 
-class Readable(UserSearchable):
+class Readable(UserSampleable, UserVersioned):
     """
     Readable things (books / articles)
 
@@ -1151,6 +1779,8 @@ class Readable(UserSearchable):
     tags = ndb.TextProperty(repeated=True)  # Lowercase
     read = ndb.BooleanProperty(default=False)
     word_count = ndb.IntegerProperty()
+    source_ts = ndb.IntegerProperty(indexed=False)  # Last modified at source (e.g. pocket time_updated)
+    stats_counted = ndb.StringProperty(indexed=False)  # Stats entry included in ReadingStats
 
     def __str__(self):
         return "%s (%s)" % (self.title, self.author)
@@ -1177,8 +1807,12 @@ class Readable(UserSearchable):
         }
 
     @staticmethod
-    def Fetch(user, favorites=False, with_notes=False, unread=False, read=False,
-              limit=30, since=None, until=None, offset=0, keys_only=False):
+    def Fetch(user, **params):
+        return Readable.FetchAsync(user, **params).get_result()
+
+    @staticmethod
+    def FetchAsync(user, favorites=False, with_notes=False, unread=False, read=False,
+                   limit=30, since=None, until=None, offset=0, keys_only=False):
         q = Readable.query(ancestor=user.key)
         ordering_prop = Readable.dt_added if not read else Readable.dt_read
         if with_notes:
@@ -1194,15 +1828,20 @@ class Readable(UserSearchable):
             q = q.filter(ordering_prop >= tools.fromISODate(since))
         if until:
             q = q.filter(ordering_prop <= tools.fromISODate(until))
-        return q.fetch(limit=limit, offset=offset, keys_only=keys_only)
+        return q.fetch_async(limit=limit, offset=offset, keys_only=keys_only)
 
     @staticmethod
-    def CreateOrUpdate(user, source_id, title=None, url=None,
-                       type=READABLE.ARTICLE, source=None,
-                       author=None, image_url=None, excerpt=None,
-                       tags=None, read=False, favorite=False,
-                       dt_read=None, notes=None,
-                       word_count=0, dt_added=None, **params):
+    def _Props(source_id, title=None, url=None,
+               type=READABLE.ARTICLE, source=None,
+               author=None, image_url=None, excerpt=None,
+               tags=None, read=False, favorite=False,
+               dt_read=None, notes=None,
+               word_count=0, dt_added=None, source_ts=None, **params):
+        '''
+        Returns:
+            tuple: (id, dict of properties for a new Readable), or None
+            without title and source
+        '''
         if title and source:
             if source_id is None:
                 m = hashlib.md5()
@@ -1214,19 +1853,79 @@ class Readable(UserSearchable):
             if not dt_added:
                 dt_added = datetime.now()
             id = source + ':' + source_id
-            r = Readable.get_or_insert(id, parent=user.key, source_id=source_id,
-                                       title=title, url=url,
-                                       type=type, source=source, read=read,
-                                       dt_added=dt_added, notes=notes,
-                                       excerpt=excerpt, favorite=favorite,
-                                       tags=tags, dt_read=dt_read,
-                                       image_url=image_url, author=author,
-                                       word_count=word_count)
+            return (id, dict(source_id=source_id,
+                             title=title, url=url,
+                             type=type, source=source, read=read,
+                             dt_added=dt_added, notes=notes,
+                             excerpt=excerpt, favorite=favorite,
+                             tags=tags, dt_read=dt_read,
+                             image_url=image_url, author=author,
+                             word_count=word_count, source_ts=source_ts))
+
+    @staticmethod
+    def CreateOrUpdate(user, source_id, **params):
+        id_props = Readable._Props(source_id, **params)
+        if id_props:
+            id, props = id_props
+            r = Readable.get_or_insert(id, parent=user.key, **props)
             if not r.slug:
                 r.generate_slug()
             r.has_notes = bool(r.notes)
             return r
 
+    @staticmethod
+    def CreateOrUpdateMulti(user, items, put=True, index=True):
+        '''
+        Bulk CreateOrUpdate: one get_multi for all items, new readables
+        built in memory, then one put_multi and batched search doc puts
+
+        Existing readables whose source_ts matches the item's are returned
+        without being updated or written.
+
+        Args:
+            items: list of dicts of CreateOrUpdate params (incl. source_id),
+                optionally with 'update': params applied via Update() to
+                both new and existing readables
+
+        Returns:
+            list of Readable() in item order (None for items without
+            title or source)
+        '''
+        built = []
+        for item in items:
+            params = dict(item)
+            update = params.pop('update', None)
+            id_props = Readable._Props(params.pop('source_id', None), **params)
+            r = None
+            if id_props:
+                id, props = id_props
+                r = Readable(id=id, parent=user.key, **props)
+            built.append((r, update))
+        keys = list(set([r.key for r, update in built if r]))
+        lookup = dict((r.key, r) for r in ndb.get_multi(keys) if r)
+        res = []
+        changed = {}
+        for r, update in built:
+            if r:
+                existing = lookup.get(r.key)
+                if existing and r.source_ts and existing.source_ts == r.source_ts:
+                    res.append(existing)  # Unchanged at source
+                    continue
+                r = lookup.setdefault(r.key, r)  # First item wins for repeated ids
+                if not r.slug:
+                    r.generate_slug()
+                r.has_notes = bool(r.notes)
+                if update:
+                    r.Update(index=False, **update)
+                changed[r.key] = r
+            res.append(r)
+        if changed:
+            if put:
+                ReadingStats.Write(user, changed.values())
+            if index:
+                Readable.put_sd_batch(changed.values())
+        return res
+
     @staticmethod
     def GetByTitleAuthor(user, author, title):
         slug = Readable.Slug(author, title)
@@ -1241,7 +1940,7 @@ class Readable(UserSearchable):
         if 'read' in params:
             change = self.read != params.get('read')
             self.read = params.get('read')
-            if change and self.read:
+            if self.read and (change or not self.dt_read):
                 self.dt_read = datetime.now()
         if 'favorite' in params:
             self.favorite = params.get('favorite')
@@ -1270,9 +1969,12 @@ class Readable(UserSearchable):
             self.author = params.get('author')
         if 'word_count' in params:
             self.word_count = params.get('word_count')
+        if 'source_ts' in params:
+            self.source_ts = params.get('source_ts')
         if not self.slug:
             self.generate_slug()
-        self.update_sd()  # doc put
+        if params.get('index', True):
+            self.update_sd()  # doc put
 
     @staticmethod
     def Slug(author, title):
@@ -1294,6 +1996,17 @@ class Readable(UserSearchable):
                                     repeated_attom_fields=['tags'],
                                     atom_fields=['url'])
 
+    def stats_entry(self):
+        '''
+        Contribution to ReadingStats, as "date|type|source|words|favorite"
+
+        Returns:
+            str, or None if unread (or read date unknown)
+        '''
+        if self.read and self.dt_read:
+            return '|'.join([tools.iso_date(self.dt_read), str(self.type or READABLE.ARTICLE),
+                             self.source or '', str(self.word_count or 0), '1' if self.favorite else '0'])
+
     def print_type(self):
         return READABLE.LABELS.get(self.type)
 
@@ -1302,7 +2015,218 @@ class Readable(UserSearchable):
             return "https://getpocket.com/a/read/%s" % self.source_id
 
 
-class Quote(UserSearchable):
+class ReadingStats(UserAccessible):
+    """
+    Reading counters for one year, by day (items read, words, favorites,
+    and items by type and source)
+
+    Key - ID: [YYYY]
+
+    Maintained from readables' stats entries as they're written (see
+    Write), so a year of stats is a single get.
+    """
+    year = ndb.IntegerProperty()
+    dt_updated = ndb.DateTimeProperty(auto_now=True)
+    days = ndb.TextProperty()  # JSON: ISO date -> counters
+    rebuilt = ndb.BooleanProperty(default=False)  # Counted from all readables (see Rebuilt)
+
+    WRITE_BATCH = 400  # Readables per transaction
+
+    def json(self):
+        days = self.get_days()
+        return {
+            'year': self.year,
+            'days': days,
+            'weeks': ReadingStats.Weeks(days),
+            'totals': ReadingStats.Sum(days.values())
+        }
+
+    def get_days(self):
+        return tools.getJson(self.days, default={})
+
+    @staticmethod
+    def Get(user, year):
+        '''
+        Returns:
+            ReadingStats() for the year (unsaved and empty if none yet)
+        '''
+        stats = ndb.Key('ReadingStats', str(year), parent=user.key).get()
+        if not stats:
+            stats = ReadingStats(id=str(year), year=int(year), parent=user.key)
+        return stats
+
+    @staticmethod
+    def Range(user, since, until):
+        '''
+        Returns:
+            dict: ISO date -> counters, for days read between since and until
+            (None until the user's stats are rebuilt)
+        '''
+        if not ReadingStats.Rebuilt(user.key):
+            return None
+        keys = [ndb.Key('ReadingStats', str(year), parent=user.key) for year in range(since.year, until.year + 1)]
+        start, end = tools.iso_date(since), tools.iso_date(until)
+        res = {}
+        for stats in ndb.get_multi(keys):
+            if stats:
+                res.update((iso_date, day) for iso_date, day in stats.get_days().items()
+                           if start <= iso_date <= end)
+        return res
+
+    @staticmethod
+    def Write(user, readables, removed=False):
+        '''
+        Put readables (or delete them, with removed=True), applying changes
+        in their stats entries to the counters in the same transaction
+
+        Returns:
+            int: number of readables whose entry changed
+        '''
+        n = 0
+        for chunk in tools.chunks(list(readables), ReadingStats.WRITE_BATCH):
+            n += ReadingStats._Write(user.key, chunk, removed)
+        return n
+
+    @staticmethod
+    @ndb.transactional()
+    def _Write(user_key, readables, removed):
+        # Entry last counted comes from the stored readable, so a retried
+        # or concurrent write isn't counted twice
+        stored = ndb.get_multi([r.key for r in readables])
+        changes = []
+        for r, stored_r in zip(readables, stored):
+            counted = stored_r.stats_counted if stored_r else None
+            entry = None if removed else r.stats_entry()
+            r.stats_counted = entry
+            if entry != counted:
+                changes.append((counted, entry))
+        if changes:
+            ReadingStats._Apply(user_key, changes)
+        if removed:
+            ndb.delete_multi([r.key for r in readables])
+        else:
+            UserVersioned.PutMulti(readables)
+        return len(changes)
+
+    @staticmethod
+    def _Apply(user_key, changes):
+        years = sorted(set(entry[:4] for change in changes for entry in change if entry))
+        keys = [ndb.Key('ReadingStats', year, parent=user_key) for year in years]
+        lookup = {}
+        for key, stats in zip(keys, ndb.get_multi(keys)):
+            lookup[key.id()] = stats or ReadingStats(id=key.id(), year=int(key.id()), parent=user_key)
+        days = dict((year, stats.get_days()) for year, stats in lookup.items())
+        for old, new in changes:
+            if old:
+                ReadingStats._Add(days[old[:4]], old, sign=-1)
+            if new:
+                ReadingStats._Add(days[new[:4]], new)
+        for year, stats in lookup.items():
+            stats.days = json.dumps(days[year])
+        ndb.put_multi(lookup.values())
+
+    @staticmethod
+    def Rebuilt(user_key):
+        '''
+        Whether the user's readables have all been counted (see
+        rebuildReadingStats); until then stats only cover reads since
+        tracking began
+        '''
+        q = ReadingStats.query(ancestor=user_key).filter(ReadingStats.rebuilt == True)
+        return bool(q.get(keys_only=True))
+
+    @staticmethod
+    def RecountPage(user_key, cursor=None):
+        '''
+        Count a page of the user's readables whose stats entry isn't
+        counted yet. Idempotent, as counted entries are skipped.
+
+        Returns:
+            str: urlsafe cursor of the next page, or None when done
+        '''
+        from google.appengine.datastore.datastore_query import Cursor
+        keys, next_cursor, more = Readable.query(ancestor=user_key).fetch_page(
+            ReadingStats.WRITE_BATCH, keys_only=True, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        if keys:
+            ReadingStats._Recount(user_key, keys)
+        return next_cursor.urlsafe() if more and next_cursor else None
+
+    @staticmethod
+    @ndb.transactional()
+    def _Recount(user_key, keys):
+        changed = []
+        changes = []
+        for r in ndb.get_multi(keys):
+            entry = r.stats_entry() if r else None
+            if r and entry != r.stats_counted:
+                changes.append((r.stats_counted, entry))
+                r.stats_counted = entry
+                changed.append(r)
+        if changes:
+            ReadingStats._Apply(user_key, changes)
+            UserVersioned.PutMulti(changed)
+        return len(changes)
+
+    @staticmethod
+    @ndb.transactional()
+    def MarkRebuilt(user_key):
+        '''
+        Flag the user's stats as counted from all readables (the current
+        year's is stored even if empty)
+        '''
+        year = str(datetime.today().year)
+        stats = ReadingStats.query(ancestor=user_key).fetch()
+        if year not in [s.key.id() for s in stats]:
+            stats.append(ReadingStats(id=year, year=int(year), days=json.dumps({}), parent=user_key))
+        for s in stats:
+            s.rebuilt = True
+        ndb.put_multi(stats)
+
+    @staticmethod
+    def _Add(days, entry, sign=1):
+        date, type, rest = entry.split('|', 2)
+        source, words, favorite = rest.rsplit('|', 2)
+        day = days.setdefault(date, ReadingStats._Empty())
+        day['count'] += sign
+        day['words'] += sign * int(words)
+        day['favorites'] += sign * int(favorite)
+        for group, value in [('types', type), ('sources', source)]:
+            day[group][value] = day[group].get(value, 0) + sign
+            if not day[group][value]:
+                del day[group][value]
+        if not day['count']:
+            del days[date]
+
+    @staticmethod
+    def _Empty():
+        return {'count': 0, 'words': 0, 'favorites': 0, 'types': {}, 'sources': {}}
+
+    @staticmethod
+    def Sum(counters):
+        total = ReadingStats._Empty()
+        for day in counters:
+            for prop in ['count', 'words', 'favorites']:
+                total[prop] += day.get(prop, 0)
+            for group in ['types', 'sources']:
+                for value, n in day.get(group, {}).items():
+                    total[group][value] = total[group].get(value, 0) + n
+        return total
+
+    @staticmethod
+    def Weeks(days):
+        '''
+        Returns:
+            dict: ISO date of week's Monday -> counters summed over the week
+        '''
+        by_week = {}
+        for iso_date, day in days.items():
+            date = tools.fromISODate(iso_date)
+            monday = tools.iso_date(date - timedelta(days=date.weekday()))
+            by_week.setdefault(monday, []).append(day)
+        return dict((monday, ReadingStats.Sum(week)) for monday, week in by_week.items())
+
+
+class Quote(UserSampleable):
     """
     Quotes
 
@@ -1318,6 +2242,10 @@ class Quote(UserSearchable):
     tags = ndb.StringProperty(repeated=True)  # lower case, symbols removed
     content = ndb.TextProperty()
 
+    SOURCE_MCK = "user:%s:quote_source:%s"  # Source slug -> readable key (urlsafe), '' for no match
+    SOURCE_EXPIRY = 60 * 60 * 24
+    SOURCE_MISS_EXPIRY = 60 * 10  # Readable may be added later
+
     def json(self):
         return {
             'id': self.key.id(),
@@ -1331,7 +2259,12 @@ class Quote(UserSearchable):
         }
 
     @staticmethod
-    def Create(user, source=None, content=None, dt_added=None, location=None, **params):
+    def Create(user, source=None, content=None, dt_added=None, location=None, sources=None, **params):
+        '''
+        Args:
+            sources (dict): readable resolutions shared across a batch (see
+                lookup_readable)
+        '''
         if source and content:
             m = hashlib.md5()
             m.update('|'.join([tools.removeNonAscii(x) for x in [source, content]]))
@@ -1341,7 +2274,7 @@ class Quote(UserSearchable):
             q = Quote(id=id, source=source, content=content,
                          location=location,
                          dt_added=dt_added, parent=user.key)
-            q.lookup_readable(user)
+            q.lookup_readable(user, sources=sources)
             return q
 
     @staticmethod
@@ -1386,27 +2319,51 @@ class Quote(UserSearchable):
         if title:
             return Readable.Slug(author, title)
 
-    def lookup_readable(self, user):
-        USE_FTS = True
+    def lookup_readable(self, user, sources=None, refresh=False):
+        '''
+        Link the readable matching this quote's source, if unambiguous.
+
+        Resolutions are cached per user by source slug (in memcache, and in
+        the sources dict if passed, to share across a batch), so search only
+        runs once per distinct source.
+
+        Args:
+            sources (dict): source slug -> readable key (or None), per batch
+            refresh (bool): ignore cached results
+
+        Returns:
+            readable key, or None
+        '''
         if self.source:
-            if USE_FTS:
-                # Lookup via readable full-text-search
-                lookup_title_quoted = "\"%s\"" % re.sub(r'\((.*)\)$', '', self.source.replace("\"", "\\\"")).strip()
-                success, message, readables = Readable.Search(user, lookup_title_quoted)
-                if success:
-                    if len(readables) == 1:
-                        # Non-ambiguous result, link it
-                        r = readables[0]
-                        self.readable = r.key
-                        return r
-            # else:
-            #     # Lookup via slug query
-            #     slug = self.source_slug()
-            #     if slug:
-            #         r = Readable.GetBySlug(user, slug)
-            #         if r:
-            #             self.readable = r.key
-            #             return r
+            slug = self.source_slug()
+            mck = Quote.SOURCE_MCK % (user.key.id(), slug) if slug else None
+            if sources is None:
+                sources = {}
+            if mck and not refresh:
+                if slug not in sources:
+                    cached = memcache.get(mck)
+                    if cached is not None:
+                        sources[slug] = ndb.Key(urlsafe=cached) if cached else None
+                if slug in sources:
+                    if sources[slug]:
+                        self.readable = sources[slug]
+                    return sources[slug]
+            # Lookup via readable full-text-search
+            readable_key = None
+            lookup_title_quoted = "\"%s\"" % re.sub(r'\((.*)\)$', '', self.source.replace("\"", "\\\"")).strip()
+            success, message, readables = Readable.Search(user, lookup_title_quoted)
+            if success:
+                if len(readables) == 1 and readables[0]:
+                    # Non-ambiguous result, link it
+                    readable_key = readables[0].key
+                    self.readable = readable_key
+            if mck:
+                sources[slug] = readable_key
+                if readable_key:
+                    memcache.set(mck, readable_key.urlsafe(), time=Quote.SOURCE_EXPIRY)
+                elif success:
+                    memcache.set(mck, '', time=Quote.SOURCE_MISS_EXPIRY)
+            return readable_key
 
 
 class Report(UserAccessible):
@@ -1520,29 +2477,30 @@ class Report(UserAccessible):
             return "application/ms-excel"
         elif extension == 'csv':
             return "text/csv"
+        elif extension == 'ndjson':
+            return "application/x-ndjson"
         else:
             return None
 
+    def worker(self, stream=None):
+        '''
+        Report worker for this report's type. With stream (file-like), the
+        worker writes rows to it for this (unsaved) report instead of GCS.
+        '''
+        from reports import REPORT_WORKERS
+        worker_class = REPORT_WORKERS.get(self.type)
+        if worker_class:
+            if stream is not None:
+                return worker_class(None, report=self, stream=stream)
+            return worker_class(self.key)
+
     def run(self, start_cursor=None):
         """Begins report generation"""
-        from reports import HabitReportWorker, TaskReportWorker, GoalReportWorker, JournalReportWorker, \
-            EventReportWorker, ProjectReportWorker
-        worker_lookup = {
-            REPORT.HABIT_REPORT: HabitReportWorker,
-            REPORT.TASK_REPORT: TaskReportWorker,
-            REPORT.GOAL_REPORT: GoalReportWorker,
-            REPORT.JOURNAL_REPORT: JournalReportWorker,
-            REPORT.EVENT_REPORT: EventReportWorker,
-            REPORT.PROJECT_REPORT: ProjectReportWorker
-        }
-        worker_class = worker_lookup.get(self.type)
-        worker = None
-        if worker_class:
-            worker = worker_class(self.key)
-            if worker and self.status not in [REPORT.ERROR, REPORT.CANCELLED]:
-                worker.run(start_cursor=start_cursor)
-            else:
-                logging.error("Worker not created or invalid status for run(): type %d" % self.type)
+        worker = self.worker()
+        if worker and self.status not in [REPORT.ERROR, REPORT.CANCELLED]:
+            worker.run(start_cursor=start_cursor)
+        else:
+            logging.error("Worker not created or invalid status for run(): type %d" % self.type)
 
     def finish(self):
         '''Finalize report'''
@@ -1575,3 +2533,62 @@ class Report(UserAccessible):
         self.delete_gcs_files()
         if self_delete:
             self.key.delete()
+
+
+class Import(UserAccessible):
+    """
+    Bulk import of readables or quotes from an uploaded file (see imports.py)
+
+    Key - ID
+    """
+    dt_created = ndb.DateTimeProperty(auto_now_add=True)
+    dt_done = ndb.DateTimeProperty()
+    kind = ndb.IntegerProperty(default=IMPORT.READABLES)
+    ftype = ndb.IntegerProperty(default=IMPORT.JSON, indexed=False)
+    status = ndb.IntegerProperty(default=IMPORT.CREATED)
+    filename = ndb.StringProperty(indexed=False)  # As uploaded
+    gcs_file = ndb.StringProperty(indexed=False)
+    source = ndb.StringProperty(indexed=False)  # Readable source for imported readables
+    position = ndb.IntegerProperty(default=0, indexed=False)  # Bytes of file processed
+    counters = ndb.TextProperty()  # JSON, e.g. created / duplicates / invalid
+    error = ndb.TextProperty()
+
+    def json(self):
+        return {
+            'key': self.key.urlsafe(),
+            'id': self.key.id(),
+            'kind': self.kind,
+            'ftype': self.ftype,
+            'status': self.status,
+            'filename': self.filename,
+            'counters': self.get_counters(),
+            'error': self.error,
+            'ts_created': tools.unixtime(self.dt_created),
+            'ts_done': tools.unixtime(self.dt_done) if self.dt_done else None
+        }
+
+    @staticmethod
+    def Fetch(user, limit=20):
+        return Import.query(ancestor=user.key).order(-Import.dt_created).fetch(limit=limit)
+
+    @staticmethod
+    def Create(user, kind=IMPORT.READABLES, ftype=IMPORT.JSON, filename=None, source='import'):
+        import_job = Import(kind=kind, ftype=ftype, filename=filename, source=source, parent=user.key)
+        import_job.dt_created = datetime.now()
+        return import_job
+
+    def is_done(self):
+        return self.status == IMPORT.DONE
+
+    def get_counters(self):
+        if self.counters:
+            return json.loads(self.counters)
+        return {}
+
+    def set_counters(self, data):
+        self.counters = json.dumps(data)
+
+    def gcs_filename(self):
+        from constants import GCS_IMPORT_BUCKET
+        return GCS_IMPORT_BUCKET + "/uid:%d/%s.%s" % (self.key.parent().id(), self.key.id(),
+                                                      IMPORT.EXTENSIONS.get(self.ftype, 'txt'))
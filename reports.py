@@ -15,6 +15,17 @@ import logging
 TEST_TOO_LONG_ON_EVERY_BATCH = False
 MC_EXPORT_STATUS = "MC_EXPORT_STATUS_%s"
 MAX_REQUEST_SECONDS = 40*3
+BATCH_SIZE = 1000
+STREAM_MAX_ROWS = 2000  # Larger exports are generated in the background
+# Rough rows per day of date range, to rule out streaming without a count
+ROWS_PER_DAY = {
+    REPORT.HABIT_REPORT: 10,
+    REPORT.TASK_REPORT: 5,
+    REPORT.GOAL_REPORT: 0.1,
+    REPORT.JOURNAL_REPORT: 1,
+    REPORT.EVENT_REPORT: 0.5,
+    REPORT.PROJECT_REPORT: 0.2
+}
 DATE_FMT = "%Y-%m-%d %H:%M:%S %Z"
 
 
@@ -26,8 +37,13 @@ class TooLongError(Exception):
 class GCSReportWorker(object):
     KIND = None
 
-    def __init__(self, rkey, start_att="__key__", start_att_desc=False, title="Report"):
-        self.report = rkey.get()
+    def __init__(self, rkey, start_att="__key__", start_att_desc=False, title="Report", report=None, stream=None):
+        '''
+        With stream (file-like, e.g. the response), rows for the given unsaved
+        report are written straight to it by stream() instead of to GCS
+        '''
+        self.streaming = stream is not None
+        self.report = report if report else rkey.get()
         if not self.report:
             logging.error("Error retrieving report [ %s ] from db" % rkey)
             return
@@ -39,13 +55,17 @@ class GCSReportWorker(object):
         self.start_ts = self.specs.get('start', 0)
         self.end_ts = self.specs.get('end', 0)
         self.report.generate_title(title, ts_start=self.start_ts, ts_end=self.end_ts)
-        self.report.put()
+        if not self.streaming:
+            self.report.put()
         self.add_date_filters(start=self.start_ts, end=self.end_ts)
         self.user = self.report.key.parent().get()
         self.ancestor = self.user
         self.counters = {
             'run': 0,
-            'skipped': 0
+            'skipped': 0,
+            'batches': 0,
+            'flushes': 0,
+            'continuations': 0
         }
         self.worker_start = tools.unixtime()
         self.cursor = None
@@ -56,10 +76,13 @@ class GCSReportWorker(object):
         self.projection = None
         self.cursor = None
         self.query = None
-        self.batch_size = 1000
-        self.report_prog_mckey = MC_EXPORT_STATUS % self.report.key
-        self.setProgress({'val': 0, "status": REPORT.GENERATING})
-        self.gcs_file = gcs.open(self.get_gcs_filename(), 'w')
+        self.batch_size = BATCH_SIZE
+        if self.streaming:
+            self.gcs_file = stream
+        else:
+            self.report_prog_mckey = MC_EXPORT_STATUS % self.report.key
+            self.setProgress({'val': 0, "status": REPORT.GENERATING})
+            self.gcs_file = gcs.open(self.get_gcs_filename(), 'w')
 
         # From: https://code.google.com/p/googleappengine/issues/detail?id=8809
         logservice.AUTOFLUSH_ENABLED = True
@@ -94,6 +117,7 @@ class GCSReportWorker(object):
         except TooLongError:
             logging.debug("TooLongError: Going to the next batch")
             if self.report:
+                self.counters['continuations'] += 1
                 self.finish(reportDone=False)
                 tools.safe_add_task(self.run, start_cursor=self._get_cursor(), _queue="report-queue")
         except Exception, e:  # including DeadlineExceededError
@@ -104,10 +128,38 @@ class GCSReportWorker(object):
         else:
             tools.safe_add_task(self.finish)
 
+    def fits_stream(self, max_rows=None):
+        '''
+        Whether this report is small enough to stream. The date range rules
+        out obviously large exports, otherwise count (bounded) matching rows.
+        '''
+        if max_rows is None:
+            max_rows = STREAM_MAX_ROWS
+        if self.start_ts and self.end_ts:
+            days = (self.end_ts - self.start_ts) / (1000. * 60 * 60 * 24) + 1
+            if days * ROWS_PER_DAY.get(self.report.type, 1) > max_rows:
+                return False
+        query = self._get_gql_query()
+        return bool(query) and self.KIND.gql(query).count(limit=max_rows + 1) <= max_rows
+
+    def stream(self):
+        '''
+        Write all rows to the stream in one pass (streaming mode)
+        '''
+        self.writeHeaders()
+        self.writeData()
+        return self.counters['run']
+
     def writeHeaders(self):
         if self.report.ftype == REPORT.CSV:
             csv.writer(self.gcs_file).writerow(tools.normalize_list_to_ascii(self.headers))
 
+    def writeRow(self, row):
+        if self.report.ftype == REPORT.CSV:
+            csv.writer(self.gcs_file).writerow(tools.normalize_list_to_ascii(row))
+        elif self.report.ftype == REPORT.NDJSON:
+            self.gcs_file.write(json.dumps(dict(zip(self.headers, row))) + '\n')
+
     def writeData(self):
         total_i = self.counters['run']
         while True:
@@ -124,12 +176,13 @@ class GCSReportWorker(object):
                         ed = self.entityData(entity)
                     else:
                         continue
-                    if self.report.ftype == REPORT.CSV:
-                        csv.writer(self.gcs_file).writerow(tools.normalize_list_to_ascii(ed))
-                    self.gcs_file.flush()
-
+                    self.writeRow(ed)
                     total_i += 1
                     self.counters['run'] += 1
+                    if self.streaming:
+                        continue
+                    self.gcs_file.flush()
+                    self.counters['flushes'] += 1
                     if total_i % 100 == 0:
                         cancelled = self.updateProgressAndCheckIfCancelled()
                         if cancelled:
@@ -137,7 +190,10 @@ class GCSReportWorker(object):
                             logging.debug("Worker cancelled by user, report deleted.")
                             return
 
+                self.counters['batches'] += 1
                 logging.debug("Batch of %d done" % len(entities))
+                if self.streaming:
+                    continue
                 elapsed_ms = tools.unixtime() - self.worker_start
                 elapsed = elapsed_ms / 1000
                 if elapsed >= MAX_REQUEST_SECONDS or (tools.on_dev_server() and TEST_TOO_LONG_ON_EVERY_BATCH):
@@ -188,7 +244,8 @@ class GCSReportWorker(object):
             logging.debug("Batch finished. Counters: %s" % (self.counters))
         p = {
             'val': self.counters['run'],
-            "filename": self.report.title
+            "filename": self.report.title,
+            "counters": self.counters
         }
         if progress:
             p.update(progress)
@@ -196,7 +253,7 @@ class GCSReportWorker(object):
         gc.collect()  # Garbage collector
 
     def _get_cursor(self):
-        return self.query.cursor() if self.query else None
+        return self.cursor
 
     def _get_gql_query(self):
         """Returns a query over the specified kind, with any appropriate filters applied."""
@@ -217,8 +274,8 @@ class GCSReportWorker(object):
 class HabitReportWorker(GCSReportWorker):
     KIND = HabitDay
 
-    def __init__(self, rkey):
-        super(HabitReportWorker, self).__init__(rkey, start_att="dt_created", title="Habit Report")
+    def __init__(self, rkey, **kwargs):
+        super(HabitReportWorker, self).__init__(rkey, start_att="dt_created", title="Habit Report", **kwargs)
         self.prefetch_props = ['habit']
         self.headers = ["Created", "Updated", "Date", "Habit", "Done", "Committed"]
 
@@ -238,8 +295,8 @@ class HabitReportWorker(GCSReportWorker):
 class TaskReportWorker(GCSReportWorker):
     KIND = Task
 
-    def __init__(self, rkey):
-        super(TaskReportWorker, self).__init__(rkey, start_att="dt_created", title="Task Report")
+    def __init__(self, rkey, **kwargs):
+        super(TaskReportWorker, self).__init__(rkey, start_att="dt_created", title="Task Report", **kwargs)
         self.prefetch_props = ['habit']
         self.headers = [
             "Date Created", "Date Due", "Date Done", "Title", "Done", "Archived", "Seconds Logged",
@@ -264,8 +321,8 @@ class TaskReportWorker(GCSReportWorker):
 class ProjectReportWorker(GCSReportWorker):
     KIND = Project
 
-    def __init__(self, rkey):
-        super(ProjectReportWorker, self).__init__(rkey, start_att="dt_created", start_att_desc=True, title="Project Report")
+    def __init__(self, rkey, **kwargs):
+        super(ProjectReportWorker, self).__init__(rkey, start_att="dt_created", start_att_desc=True, title="Project Report", **kwargs)
         self.headers = [
             "Date Created", "Date Due", "Date Completed", "Date Archived", "Title", "Subhead",
             "Links", "Starred", "Archived", "Progress"]
@@ -297,8 +354,8 @@ class ProjectReportWorker(GCSReportWorker):
 class GoalReportWorker(GCSReportWorker):
     KIND = Goal
 
-    def __init__(self, rkey):
-        super(GoalReportWorker, self).__init__(rkey, start_att="dt_created", title="Goal Report")
+    def __init__(self, rkey, **kwargs):
+        super(GoalReportWorker, self).__init__(rkey, start_att="dt_created", title="Goal Report", **kwargs)
         self.prefetch_props = ['habit']
         self.n_slots = int(self.user.get_setting_prop(['goals', 'preferences', 'slots'], default=GOAL.DEFAULT_GOAL_SLOTS))
         self.headers = ["Goal Period", "Date Created"]
@@ -319,8 +376,8 @@ class GoalReportWorker(GCSReportWorker):
 class JournalReportWorker(GCSReportWorker):
     KIND = MiniJournal
 
-    def __init__(self, rkey):
-        super(JournalReportWorker, self).__init__(rkey, start_att="dt_created", title="Journal Report")
+    def __init__(self, rkey, **kwargs):
+        super(JournalReportWorker, self).__init__(rkey, start_att="dt_created", title="Journal Report", **kwargs)
         self.prefetch_props = ['habit']
         self.headers = ["Date", "Tags", "Location", "Data"]
 
@@ -337,8 +394,8 @@ class JournalReportWorker(GCSReportWorker):
 class EventReportWorker(GCSReportWorker):
     KIND = Event
 
-    def __init__(self, rkey):
-        super(EventReportWorker, self).__init__(rkey, start_att="date_start", title="Event Report")
+    def __init__(self, rkey, **kwargs):
+        super(EventReportWorker, self).__init__(rkey, start_att="date_start", title="Event Report", **kwargs)
         self.headers = ["Date Start", "Date End", "Title", "Details", "Color"]
 
     def entityData(self, event):
@@ -350,3 +407,13 @@ class EventReportWorker(GCSReportWorker):
             event.color
         ]
         return row
+
+
+REPORT_WORKERS = {
+    REPORT.HABIT_REPORT: HabitReportWorker,
+    REPORT.TASK_REPORT: TaskReportWorker,
+    REPORT.GOAL_REPORT: GoalReportWorker,
+    REPORT.JOURNAL_REPORT: JournalReportWorker,
+    REPORT.EVENT_REPORT: EventReportWorker,
+    REPORT.PROJECT_REPORT: ProjectReportWorker
+}
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+# Benchmark API response encoding (encode time and payload size)
+# on fixtures shaped like SnapshotAPI.list and HabitAPI.range responses.
+#
+# Usage (from repo root): python scripts/bench_json.py [n_runs]
+
+import sys
+import time
+import json
+import random
+from os.path import dirname, abspath
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from common import json_util
+
+SNAPSHOT_FIELDS = ['ts', 'activity', 'metrics']
+HABITDAY_FIELDS = ['done']
+
+
+def snapshot_fixture(n=500):
+    snapshots = []
+    for i in range(n):
+        snapshots.append({
+            'id': 5629499534213120 + i,
+            'ts': 1494269497212 + i * 3600000,
+            'iso_date': '2017-05-%02d' % (i % 28 + 1),
+            'metrics': {'happiness': random.randint(1, 10), 'stress': random.randint(1, 10)},
+            'people': ['Elizabeth', 'John'],
+            'place': 'Office',
+            'activity': 'Working',
+            'activity_sub': 'Coding',
+            'lat': 37.7749,
+            'lon': -122.4194
+        })
+    return {'success': True, 'message': None, 'snapshots': snapshots}
+
+
+def habitday_fixture(n_habits=10, n_days=365):
+    habitdays = {}
+    for h in range(n_habits):
+        for d in range(n_days):
+            id = "habit:%d_day:2017-%02d-%02d" % (h, d % 12 + 1, d % 28 + 1)
+            habitdays[id] = {
+                'id': id,
+                'ts_created': 1494269497212 + d,
+                'ts_updated': 1494269497212 + d,
+                'habit_id': h,
+                'done': random.random() > 0.3,
+                'committed': random.random() > 0.8
+            }
+    return {'success': True, 'message': None, 'habits': [], 'habitdays': habitdays}
+
+
+def bench(label, fn, runs):
+    start = time.time()
+    for i in range(runs):
+        out = fn()
+    elapsed_ms = (time.time() - start) * 1000. / runs
+    print "%-42s %10.2f ms %12d bytes" % (label, elapsed_ms, len(out))
+
+
+def main(runs=20):
+    for name, fixture, fields in [
+            ('snapshots (500)', snapshot_fixture(), SNAPSHOT_FIELDS),
+            ('habitdays (10 habits x 365 days)', habitday_fixture(), HABITDAY_FIELDS)]:
+        print "\n%s" % name
+        bench("json.dumps (previous)", lambda: json.dumps(fixture), runs)
+        bench("json_util.dumps", lambda: json_util.dumps(fixture), runs)
+        bench("json_util.iterencode (stream)", lambda: ''.join(json_util.iterencode(fixture)), runs)
+        bench("json_util.dumps fields=%s" % ','.join(fields),
+              lambda: json_util.dumps(json_util.select_fields(fixture, fields)), runs)
+
+
+if __name__ == '__main__':
+    main(runs=int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+# Load-test driver: replays a weighted mix of API requests at a fixed rate
+# and reports throughput and latency percentiles (overall and per route).
+#
+# Targets:
+#   dev      A running dev server (scripts/server.sh). Seed synthetic users
+#            first with /admin/gauth/hacks?hack_id=seed_synthetic, then pass
+#            the returned user ids with --users.
+#   webtest  In-process flow.app on a testbed datastore, seeded here with
+#            --n_users synthetic users (requires the SDK path).
+#
+# Usage (from repo root):
+#   python scripts/load_test.py dev --users 123,456 --rate 20 --duration 60
+#   python scripts/load_test.py webtest --sdk /usr/local/google_appengine \
+#       --n_users 3 --size small --rate 50 --duration 30
+
+import sys
+import json
+import time
+import random
+import base64
+import urllib
+import urllib2
+import optparse
+import threading
+from datetime import datetime, timedelta
+from os.path import dirname, abspath, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+PASSWORD = "pw"  # testing.synthetic.PASSWORD
+
+
+def _dates(days):
+    today = datetime.today()
+    return (today - timedelta(days=days)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+
+
+# (weight, method, path, params function)
+PROFILE = [
+    (20, 'GET', '/api/dashboard', lambda: {}),
+    (15, 'GET', '/api/habit/recent', lambda: {'days': 7}),
+    (10, 'GET', '/api/habit/range', lambda: dict(zip(['start_date', 'end_date'], _dates(30)))),
+    (15, 'GET', '/api/task', lambda: {}),
+    (5, 'GET', '/api/project/active', lambda: {}),
+    (10, 'GET', '/api/journal/today', lambda: {}),
+    (5, 'GET', '/api/analysis', lambda: dict(zip(['date_start', 'date_end'], _dates(30)), with_habits=1)),
+    (10, 'GET', '/api/readable', lambda: {'unread': 1}),
+    (5, 'GET', '/api/readable/search', lambda: {'term': random.choice(['focus', 'design', 'history'])}),
+    (5, 'GET', '/api/quote', lambda: {})
+]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(p / 100. * (len(values) - 1)))]
+
+
+def pick(rnd):
+    total = sum(w for w, m, p, f in PROFILE)
+    x = rnd.uniform(0, total)
+    for weight, method, path, params_fn in PROFILE:
+        x -= weight
+        if x <= 0:
+            break
+    return method, path, params_fn()
+
+
+def auth_header(user_id):
+    return "Basic %s" % base64.b64encode("%s:%s" % (user_id, PASSWORD))
+
+
+class DevServerTarget(object):
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, user_id, method, path, params):
+        data = urllib.urlencode(params)
+        url = self.base_url + path
+        if method == 'GET':
+            req = urllib2.Request(url + ('?' + data if data else ''))
+        else:
+            req = urllib2.Request(url, data)
+        req.add_header('Authorization', auth_header(user_id))
+        try:
+            return urllib2.urlopen(req, timeout=60).getcode()
+        except urllib2.HTTPError, e:
+            return e.code
+
+
+class WebtestTarget(object):
+
+    def __init__(self, sdk_path, n_users, size, seed):
+        sys.path.insert(0, sdk_path)
+        sys.path.insert(0, join(ROOT, 'lib'))
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+        sys.path[1:1] = [ROOT, join(ROOT, 'testing')]
+        import webtest
+        from google.appengine.ext import testbed
+        from google.appengine.api.search.simple_search_stub import SearchServiceStub
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='test-app')
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_blobstore_stub()
+        self.testbed._register_stub('search', SearchServiceStub())
+        import synthetic
+        from flow import app
+        self.user_ids = [u.key.id() for u, counts in synthetic.seed_users(n_users, size=size, seed=seed)]
+        self.app = webtest.TestApp(app)
+
+    def request(self, user_id, method, path, params):
+        headers = {'Authorization': auth_header(user_id)}
+        if method == 'GET':
+            res = self.app.get(path, params, headers=headers, expect_errors=True)
+        else:
+            res = self.app.post(path, params, headers=headers, expect_errors=True)
+        return res.status_int
+
+
+def run(target, user_ids, rate, duration, concurrency, seed):
+    '''
+    Each worker issues requests on its own fixed schedule so the combined
+    offered load is `rate` requests/sec (a slow response delays only the
+    worker that made it). Latency is measured from the scheduled send time,
+    so queueing behind a slow request is included.
+    '''
+    samples = []  # (path, latency ms, status)
+    lock = threading.Lock()
+    interval = concurrency / float(rate)
+    start = time.time()
+
+    def worker(i):
+        rnd = random.Random(seed + i)
+        scheduled = start + i * interval / concurrency
+        while scheduled < start + duration:
+            wait = scheduled - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            method, path, params = pick(rnd)
+            try:
+                status = target.request(rnd.choice(user_ids), method, path, params)
+            except Exception, e:
+                status = str(e)
+            latency = (time.time() - scheduled) * 1000.
+            with lock:
+                samples.append((path, latency, status))
+            scheduled += interval
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.time() - start
+
+
+def summarize(samples, elapsed):
+    def stats(latencies, n_errors):
+        return {
+            'n': len(latencies),
+            'errors': n_errors,
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': max(latencies) if latencies else None
+        }
+    by_route = {}
+    for path, latency, status in samples:
+        by_route.setdefault(path, []).append((latency, status))
+    res = stats([s[1] for s in samples], len([s for s in samples if s[2] != 200]))
+    res.update({
+        'elapsed_s': round(elapsed, 1),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'routes': dict((path, stats([r[0] for r in rows], len([r for r in rows if r[1] != 200])))
+                       for path, rows in by_route.items())
+    })
+    return res
+
+
+def main():
+    parser = optparse.OptionParser("%prog dev|webtest [options]")
+    parser.add_option('--base', default='http://localhost:8080', help="Dev server URL")
+    parser.add_option('--users', default='', help="Comma-separated user ids (dev)")
+    parser.add_option('--sdk', default='/usr/local/google_appengine', help="SDK path (webtest)")
+    parser.add_option('--n_users', type='int', default=3, help="Synthetic users to seed (webtest)")
+    parser.add_option('--size', default='small', help="Synthetic user size (webtest)")
+    parser.add_option('--rate', type='float', default=10, help="Requests per second")
+    parser.add_option('--duration', type='float', default=30, help="Seconds")
+    parser.add_option('--concurrency', type='int', default=4, help="Workers (dev)")
+    parser.add_option('--seed', type='int', default=1)
+    parser.add_option('--output', help="Write JSON report to file")
+    options, args = parser.parse_args()
+    if not args or args[0] not in ['dev', 'webtest']:
+        parser.print_help()
+        sys.exit(1)
+    concurrency = options.concurrency
+    if args[0] == 'dev':
+        user_ids = [u for u in options.users.split(',') if u]
+        if not user_ids:
+            print 'Error: --users required (see hack_id=seed_synthetic)'
+            sys.exit(1)
+        target = DevServerTarget(options.base)
+    else:
+        target = WebtestTarget(options.sdk, options.n_users, options.size, options.seed)
+        user_ids = target.user_ids
+        concurrency = 1  # Testbed stubs are not thread-safe
+    samples, elapsed = run(target, user_ids, options.rate, options.duration, concurrency, options.seed)
+    out = json.dumps(summarize(samples, elapsed), indent=2, sort_keys=True)
+    print out
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(out)
+
+
+if __name__ == '__main__':
+    main()
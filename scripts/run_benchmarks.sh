@@ -0,0 +1,9 @@
+#!/bin/bash
+# Usage: ./run_benchmarks.sh [small|medium|large] [runs] [output.json] [baseline.reports.json]
+# Report regressions beyond BENCH_THRESHOLD (default 0.2) vs the baseline fail the run.
+export BENCH_SIZE=${1:-small}
+export BENCH_RUNS=${2:-5}
+export BENCH_OUTPUT=$3
+export BENCH_BASELINE=$4
+
+sudo -E ./runtests.py /usr/local/google_appengine ../testing/ benchmarks.py
@@ -27,7 +27,8 @@ def main(sdk_path, test_path, module=None):
         suite = unittest.loader.TestLoader().discover(test_path, pattern=module)
     else:
         suite = unittest.loader.TestLoader().discover(test_path)
-    doctest_modules = ["tools"]
+    doctest_modules = ["tools", "common.json_util", "common.instrumentation", "imports",
+                       "services.github"]
     for mod in doctest_modules:
         suite.addTests(doctest.DocTestSuite(mod))
     test_result = unittest.TextTestRunner(verbosity=2).run(suite)
@@ -4,7 +4,7 @@
 # API calls to interact with API.AI (Google Assistant / Actions / Home, Facebook Messenger)
 
 from google.appengine.ext import ndb
-from models import Habit, HabitDay, Task, Goal, User, MiniJournal
+from models import Habit, HabitDay, Task, Goal, User, MiniJournal, UserVersioned
 from datetime import datetime, time
 import random
 from constants import HABIT_DONE_REPLIES, HABIT_COMMIT_REPLIES, SECURE_BASE, \
@@ -260,7 +260,7 @@ class ConversationAgent(object):
                         for tn in task_names:
                             task = Task.Create(self.user, tn)
                             tasks.append(task)
-                    ndb.put_multi(tasks)
+                    UserVersioned.PutMulti(tasks)
                     reply = "Report submitted!"
                     end_convo = True
                 if reply:
@@ -381,12 +381,13 @@ class ConversationAgent(object):
         today = datetime.today().date()
         habitday_keys = [ndb.Key('HabitDay', HabitDay.ID(h, today), parent=self.user.key) for h in habits]
         habitdays = ndb.get_multi(habitday_keys)
+        habit_lookup = dict((h.key, h) for h in habits)
         n_habits_done = 0
         habits_committed_undone = []
         habits_done = []
         for hd in habitdays:
             if hd:
-                habit = hd.habit.get()
+                habit = habit_lookup.get(hd.habit)
                 if hd.committed and not hd.done:
                     if habit:
                         habits_committed_undone.append(habit.name)
@@ -404,6 +405,13 @@ class ConversationAgent(object):
                 text = "No habits done yet."
             if habits_committed_undone:
                 text += " Don't forget you've committed to %s." % (' and '.join(habits_committed_undone))
+            # From counters kept on each habit, no habit day scans needed
+            for h in habits:
+                streak = h.current_streak()
+                if streak >= 3:
+                    text += " You're on a %d day streak for %s." % (streak, h.name)
+                if h.tgt_weekly:
+                    text += " %s: %d of %d this week." % (h.name, h.done_this_week(), h.tgt_weekly)
         else:
             text = "You haven't added any habits yet. Try saying 'add habit run'"
         return text
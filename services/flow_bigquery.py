@@ -10,7 +10,7 @@ from __future__ import absolute_import
 from datetime import datetime, timedelta, time
 from services.gservice import GoogleServiceFetcher
 from constants import JOURNAL
-from models import Habit, HabitDay, Task, Readable, MiniJournal
+from models import Habit, HabitDay, Task, ReadingStats, MiniJournal
 from apiclient.errors import HttpError
 import logging
 import tools
@@ -109,58 +109,46 @@ class BigQueryClient(GoogleServiceFetcher):
         if not until:
             until = datetime.combine((datetime.now() - timedelta(days=self.days_ago_end)).date(), time(0, 0))
         rows = []
-        habitdays_by_day = tools.partition(
-            HabitDay.Range(self.user, self.habits.values(), since, until_date=until),
-            lambda hd: tools.iso_date(hd.date)
-        )
+        habitdays = HabitDay.Range(self.user, self.habits.values(), since, until_date=until, keyed=True)
         tasks_by_day = tools.partition(
             Task.DueInRange(self.user, since, until, limit=500),
             lambda t: tools.iso_date(t.dt_due)
         )
-        readables_by_day = tools.partition(
-            Readable.Fetch(self.user, read=True,
-                           since=tools.iso_date(since),
-                           until=tools.iso_date(until)),
-            lambda r: tools.iso_date(r.dt_read)
-        )
+        reading_days = ReadingStats.Range(self.user, since, until)
+        if reading_days is None:
+            # History not counted yet, leave reading columns empty meanwhile
+            from tasks import queueReadingStatsRebuild
+            queueReadingStatsRebuild(self.user)
         journals, iso_dates = MiniJournal.Fetch(self.user, start=since, end=until)
         journals_by_day = tools.partition(journals, lambda jrnl: tools.iso_date(jrnl.date))
         cursor = since
         while cursor <= until:
             iso_date = tools.iso_date(cursor)
             tasks = tasks_by_day.get(iso_date, [])
-            habitdays = habitdays_by_day.get(iso_date, [])
-            readables = readables_by_day.get(iso_date, [])
+            reading = reading_days.get(iso_date, {}) if reading_days is not None else {}
             journals = journals_by_day.get(iso_date, [])
             journal = journals[0] if journals else None
-            tasks_done = tasks_undone = habits_done = habits_cmt = habits_cmt_undone = items_read = 0
+            tasks_done = tasks_undone = habits_done = habits_cmt = habits_cmt_undone = 0
             row = {}
             for t in tasks:
                 if t.is_done():
                     tasks_done += 1
                 else:
                     tasks_undone += 1
-            habits_checklist = self.habits.keys()  # list of habit IDs
-            for hd in habitdays:
-                hid = hd.habit.id()
-                h = self.habits.get(hid)
-                if h:
-                    habits_checklist.remove(hid)
-                    row[self._habit_col(h)] = 'true' if hd.done else 'false'
+            for hid, h in self.habits.items():
+                # Missing habit-days still get a column
+                hd = habitdays.get((hid, iso_date))
+                row[self._habit_col(h)] = 'true' if hd and hd.done else 'false'
+                if not hd:
+                    continue
                 if hd.done:
                     habits_done += 1
                 if hd.committed:
                     habits_cmt += 1
                     if not hd.done:
                         habits_cmt_undone += 1
-            if habits_checklist:
-                # Missing habit-days, need to create columns anyway
-                for hid in habits_checklist:
-                    h = self.habits.get(hid)
-                    if h:
-                        row[self._habit_col(h)] = 'false'
-            items_read = len(readables)
-            fav_items_read = len([r for r in readables if r.favorite])
+            items_read = reading.get('count', 0) if reading_days is not None else None
+            fav_items_read = reading.get('favorites', 0) if reading_days is not None else None
             row.update({
                 "id": iso_date,
                 "date": iso_date,
@@ -9,6 +9,7 @@ from datetime import datetime
 from evernote.api.client import EvernoteClient
 from evernote.edam.error.ttypes import EDAMSystemException
 import re
+import threading
 import tools
 from google.appengine.api import memcache
 
@@ -16,6 +17,8 @@ SANDBOX = False
 USE_DEV_TOKEN = False
 SECRET_MCK = "user:%s:evernote:secret"
 
+_local = threading.local()
+
 
 def user_access_token(user):
     from settings.secrets import EVERNOTE_DEV_TOKEN
@@ -81,13 +84,26 @@ def extract_clipping_content(raw):
             return tools.remove_html_tags(content)
 
 
+def get_note_store(access_token):
+    '''
+    NoteStore client for access_token, reused across calls on this thread
+    (creating one costs a UserStore round trip)
+    '''
+    note_stores = getattr(_local, 'note_stores', None)
+    if note_stores is None:
+        note_stores = _local.note_stores = {}
+    if access_token not in note_stores:
+        client = EvernoteClient(token=access_token, sandbox=SANDBOX)
+        note_stores[access_token] = client.get_note_store()
+    return note_stores[access_token]
+
+
 def get_note(user, note_id):
     STRIP_WORDS = ["Pocket:"]
-    title = url = content = None
+    uid = title = url = content = None
     access_token = user_access_token(user)
     if access_token:
-        client = EvernoteClient(token=access_token, sandbox=SANDBOX)
-        noteStore = client.get_note_store()
+        noteStore = get_note_store(access_token)
         note = noteStore.getNote(access_token, note_id, True, False, False, False)
         if note:
             logging.debug(note)
@@ -7,15 +7,21 @@ from google.appengine.api import urlfetch
 import base64
 import json
 import logging
+import re
 import urllib
 from datetime import datetime, timedelta, time
 from google.appengine.api import memcache
 import tools
-from bs4 import BeautifulSoup
 
 BASE = 'https://api.github.com'
 REPO_MEMKEY = "GITHUB:%s"
 GH_DATE = "%Y-%m-%dT%H:%M:%SZ"
+CONTRIBUTIONS_URL = "https://github.com/%s?tab=overview"
+CALENDAR_MCK = "user:%s:github:calendar:%s"  # User ID, ISO date fetched
+CALENDAR_EXPIRY = 60 * 60 * 24
+RECT_RE = re.compile(r'<rect\b([^>]*)>')
+DATE_ATTR_RE = re.compile(r'data-date="(\d{4}-\d{2}-\d{2})"')
+COUNT_ATTR_RE = re.compile(r'data-count="(\d+)"')
 
 
 class GithubClient(object):
@@ -46,18 +52,69 @@ class GithubClient(object):
             logging.debug(response.content)
         return (response, None)
 
-    def get_contributions_on_date_range(self, date_range):
+    def fetch_calendar_async(self):
         '''
-        Currently scraping Github public overview page (no API yet)
+        Start fetching the public overview page, unless the calendar is
+        cached for today
+
+        Returns:
+            urlfetch RPC, or None if cached
         '''
-        response = urlfetch.fetch("https://github.com/%s?tab=overview" % self.github_username, deadline=30)
-        if response.status_code == 200:
-            bs = BeautifulSoup(response.content, "html.parser")
-            commits_dict = {}
-            for date in date_range:
-                iso_date = tools.iso_date(date)
-                commits_on_day = bs.find('rect', {'data-date': iso_date}).get('data-count', 0)
-                commits_dict[date] = commits_on_day
-            return commits_dict
-        else:
-            logging.error("Error getting contributions")
+        if memcache.get(self._calendar_mckey()) is None:
+            rpc = urlfetch.create_rpc(deadline=30)
+            urlfetch.make_fetch_call(rpc, CONTRIBUTIONS_URL % self.github_username)
+            return rpc
+
+    def get_contribution_calendar(self, rpc=None, refresh=False):
+        '''
+        Contributions for the past year, from the public overview page (no
+        API yet), cached for the rest of the day
+
+        Args:
+            rpc: result of fetch_calendar_async, if started
+
+        Returns:
+            dict: ISO date -> count, or None on error
+        '''
+        mckey = self._calendar_mckey()
+        calendar = None if refresh else memcache.get(mckey)
+        if calendar is None:
+            if not rpc:
+                rpc = urlfetch.create_rpc(deadline=30)
+                urlfetch.make_fetch_call(rpc, CONTRIBUTIONS_URL % self.github_username)
+            response = rpc.get_result()
+            if response.status_code == 200:
+                calendar = parse_contributions(response.content)
+                memcache.set(mckey, calendar, time=CALENDAR_EXPIRY)
+            else:
+                logging.error("Error getting contributions")
+        return calendar
+
+    def get_contributions_on_date_range(self, date_range, rpc=None):
+        '''
+        Returns:
+            dict: date -> count (0 if not in calendar), or None on error
+        '''
+        calendar = self.get_contribution_calendar(rpc=rpc)
+        if calendar is not None:
+            return dict((date, calendar.get(tools.iso_date(date), 0)) for date in date_range)
+
+    def _calendar_mckey(self):
+        return CALENDAR_MCK % (self.user.key.id(), tools.iso_date(datetime.today()))
+
+
+def parse_contributions(html):
+    '''
+    Contribution counts from the calendar's rect elements, in one pass
+    over the page
+
+    >>> sorted(parse_contributions('<svg><rect class="day" data-count="3" data-date="2017-01-02"/><rect data-date="2017-01-03" data-count="0"></rect><rect width="10"/></svg>').items())
+    [('2017-01-02', 3), ('2017-01-03', 0)]
+    '''
+    calendar = {}
+    for m in RECT_RE.finditer(html):
+        attrs = m.group(1)
+        date, count = DATE_ATTR_RE.search(attrs), COUNT_ATTR_RE.search(attrs)
+        if date and count:
+            calendar[date.group(1)] = int(count.group(1))
+    return calendar
@@ -1,6 +1,7 @@
 import logging
+import hashlib
 from settings.secrets import GR_API_KEY
-from google.appengine.api import urlfetch
+from google.appengine.api import urlfetch, memcache
 from google.appengine.ext import ndb
 from lxml import etree
 from StringIO import StringIO
@@ -8,52 +9,120 @@ from models import Readable
 from constants import READABLE
 import urllib
 
+# Per user + shelf + page: content hash, ETag / Last-Modified, readable ids
+SYNC_MCK = "user:%s:goodreads:%s:%d"
+SYNC_EXPIRY = 60 * 60 * 24 * 7
+PER_PAGE = 200  # API max
+MAX_PAGES = 10
+
+
+def fetch_page(gr_user_id, shelf, page=1, cached=None):
+    '''
+    Conditional GET of one shelf page
+
+    Returns:
+        urlfetch response (status 304 if unchanged since cached)
+    '''
+    params = urllib.urlencode({
+        'shelf': shelf,
+        'key': GR_API_KEY,
+        'v': 2,
+        'per_page': PER_PAGE,
+        'page': page
+    })
+    url = "https://www.goodreads.com/review/list/%s.xml?%s" % (gr_user_id, params)
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached.get('etag')
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached.get('last_modified')
+    logging.debug("Fetching %s" % url)
+    return urlfetch.fetch(
+        url=url,
+        method=urlfetch.GET,
+        headers=headers,
+        validate_certificate=True)
+
+
+def _text(elem, path):
+    child = elem.find(path)
+    return child.text if child is not None else None
+
+
+def parse_shelf(xml):
+    '''
+    Incrementally parse a shelf page, clearing each review once read
+
+    Returns:
+        tuple: (list of Readable.CreateOrUpdateMulti items, more pages)
+    '''
+    items = []
+    more = False
+    for event, elem in etree.iterparse(StringIO(xml), events=('start', 'end')):
+        if event == 'start' and elem.tag == 'reviews':
+            end, total = elem.get('end'), elem.get('total')
+            if end and total:
+                more = int(end) < int(total)
+        elif event == 'end' and elem.tag == 'review':
+            book = elem.find('book')
+            if book is not None:
+                author = None
+                first_author = book.find('authors/author')
+                if first_author is not None:
+                    author = _text(first_author, 'name')
+                items.append(dict(source_id=_text(book, 'isbn13'),
+                                  title=_text(book, 'title'),
+                                  url=_text(book, 'link'), source='goodreads',
+                                  image_url=_text(book, 'image_url'), author=author,
+                                  type=READABLE.BOOK,
+                                  read=False))
+            elem.clear()
+    return (items, more)
+
 
 def get_books_on_shelf(user, shelf='currently-reading'):
     '''
-    Return JSON array {title, author, isbn, image}
+    Sync books on shelf (all pages) to readables. Pages unchanged since
+    the last sync (304, or same content hash) aren't parsed or written.
+
+    Returns:
+        tuple: (success, list of Readable())
     '''
     user_id = user.get_integration_prop('goodreads_user_id')
     readables = []
     success = False
     if user_id:
-        data = urllib.urlencode({
-            'shelf': shelf,
-            'key': GR_API_KEY,
-            'v': 2
-        })
-        params = data
-        url = "https://www.goodreads.com/review/list/%s.xml?%s" % (user_id, params)
-        logging.debug("Fetching %s for %s" % (url, user))
-        res = urlfetch.fetch(
-            url=url,
-            method=urlfetch.GET,
-            validate_certificate=True)
-        logging.debug(res.status_code)
-        if res.status_code == 200:
-            xml = res.content
-            data = etree.parse(StringIO(xml))
-            for r in data.getroot().find('reviews').findall('review'):
-                book = r.find('book')
-                isbn = book.find('isbn13').text
-                image_url = book.find('image_url').text
-                title = book.find('title').text
-                authors = book.find('authors')
-                link = book.find('link').text
-                first_author = authors.find('author')
-                if first_author is not None:
-                    name = first_author.find('name')
-                    if name is not None:
-                        author = name.text
-                r = Readable.CreateOrUpdate(user, isbn, title=title,
-                                            url=link, source='goodreads',
-                                            image_url=image_url, author=author,
-                                            type=READABLE.BOOK,
-                                            read=False)
-                readables.append(r)
-            success = True
-        logging.debug("Putting %d readable(s)" % len(readables))
-        ndb.put_multi(readables)
-        Readable.put_sd_batch(readables)
+        success = True
+        for page in range(1, MAX_PAGES + 1):
+            mck = SYNC_MCK % (user.key.id(), shelf, page)
+            cached = memcache.get(mck)
+            res = fetch_page(user_id, shelf, page=page, cached=cached)
+            logging.debug(res.status_code)
+            if res.status_code == 304 and cached:
+                unchanged = True
+            elif res.status_code == 200:
+                content_hash = hashlib.md5(res.content).hexdigest()
+                unchanged = cached and cached.get('hash') == content_hash
+            else:
+                success = False
+                break
+            if unchanged:
+                keys = [ndb.Key('Readable', id, parent=user.key) for id in cached.get('ids', [])]
+                readables.extend([r for r in ndb.get_multi(keys) if r])
+                more = cached.get('more')
+            else:
+                items, more = parse_shelf(res.content)
+                logging.debug("Putting %d readable(s)" % len(items))
+                page_readables = [r for r in Readable.CreateOrUpdateMulti(user, items) if r]
+                readables.extend(page_readables)
+                memcache.set(mck, {
+                    'hash': content_hash,
+                    'etag': res.headers.get('ETag'),
+                    'last_modified': res.headers.get('Last-Modified'),
+                    'ids': [r.key.id() for r in page_readables],
+                    'more': more
+                }, time=SYNC_EXPIRY)
+            if not more:
+                break
     return (success, readables)
-
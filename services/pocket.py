@@ -1,10 +1,8 @@
 import logging
 from settings.secrets import POCKET_CONSUMER_KEY
 from google.appengine.api import urlfetch
-from google.appengine.ext import ndb
 from models import Readable
 import urllib
-from datetime import datetime, timedelta
 import json
 import tools
 import urlparse
@@ -16,6 +14,11 @@ POCKET_AUTHORIZE_REDIR = "https://getpocket.com/auth/authorize"
 POCKET_OAUTH_AUTHORIZE = "https://getpocket.com/v3/oauth/authorize"
 POCKET_FINISH_REDIRECT = "/app/integrations?action=pocket_finish"
 
+TS_KEY = 'pocket_last_timestamp'  # Seconds
+CHECKPOINT_KEY = 'pocket_sync_checkpoint'  # Paged sync in progress
+PAGE_SIZE = 200
+PAGES_PER_RUN = 5
+
 
 def get_request_token(base):
     '''
@@ -97,89 +100,163 @@ def update_article(access_token, item_id, action='favorite'):
     return False
 
 
-def sync(user, access_token):
+def parse_article(id, article):
+    '''
+    Readable.CreateOrUpdateMulti item for a Pocket article (see sync)
     '''
-    Return JSON array {title, author, isbn, image}
+    USE_RESOLVED_TITLE = True
+    if USE_RESOLVED_TITLE:
+        title = article.get('resolved_title')
+    else:
+        title = article.get('given_title')
+    url = article.get('given_url')
+    status = article.get('status')
+    authors = article.get('authors')
+    excerpt = article.get('excerpt')
+    images = article.get('images')
+    time_added = int(article.get('time_added', 0)) * 1000
+    time_read = int(article.get('time_read', 0)) * 1000
+    time_updated = int(article.get('time_updated', 0))
+    dt_added = tools.dt_from_ts(time_added)
+    dt_read = tools.dt_from_ts(time_read) if time_read else None
+    tags = article.get('tags', {}).keys()
+    word_count = int(article.get('word_count', 0))
+    favorite = int(article.get('favorite', 0)) == 1
+    image_url = None
+    author = None
+    if images:
+        first_image = images.get('1')
+        if first_image:
+            image_url = first_image.get('src')
+    if authors:
+        author_keys = authors.keys()
+        if author_keys:
+            author = authors.get(author_keys[0], {}).get('name')
+    archived = int(status) == 1
+    read = archived and (not tags or 'unread' not in tags)
+    return dict(source_id=id, title=title, url=url,
+                image_url=image_url, author=author,
+                excerpt=excerpt, favorite=favorite,
+                dt_added=dt_added, word_count=word_count,
+                dt_read=dt_read, source_ts=time_updated,
+                tags=tags, source='pocket', read=read,
+                update=dict(read=archived, favorite=favorite, dt_read=dt_read,
+                            source_ts=time_updated))
 
-    Sample dict from pocket:
 
-    {u'resolved_url': u'https://arxiv.org/abs/1701.06538', u'given_title': u'', u'is_article': u'1', u'sort_id': 16, u'word_count': u'221', u'status': u'0', u'has_image': u'0', u'given_url': u'https://arxiv.org/abs/1701.06538', u'favorite': u'0', u'has_video': u'0', u'time_added': u'1485774143', u'time_updated': u'1485774143', u'time_read': u'0', u'excerpt': u'Authors: Noam Shazeer, Azalia Mirhoseini, Krzysztof Maziarz, Andy Davis, Quoc Le, Geoffrey Hinton, Jeff Dean  Abstract: The capacity of a neural network to absorb information is limited by its number of parameters.', u'resolved_title': u'Title: Outrageously Large Neural Networks: The Sparsely-Gated Mixture-of-Experts Layer', u'authors': {u'32207876': {u'url': u'', u'author_id': u'32207876', u'item_id': u'1576987151', u'name': u'cscs.CLcs.NEstatstat.ML'}}, u'resolved_id': u'1576987151', u'item_id': u'1576987151', u'time_favorited': u'0', u'is_index': u'0'}
-    {u'resolved_url': u'http://lens.blogs.nytimes.com/2012/10/09/looking-into-the-eyes-of-made-in-china/', u'given_title': u'http://lens.blogs.nytimes.com/2012/10/09/looking-into-the-eyes-of-made-in-c', u'is_article': u'1', u'sort_id': 99, u'word_count': u'800', u'status': u'1', u'has_image': u'0', u'given_url': u'http://lens.blogs.nytimes.com/2012/10/09/looking-into-the-eyes-of-made-in-china/?partner=rss&emc=rss&smid=tw-nytimes', u'favorite': u'0', u'has_video': u'0', u'time_added': u'1349951324', u'time_updated': u'1482284773', u'time_read': u'1482284772', u'excerpt': u'Your clothes, your child\u2019s toys, even the device you use to read these words may have been made in China. They are among the $100 billion of goods that the United States imports from China each year \u2014 an exchange that has become an important issue in the 2012 presidential campaign.', u'resolved_title': u'Looking Into the Eyes of &#8216;Made in China&#8217;', u'authors': {u'3024958': {u'url': u'', u'author_id': u'3024958', u'item_id': u'233921121', u'name': u'KERRI MACDONALD'}}, u'resolved_id': u'233843309', u'item_id': u'233921121', u'time_favorited': u'0', u'is_index': u'0'}
+def fetch_page(access_token, since=None, offset=0, count=PAGE_SIZE):
     '''
-    dt = datetime.now() - timedelta(days=7)
-    init_sync_since = tools.unixtime(dt, ms=False)
-    TS_KEY = 'pocket_last_timestamp'  # Seconds
-    since_timestamp = user.get_integration_prop(TS_KEY, init_sync_since)
-    data = urllib.urlencode({
+    Returns:
+        tuple: (success, dict of articles by item id, server 'since' timestamp)
+    '''
+    params = {
         'access_token': access_token,
         'consumer_key': POCKET_CONSUMER_KEY,
         'detailType': 'complete',
-        'since': since_timestamp,
-        'state': 'all'
-    })
-    success = False
-    logging.debug("Syncing pocket for %s since %s" % (user, dt))
+        'state': 'all',
+        'sort': 'oldest',
+        'count': count,
+        'offset': offset
+    }
+    if since:
+        params['since'] = since
     res = urlfetch.fetch(
         url=GET_ENDPOINT,
-        payload=data,
+        payload=urllib.urlencode(params),
         method=urlfetch.POST,
         deadline=60,
         validate_certificate=True)
     logging.debug(res.status_code)
-    latest_timestamp = 0
-    readables = []
     if res.status_code == 200:
         data = json.loads(res.content)
-        articles = data.get('list', {})
-        latest_timestamp = data.get('since', 0) #?
-        save = []
-        USE_RESOLVED_TITLE = True
-        if articles:
-            for id, article in articles.items():
-                source = 'pocket'
-                if USE_RESOLVED_TITLE:
-                    title = article.get('resolved_title')
-                else:
-                    title = article.get('given_title')
-                url = article.get('given_url')
-                status = article.get('status')
-                authors = article.get('authors')
-                excerpt = article.get('excerpt')
-                images = article.get('images')
-                time_added = int(article.get('time_added', 0)) * 1000
-                time_read = int(article.get('time_read', 0)) * 1000
-                dt_added = tools.dt_from_ts(time_added)
-                dt_read = tools.dt_from_ts(time_read) if time_read else None
-                tags = article.get('tags', {}).keys()
-                word_count = int(article.get('word_count', 0))
-                favorite = int(article.get('favorite', 0)) == 1
-                image_url = None
-                author = None
-                if images:
-                    first_image = images.get('1')
-                    if first_image:
-                        image_url = first_image.get('src')
-                if authors:
-                    author_keys = authors.keys()
-                    if author_keys:
-                        author = authors.get(author_keys[0], {}).get('name')
-                archived = int(status) == 1
-                read = archived and (not tags or 'unread' not in tags)
-                r = Readable.CreateOrUpdate(user, source_id=id, title=title, url=url,
-                                            image_url=image_url, author=author,
-                                            excerpt=excerpt, favorite=favorite,
-                                            dt_added=dt_added, word_count=word_count,
-                                            dt_read=dt_read,
-                                            tags=tags, source=source, read=read)
-                if r:
-                    r.Update(read=archived, favorite=favorite, dt_read=dt_read)
-                    save.append(r)
-                    readables.append(r)
-        ndb.put_multi(save)  # Save all
-        Readable.put_sd_batch(save)
-        user.set_integration_prop(TS_KEY, latest_timestamp)
-        success = True
+        articles = data.get('list') or {}  # Empty page is a list
+        return (True, articles, data.get('since', 0))
     else:
         logging.debug(res.headers)
-    return (success, readables, latest_timestamp)
+    return (False, {}, 0)
+
+
+def sync(user, access_token, max_pages=PAGES_PER_RUN):
+    '''
+    Sync articles changed since the last completed sync (the full library
+    on first sync), PAGE_SIZE articles per request, each page written as
+    it arrives. Articles whose time_updated matches the stored readable
+    are not re-written.
+
+    Progress is checkpointed in the user's integration props, putting the
+    user after every page so a deadline mid-run loses at most one page,
+    and resumed by the next call (see queue_continue_sync). The last sync
+    timestamp is only advanced once all pages are done.
+
+    Returns:
+        tuple: (success, readables, latest_timestamp, more)
 
+    Sample dict from pocket:
+
+    {u'resolved_url': u'https://arxiv.org/abs/1701.06538', u'given_title': u'', u'is_article': u'1', u'sort_id': 16, u'word_count': u'221', u'status': u'0', u'has_image': u'0', u'given_url': u'https://arxiv.org/abs/1701.06538', u'favorite': u'0', u'has_video': u'0', u'time_added': u'1485774143', u'time_updated': u'1485774143', u'time_read': u'0', u'excerpt': u'Authors: Noam Shazeer, Azalia Mirhoseini, Krzysztof Maziarz, Andy Davis, Quoc Le, Geoffrey Hinton, Jeff Dean  Abstract: The capacity of a neural network to absorb information is limited by its number of parameters.', u'resolved_title': u'Title: Outrageously Large Neural Networks: The Sparsely-Gated Mixture-of-Experts Layer', u'authors': {u'32207876': {u'url': u'', u'author_id': u'32207876', u'item_id': u'1576987151', u'name': u'cscs.CLcs.NEstatstat.ML'}}, u'resolved_id': u'1576987151', u'item_id': u'1576987151', u'time_favorited': u'0', u'is_index': u'0'}
+    {u'resolved_url': u'http://lens.blogs.nytimes.com/2012/10/09/looking-into-the-eyes-of-made-in-china/', u'given_title': u'http://lens.blogs.nytimes.com/2012/10/09/looking-into-the-eyes-of-made-in-c', u'is_article': u'1', u'sort_id': 99, u'word_count': u'800', u'status': u'1', u'has_image': u'0', u'given_url': u'http://lens.blogs.nytimes.com/2012/10/09/looking-into-the-eyes-of-made-in-china/?partner=rss&emc=rss&smid=tw-nytimes', u'favorite': u'0', u'has_video': u'0', u'time_added': u'1349951324', u'time_updated': u'1482284773', u'time_read': u'1482284772', u'excerpt': u'Your clothes, your child\u2019s toys, even the device you use to read these words may have been made in China. They are among the $100 billion of goods that the United States imports from China each year \u2014 an exchange that has become an important issue in the 2012 presidential campaign.', u'resolved_title': u'Looking Into the Eyes of &#8216;Made in China&#8217;', u'authors': {u'3024958': {u'url': u'', u'author_id': u'3024958', u'item_id': u'233921121', u'name': u'KERRI MACDONALD'}}, u'resolved_id': u'233843309', u'item_id': u'233921121', u'time_favorited': u'0', u'is_index': u'0'}
+    '''
+    checkpoint = user.get_integration_prop(CHECKPOINT_KEY)
+    if checkpoint:
+        since = checkpoint.get('since')
+        offset = checkpoint.get('offset', 0)
+        latest_timestamp = checkpoint.get('latest', 0)
+    else:
+        since = user.get_integration_prop(TS_KEY)
+        offset = 0
+        latest_timestamp = 0
+    logging.debug("Syncing pocket for %s since %s from offset %d" % (user, since, offset))
+    success = True
+    more = True
+    readables = []
+    for page in range(max_pages):
+        ok, articles, page_since = fetch_page(access_token, since=since, offset=offset)
+        if not ok:
+            success = False
+            break
+        if not latest_timestamp:
+            # Server time of the first request, so changes made while
+            # paging are picked up by the next sync
+            latest_timestamp = page_since
+        items = [parse_article(id, article) for id, article in articles.items()]
+        readables.extend([r for r in Readable.CreateOrUpdateMulti(user, items) if r])
+        offset += len(articles)
+        more = len(articles) >= PAGE_SIZE
+        if more:
+            user.set_integration_prop(CHECKPOINT_KEY, {
+                'since': since,
+                'offset': offset,
+                'latest': latest_timestamp
+            })
+        else:
+            user.set_integration_prop(TS_KEY, latest_timestamp)
+            user.set_integration_prop(CHECKPOINT_KEY, None)
+        user.put()
+        if not more:
+            break
+    return (success, readables, latest_timestamp, more)
+
+
+def continue_sync(user_id):
+    '''
+    Task continuation for a sync with pages remaining
+    '''
+    from models import User
+    user = User.get_by_id(user_id)
+    access_token = user.get_integration_prop('pocket_access_token') if user else None
+    if access_token:
+        success, readables, latest_timestamp, more = sync(user, access_token)
+        logging.debug("Continued pocket sync for %s: %d readables" % (user, len(readables)))
+        if success and more:
+            queue_continue_sync(user)
+
+
+def queue_continue_sync(user):
+    '''
+    Queue continue_sync from the user's checkpoint. The task is named by
+    user and checkpoint, so syncs reaching the same checkpoint (e.g. cron
+    and a manual sync) continue as a single chain.
+    '''
+    checkpoint = user.get_integration_prop(CHECKPOINT_KEY) or {}
+    tools.safe_add_task(continue_sync, user.key.id(), _name="pocket-sync-%s-%s-%s" % (
+        user.key.id(), int(checkpoint.get('since') or 0), checkpoint.get('offset', 0)))
@@ -9,6 +9,15 @@ describe('util.type_check', function() {
  });
 });
 
+describe('util.take_initial_data', function() {
+ it('returns preloaded data once', function() {
+   window.initial_data = {tasks: [{id: 1}]};
+   expect(util.take_initial_data('tasks')[0].id).toBe(1);
+   expect(util.take_initial_data('tasks')).toBeUndefined();
+   expect(util.take_initial_data('habits')).toBeUndefined();
+ });
+});
+
 describe('util.toggleInList', function() {
  it('removes "dog" from a short array', function() {
    var res = util.toggleInList(["dog","cat"], "dog");
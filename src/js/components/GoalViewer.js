@@ -106,6 +106,11 @@ export default class GoalViewer extends React.Component {
   }
 
   fetch_current() {
+    let goals = util.take_initial_data('goals');
+    if (goals) {
+      this.setState({annual: goals.annual, monthly: goals.monthly, longterm: goals.longterm});
+      return;
+    }
     api.get("/api/goal/current", {}, (res) => {
       let st = {annual: res.annual, monthly: res.monthly, longterm: res.longterm};
       this.setState(st);
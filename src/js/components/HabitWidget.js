@@ -74,6 +74,12 @@ export default class HabitWidget extends React.Component {
   }
 
   fetch_current() {
+    let habits = util.take_initial_data('habits');
+    let habitdays = util.take_initial_data('habitdays');
+    if (habits && habitdays && this.props.days == 7) {
+      this.setState({habits: habits, habitdays: habitdays, habit_week_start: this.get_habit_week_start()});
+      return;
+    }
     api.get("/api/habit/recent", {days: this.props.days}, (res) => {
       // dict of ids to habit days (if present)
       this.setState({habits: res.habits, habitdays: res.habitdays, habit_week_start: this.get_habit_week_start()});
@@ -110,11 +110,16 @@ export default class MiniJournalWidget extends React.Component {
 
   check_if_not_submitted() {
     // If not yet submitted for day, show dialog
-    api.get("/api/journal/today", {}, (res) => {
-      let not_submitted = !res.journal || (res.journal && !res.journal.data);
+    let on_journal = (journal) => {
+      let not_submitted = !journal || (journal && !journal.data);
       this.setState({submitted: !not_submitted}, () => {
         if (not_submitted) this.open_journal_dialog();
       });
+    }
+    let preloaded = util.take_initial_data('journal');
+    if (preloaded !== undefined) on_journal(preloaded);
+    else api.get("/api/journal/today", {}, (res) => {
+      on_journal(res.journal);
     });
   }
 
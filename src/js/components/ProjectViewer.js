@@ -7,6 +7,7 @@ var MobileDialog = require('components/common/MobileDialog');
 var ProjectLI = require('components/list_items/ProjectLI');
 var ProjectAnalysis = require('components/ProjectAnalysis');
 var ProjectStore = require('stores/ProjectStore');
+var ProjectActions = require('actions/ProjectActions');
 var util = require('utils/util');
 import connectToStores from 'alt-utils/lib/connectToStores';
 
@@ -50,7 +51,9 @@ export default class ProjectViewer extends React.Component {
   }
 
   fetch_projects() {
-    ProjectStore.fetchProjects()
+    let projects = util.take_initial_data('projects');
+    if (projects) ProjectActions.gotProjects({projects: projects});
+    else ProjectStore.fetchProjects()
   }
 
   due_in_days(p) {
@@ -62,6 +62,11 @@ export default class ReadWidget extends React.Component {
   }
 
   fetch_readables() {
+    let readables = util.take_initial_data('readables');
+    if (readables) {
+      this.merge_readables(readables);
+      return;
+    }
     api.get("/api/readable", {unread: 1}, (res) => {
       this.merge_readables(res.readables);
     });
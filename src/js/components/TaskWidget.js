@@ -69,6 +69,11 @@ class TaskWidget extends React.Component {
   }
 
   fetch_recent() {
+    let tasks = util.take_initial_data('tasks');
+    if (tasks) {
+      this.setState({tasks: tasks});
+      return;
+    }
     api.get("/api/task", {}, (res) => {
       this.setState({tasks: res.tasks});
     });
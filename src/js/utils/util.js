@@ -4,6 +4,15 @@ import {findIndexById} from 'utils/store-utils';
 
 var util = {
 
+    take_initial_data(key) {
+        // Dashboard data embedded in the page (see views.preload_dashboard).
+        // Returned once, later fetches go to the API.
+        if (typeof initial_data == 'undefined' || !initial_data || !(key in initial_data)) return undefined;
+        let data = initial_data[key];
+        delete initial_data[key];
+        return data;
+    },
+
     ListPop: function(keyval, list, _key) {
         var key = _key || "id";
         for (var i=0; i<list.length; i++) {
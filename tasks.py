@@ -4,6 +4,8 @@ import handlers
 from google.appengine.ext import ndb
 from datetime import datetime, timedelta, time
 import tools
+import json
+import hashlib
 
 
 class WarmupHandler(handlers.BaseRequestHandler):
@@ -18,23 +20,17 @@ class SyncReadables(handlers.BaseRequestHandler):
     def get(self):
         from services import pocket, goodreads
         logging.debug("Running SyncReadables cron...")
-        TS_KEY = 'pocket_last_timestamp'
         users = User.SyncActive(['pocket', 'goodreads'])
-        user_put = []
         for user in users:
-            # Pocket
-            user_changes = False
+            # Pocket (checkpoints saved by sync)
             access_token = user.get_integration_prop('pocket_access_token')
             if access_token:
-                success, readables, latest_timestamp = pocket.sync(user, access_token)
+                success, readables, latest_timestamp, more = pocket.sync(user, access_token)
                 logging.debug("Got %d readables from pocket" % len(readables))
-                user.set_integration_prop(TS_KEY, latest_timestamp)
-                user_changes = True
+                if success and more:
+                    pocket.queue_continue_sync(user)
             success, readables = goodreads.get_books_on_shelf(user, shelf='currently-reading')
             logging.debug("Got %d readables from good reads" % len(readables))
-            if user_changes:
-                user_put.append(user)
-        ndb.put_multi(user_put)
 
 
 class SyncGithub(handlers.BaseRequestHandler):
@@ -49,24 +45,21 @@ class SyncGithub(handlers.BaseRequestHandler):
             last_date = (datetime.today() - timedelta(days=1))
         users = User.SyncActive('github')
         res = {}
-        td_put = []
+        date_range = [(last_date - timedelta(days=x)).date() for x in range(self.GH_COMMIT_OVERLAP)]
+        # Start all (uncached) page fetches before parsing any
+        clients = []
         for user in users:
             gh_client = GithubClient(user)
             if gh_client._can_run():
-                date_range = [(last_date - timedelta(days=x)).date() for x in range(self.GH_COMMIT_OVERLAP)]
-                logging.debug("Running SyncGithub cron for %s on %s..." % (user, date_range))
-                commits_dict = gh_client.get_contributions_on_date_range(date_range)
-                if commits_dict is not None:
-                    for date, n_commits in commits_dict.items():
-                        td = TrackingDay.Create(user, date)
-                        td.set_properties({
-                            'commits': n_commits
-                        })
-                        td_put.append(td)
+                clients.append((gh_client, gh_client.fetch_calendar_async()))
             else:
                 logging.debug("Github updater can't run")
-        if td_put:
-            ndb.put_multi(td_put)
+        for gh_client, rpc in clients:
+            logging.debug("Running SyncGithub cron for %s on %s..." % (gh_client.user, date_range))
+            commits_dict = gh_client.get_contributions_on_date_range(date_range, rpc=rpc)
+            if commits_dict is not None:
+                TrackingDay.MergeMany(gh_client.user, dict(
+                    (date, {'commits': n_commits}) for date, n_commits in commits_dict.items()))
         self.json_out(res)
 
 
@@ -85,9 +78,7 @@ class SyncFromGoogleFit(handlers.BaseRequestHandler):
                     var_durations = fit_client.aggregate_activity_durations(date)
                     logging.debug(var_durations)
                     if var_durations:
-                        td = TrackingDay.Create(user, date)
-                        td.set_properties(var_durations)
-                        td.put()
+                        TrackingDay.MergeMany(user, {date: var_durations})
             else:
                 logging.debug("Fit not authorized")
         self.json_out(res, debug=True)
@@ -136,3 +127,131 @@ def backgroundReportRun(rkey, start_cursor=None):
     r = rkey.get()
     if r:
         r.run(start_cursor=start_cursor)
+
+
+def backgroundImportRun(ikey):
+    from imports import ImportWorker
+    imp = ndb.Key(urlsafe=ikey).get()
+    if imp and not imp.is_done():
+        done = ImportWorker(imp).run()
+        if not done:
+            tools.safe_add_task(backgroundImportRun, ikey, _queue="import-queue")
+
+
+def rebuildReadingStats(user_id, cursor=None):
+    '''
+    Count a user's readables into ReadingStats a page (transaction) at a
+    time, then mark the stats rebuilt
+    '''
+    from models import ReadingStats
+    user_key = ndb.Key('User', user_id)
+    cursor = ReadingStats.RecountPage(user_key, cursor=cursor)
+    if cursor:
+        tools.safe_add_task(rebuildReadingStats, user_id, cursor=cursor)
+    else:
+        ReadingStats.MarkRebuilt(user_key)
+
+
+def queueReadingStatsRebuild(user):
+    '''
+    One rebuild chain per user (task name), for stats predating tracking
+    '''
+    tools.safe_add_task(rebuildReadingStats, user.key.id(),
+                        _name="reading-stats-rebuild-%s" % user.key.id())
+
+
+EVERNOTE_QUEUE = "evernote-queue"  # Pull queue of webhook notifications, tagged by evernote user id
+EVERNOTE_COALESCE_SECS = 10
+EVERNOTE_LEASE_SECS = 120
+EVERNOTE_LEASE_MAX = 100
+EVERNOTE_MAX_LEASES = 5  # Notes failing this many runs are dropped
+
+
+def queueEvernoteNote(evernote_id, note_guid, notebook_guid=None):
+    '''
+    Queue a note notification for processEvernoteQueue
+
+    One worker is scheduled per user per EVERNOTE_COALESCE_SECS window (task
+    name), running after the window ends, so a burst of notes is handled
+    by a single worker run.
+    '''
+    from google.appengine.api import taskqueue
+    taskqueue.Queue(EVERNOTE_QUEUE).add(taskqueue.Task(
+        method='PULL', tag=evernote_id,
+        payload=json.dumps({'guid': note_guid, 'notebook_guid': notebook_guid})))
+    # Task names only allow [a-zA-Z0-9_-], hash the id from the webhook
+    window = int(tools.unixtime(ms=False)) / EVERNOTE_COALESCE_SECS
+    tools.safe_add_task(processEvernoteQueue, evernote_id,
+                        _name="evernote-%s-%d" % (hashlib.md5(str(evernote_id)).hexdigest(), window),
+                        _countdown=EVERNOTE_COALESCE_SECS)
+
+
+def processEvernoteQueue(evernote_id):
+    '''
+    Lease all queued notes for an Evernote user, fetch them and write the
+    resulting readables (articles) and quotes (excerpts) in batches
+
+    A follow-up worker is scheduled once the first batch is leased, running
+    after the lease expires, so notes left leased by a failed run are
+    retried (up to EVERNOTE_MAX_LEASES times) without a new notification.
+    '''
+    from google.appengine.api import taskqueue
+    from services import flow_evernote
+    from models import Readable, Quote
+    queue = taskqueue.Queue(EVERNOTE_QUEUE)
+    user = None
+    follow_up = False
+    while True:
+        leased = queue.lease_tasks_by_tag(EVERNOTE_LEASE_SECS, EVERNOTE_LEASE_MAX, tag=evernote_id)
+        if not leased:
+            break
+        if not follow_up:
+            tools.safe_add_task(processEvernoteQueue, evernote_id,
+                                _countdown=EVERNOTE_LEASE_SECS + EVERNOTE_COALESCE_SECS)
+            follow_up = True
+        dropped = [task for task in leased if task.retry_count >= EVERNOTE_MAX_LEASES]
+        if dropped:
+            logging.warning("Dropping %d evernote note(s) after repeated failures" % len(dropped))
+            queue.delete_tasks(dropped)
+            leased = [task for task in leased if task.retry_count < EVERNOTE_MAX_LEASES]
+            if not leased:
+                continue
+        if not user:
+            user = User.GetByEvernoteId(evernote_id)
+            if not user:
+                logging.warning("User not found")
+                queue.delete_tasks(leased)
+                break
+        config_notebook_ids = user.get_integration_prop('evernote_notebook_ids', default='').split(',')  # Comma sep
+        max_quote_length = user.get_integration_prop('evernote_max_quote_length', 1200)
+        readable_items = []
+        quotes = []
+        sources = {}  # Quote readable resolutions for this batch
+        seen = set()
+        for task in leased:
+            note = json.loads(task.payload)
+            guid = note.get('guid')
+            if guid in seen:
+                continue
+            seen.add(guid)
+            if note.get('notebook_guid') not in config_notebook_ids:
+                logging.warning("Note from ignored notebook")
+                continue
+            uid, title, content, url = flow_evernote.get_note(user, guid)
+            if title and content:
+                # TODO: Tags (come in as guids)
+                is_article = len(content) > max_quote_length or title in content
+                if is_article:
+                    # Treat as article
+                    readable_items.append(dict(source_id=uid, source='evernote', url=url, title=title))
+                else:
+                    # Treat as quote/excerpt
+                    q = Quote.Create(user, source=title, content=content, sources=sources)
+                    q.Update(link=url)
+                    quotes.append(q)
+            else:
+                logging.warning("Failed to parse note %s" % guid)
+        Readable.CreateOrUpdateMulti(user, readable_items)
+        ndb.put_multi(quotes)
+        queue.delete_tasks(leased)
+        logging.debug("Processed %d evernote note(s) for %s" % (len(leased), user))
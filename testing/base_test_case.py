@@ -324,11 +324,11 @@ class BaseTestCase(unittest.TestCase):
         else:
             self.assertEqual(n, len(tasks))
 
-    def clear_task_queue(self):
-        """Clear all task queues"""
+    def clear_task_queue(self, queue_names=None):
+        """Clear all (or the named) task queues"""
 
         stub = self.get_task_queue_stub()
-        for name in self.get_task_queue_names():
+        for name in queue_names or self.get_task_queue_names():
             stub.FlushQueue(name)
 
     def is_deferred_task(self, task):
@@ -409,12 +409,15 @@ class BaseTestCase(unittest.TestCase):
                     break
             return found
 
-    def get_task_queue_names(self):
+    def get_task_queue_names(self, push_only=False):
         """Get all task names from all queues
 
+            push_only - skip pull queues (tasks there are leased by workers)
+
             Returns: array of task queue names
         """
-        return [q['name'] for q in self.get_task_queues()]
+        return [q['name'] for q in self.get_task_queues()
+                if not push_only or q.get('mode') != 'pull']
 
     def execute_task(self, task, application=None):
         """Execute task and remove it from the queue"""
@@ -450,8 +453,9 @@ class BaseTestCase(unittest.TestCase):
         """
 
         # Get all of the tasks, and then clear them.
-        tasks = self.get_tasks()
-        self.clear_task_queue()
+        queue_names = self.get_task_queue_names(push_only=True)
+        tasks = self.get_tasks(queue_names=queue_names)
+        self.clear_task_queue(queue_names=queue_names)
 
         # Run each of the tasks, checking that they succeeded.
         for task in tasks:
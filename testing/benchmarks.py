@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+# Benchmarks for hot API routes against a synthetic user (see synthetic.py)
+#
+# Not collected by the default test run (file name doesn't match test*.py).
+# Run with scripts/run_benchmarks.sh [size]. Each route is requested
+# BENCH_RUNS times and latency, RPC counts and datastore entities read are
+# reported per route as JSON (stdout, and BENCH_OUTPUT if set) to compare
+# against a baseline from another branch.
+#
+# The report benchmark runs every report type through the worker pipeline
+# (GCS client stub) and, given a previous report as BENCH_BASELINE, fails
+# when a metric regresses by more than BENCH_THRESHOLD (fraction).
+
+import os
+import json
+import resource
+import threading
+import cloudstorage as gcs
+from google.appengine.api import memcache
+from datetime import datetime, timedelta
+from base_test_case import BaseTestCase
+from flow import app as tst_app
+from constants import REPORT
+from models import Report
+from common import instrumentation
+import reports
+import synthetic
+import tools
+
+BENCH_SIZE = os.environ.get('BENCH_SIZE', 'small')
+BENCH_RUNS = int(os.environ.get('BENCH_RUNS', 5))
+BENCH_OUTPUT = os.environ.get('BENCH_OUTPUT')
+BENCH_BASELINE = os.environ.get('BENCH_BASELINE')
+BENCH_THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.2))
+BENCH_REPORT_BATCH = int(os.environ.get('BENCH_REPORT_BATCH', reports.BATCH_SIZE))
+
+REPORT_TYPES = [REPORT.HABIT_REPORT, REPORT.TASK_REPORT, REPORT.GOAL_REPORT,
+                REPORT.JOURNAL_REPORT, REPORT.EVENT_REPORT, REPORT.PROJECT_REPORT]
+
+# Report metrics guarded against regression (True: higher is better)
+REPORT_METRICS = {
+    'rows_per_sec': True,
+    'rpcs_per_batch': False,
+    'flushes_per_row': False,
+    'continuations': False,
+    'peak_rss_delta_kb': False
+}
+
+
+def rss_kb():
+    '''
+    Current resident set size (Linux /proc), None where unavailable
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+class RssSampler(threading.Thread):
+    '''
+    Peak RSS growth while running, sampled every INTERVAL_S. ru_maxrss is
+    the process-wide high-water mark, flat for any report staying below an
+    earlier peak, so it can't be compared per report.
+    '''
+    INTERVAL_S = 0.005
+
+    def __init__(self):
+        super(RssSampler, self).__init__()
+        self.daemon = True
+        self.done = threading.Event()
+        self.start_kb = self.peak_kb = rss_kb()
+
+    def run(self):
+        while self.start_kb is not None and not self.done.is_set():
+            self.peak_kb = max(self.peak_kb, rss_kb())
+            self.done.wait(self.INTERVAL_S)
+
+    def stop(self):
+        '''
+        Returns:
+            int: peak growth (kb) over RSS at start, None if not measurable
+        '''
+        self.done.set()
+        self.join()
+        if self.start_kb is not None:
+            return max(self.peak_kb, rss_kb()) - self.start_kb
+
+
+def summarize(label, summaries):
+    '''
+    Aggregate per-request instrumentation summaries for one route
+    '''
+    services = {}
+    for s in summaries:
+        for service, stats in s.get('services').items():
+            services.setdefault(service, []).append(stats['calls'])
+    return {
+        'route': label,
+        'n': len(summaries),
+        'ms_p50': instrumentation.percentile([s.get('total_ms') for s in summaries], 50),
+        'ms_p90': instrumentation.percentile([s.get('total_ms') for s in summaries], 90),
+        'rpcs': instrumentation.percentile([s.get('rpcs') for s in summaries], 50),
+        'entities': instrumentation.percentile([s.get('entities') for s in summaries], 50),
+        'calls': dict((service, instrumentation.percentile(calls, 50)) for service, calls in services.items())
+    }
+
+
+def regressions(results, baseline, threshold):
+    '''
+    Compare report metrics against a baseline run
+
+    >>> regressions({'1': {'rows_per_sec': 70.}}, {'1': {'rows_per_sec': 100.}}, 0.2)
+    ['1 rows_per_sec: 70.0 vs baseline 100.0']
+    >>> regressions({'1': {'rpcs_per_batch': 11.}}, {'1': {'rpcs_per_batch': 10.}}, 0.2)
+    []
+    >>> regressions({'1': {'continuations': 1}}, {'1': {'continuations': 0}}, 0.2)
+    ['1 continuations: 1 vs baseline 0']
+    '''
+    res = []
+    for key, metrics in sorted(results.items()):
+        base = baseline.get(key, {})
+        for metric, higher_better in sorted(REPORT_METRICS.items()):
+            value, base_value = metrics.get(metric), base.get(metric)
+            # Only skip metrics missing from either run; a zero baseline
+            # (e.g. no continuations) is guarded like any other
+            if value is None or base_value is None:
+                continue
+            if higher_better:
+                regressed = value < base_value * (1 - threshold)
+            else:
+                regressed = value > base_value * (1 + threshold)
+            if regressed:
+                res.append("%s %s: %s vs baseline %s" % (key, metric, value, base_value))
+    return res
+
+
+class BenchmarkTestCases(BaseTestCase):
+
+    def setUp(self):
+        self.set_application(tst_app)
+        self.setup_testbed()
+        self.init_standard_stubs()
+        self.init_app_basics()
+        self.u = self.users[0]
+        self.today = datetime.today()
+        self.seeded = synthetic.seed_user(self.u, size=BENCH_SIZE, today=self.today)
+        self.clearNDBCache()
+
+    def _bench_get(self, url, params):
+        summaries = []
+        for i in range(BENCH_RUNS):
+            self.clearNDBCache()
+            self.get_json(url, params, headers=self.api_headers)
+            summaries.append(instrumentation.last())
+        return summaries
+
+    def _bench_report(self, type):
+        summaries = []
+        for i in range(BENCH_RUNS):
+            self.post_json("/api/report/generate", {'type': type}, headers=self.api_headers)
+            # Dispatch ended tracking for the request, restart for the task run
+            request_summary = instrumentation.last()
+            instrumentation.begin()
+            self.execute_tasks_until_empty()
+            summary = instrumentation.end()
+            summary['total_ms'] += request_summary.get('total_ms')
+            summaries.append(summary)
+        return summaries
+
+    def test_benchmark_routes(self):
+        days = synthetic.SIZES.get(BENCH_SIZE, synthetic.SIZES['small'])['days']
+        start = tools.iso_date(self.today - timedelta(days=days - 1))
+        end = tools.iso_date(self.today)
+        routes = [
+            ("/api/habit/range", {'start_date': start, 'end_date': end}),
+            ("/api/analysis", {'date_start': start, 'date_end': end, 'with_habits': 1}),
+            ("/api/task", {'with_archived': 1}),
+            ("/api/readable/search", {'term': 'focus'}),
+            ("/api/dashboard", {})
+        ]
+        results = []
+        for url, params in routes:
+            results.append(summarize(url, self._bench_get(url, params)))
+        results.append(summarize("report:task", self._bench_report(REPORT.TASK_REPORT)))
+        results.append(summarize("report:habit", self._bench_report(REPORT.HABIT_REPORT)))
+
+        report = {
+            'size': BENCH_SIZE,
+            'runs': BENCH_RUNS,
+            'seeded': self.seeded,
+            'routes': results
+        }
+        out = json.dumps(report, indent=2, sort_keys=True)
+        print out
+        if BENCH_OUTPUT:
+            with open(BENCH_OUTPUT, 'w') as f:
+                f.write(out)
+        self.assertEqual(len(results), len(routes) + 2)
+
+    def _run_report(self, type):
+        report = Report.Create(self.u, type=type)
+        report.put()
+        sampler = RssSampler()
+        sampler.start()
+        instrumentation.begin()
+        report.run()
+        self.execute_tasks_until_empty()
+        summary = instrumentation.end()
+        peak_rss_delta_kb = sampler.stop()
+        report = report.key.get()
+        progress = memcache.get(reports.MC_EXPORT_STATUS % report.key) or {}
+        counters = progress.get('counters', {})
+        rows = counters.get('run', 0)
+        batches = counters.get('batches', 0)
+        elapsed_s = summary.get('total_ms') / 1000.
+        return {
+            'rows': rows,
+            'rows_per_sec': round(rows / elapsed_s, 1) if elapsed_s else None,
+            'batches': batches,
+            'rpcs_per_batch': round(summary.get('rpcs') / float(batches), 1) if batches else None,
+            'entities_per_row': round(summary.get('entities') / float(rows), 2) if rows else None,
+            'flushes': counters.get('flushes', 0),
+            'flushes_per_row': round(counters.get('flushes', 0) / float(rows), 2) if rows else None,
+            'continuations': counters.get('continuations', 0),
+            'gcs_bytes': gcs.stat(report.get_gcs_file()).st_size if report.get_gcs_file() else 0,
+            'peak_rss_delta_kb': peak_rss_delta_kb,
+            'done': report.is_done()
+        }
+
+    def test_benchmark_reports(self):
+        reports.BATCH_SIZE = BENCH_REPORT_BATCH
+        results = {}
+        for type in REPORT_TYPES:
+            results[str(type)] = self._run_report(type)
+            results[str(type)]['type'] = REPORT.TYPE_LABELS.get(type)
+        out = json.dumps({
+            'size': BENCH_SIZE,
+            'batch_size': BENCH_REPORT_BATCH,
+            'seeded': self.seeded,
+            'reports': results
+        }, indent=2, sort_keys=True)
+        print out
+        if BENCH_OUTPUT:
+            with open(BENCH_OUTPUT.replace('.json', '') + '.reports.json', 'w') as f:
+                f.write(out)
+        for key, res in results.items():
+            self.assertTrue(res.get('done'), "Report type %s not done" % key)
+        if BENCH_BASELINE:
+            with open(BENCH_BASELINE) as f:
+                baseline = json.load(f).get('reports', {})
+            regressed = regressions(results, baseline, BENCH_THRESHOLD)
+            self.assertEqual(regressed, [], "Report regressions: %s" % '; '.join(regressed))
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+# Synthetic user data for benchmarks and load tests
+#
+# Datasets are reproducible (seeded RNG per user) and shaped like real
+# usage: habits done in streaks, tasks due on weekday evenings and mostly
+# completed around their due date, journals answering the user's configured
+# questions (tags in text responses), and tagged readables.
+# Entities are built directly (no per-entity get_or_insert / lookups) and
+# written with chunked put_multi so large users seed quickly.
+
+import hashlib
+import random
+from datetime import datetime, timedelta
+from models import User, Habit, HabitDay, Task, Project, MiniJournal, \
+    JournalTag, Readable, ReadingStats, Quote, Goal, Event, UserVersioned
+from constants import TASK, READABLE, JOURNALTAG, DEFAULT_USER_SETTINGS
+import tools
+
+PUT_BATCH = 500
+PASSWORD = "pw"
+
+# Named sizes (habits x days of HabitDay, plus collection sizes)
+SIZES = {
+    'small': {'habits': 3, 'days': 30, 'projects': 3, 'tasks': 200, 'readables': 100, 'quotes': 100, 'journals': 30},
+    'medium': {'habits': 8, 'days': 180, 'projects': 10, 'tasks': 1000, 'readables': 500, 'quotes': 500, 'journals': 180},
+    'large': {'habits': 15, 'days': 365, 'projects': 25, 'tasks': 5000, 'readables': 2000, 'quotes': 2000, 'journals': 365},
+    'years': {'habits': 10, 'days': 365 * 3, 'projects': 40, 'tasks': 8000, 'readables': 3000, 'quotes': 3000, 'journals': 365 * 3}
+}
+
+WORDS = ["focus", "deep", "work", "read", "write", "plan", "review", "call",
+         "garden", "budget", "email", "design", "draft", "ship", "learn", "run"]
+PEOPLE = ["Alice", "Bruno", "Chen", "Dana", "Emeka", "Farah", "Gus", "Hana"]
+ACTIVITIES = ["Running", "Cooking", "Climbing", "Reading", "Movies", "Travel", "Yoga"]
+READABLE_TAGS = ["productivity", "history", "science", "economics", "fiction",
+                 "design", "health", "programming", "philosophy"]
+
+
+def _put(entities):
+    for chunk in tools.chunks(entities, PUT_BATCH):
+        UserVersioned.PutMulti(chunk)
+
+
+def _title(rnd, n_words=3):
+    return ' '.join(rnd.choice(WORDS) for i in range(n_words))
+
+
+def habit_days(rnd, user, habit, start, days):
+    '''
+    Done days follow a two-state chain, so they come in streaks: staying on
+    a streak is much likelier than restarting one. Per-habit adherence
+    varies between habits.
+    '''
+    adherence = rnd.uniform(0.3, 0.9)
+    p_continue = min(0.97, adherence + 0.15)
+    p_restart = adherence * (1 - p_continue) / (1 - adherence)
+    done = rnd.random() < adherence
+    res = []
+    for d in range(days):
+        done = rnd.random() < (p_continue if done else p_restart)
+        date = start + timedelta(days=d)
+        if done:
+            hd = HabitDay.Create(user, habit, date)
+            hd.done = True
+            res.append(hd)
+        elif rnd.random() < 0.1:
+            # Committed but not done
+            hd = HabitDay.Create(user, habit, date)
+            hd.committed = True
+            res.append(hd)
+    return res
+
+
+def task(rnd, user, start, days, today, projects):
+    '''
+    Due on a random day at a weekday-evening-skewed hour. Past tasks are
+    mostly done, typically on or shortly before / after the due date.
+    '''
+    due_date = start + timedelta(days=rnd.randint(0, days))
+    hour = rnd.choice([17, 18, 20, 22, 22]) if due_date.weekday() < 5 else rnd.randint(9, 22)
+    due = datetime.combine(due_date.date(), datetime.min.time()) + timedelta(hours=hour)
+    t = Task(title=tools.capitalize(_title(rnd)), dt_due=due, parent=user.key)
+    t.dt_created = due - timedelta(days=int(rnd.expovariate(1 / 2.)))
+    if projects and rnd.random() < 0.3:
+        t.project = rnd.choice(projects).key
+    if due < today and rnd.random() < 0.85:
+        t.status = TASK.DONE
+        t.dt_done = min(today, due + timedelta(hours=rnd.gauss(0, 18)))
+        t.archived = rnd.random() < 0.7
+    return t
+
+
+def journal_data(rnd, questions):
+    '''
+    Responses for the user's journal questions (text responses mention
+    @people and #activities)
+    '''
+    data = {}
+    for q in questions:
+        if q.get('response_type') == 'number':
+            data[q.get('name')] = max(1, min(10, int(rnd.gauss(7, 1.5))))
+        else:
+            mentions = ["@%s" % p for p in rnd.sample(PEOPLE, rnd.randint(0, 2))]
+            mentions += ["#%s" % a for a in rnd.sample(ACTIVITIES, rnd.randint(0, 2))]
+            data[q.get('name')] = ' '.join([_title(rnd, 5)] + mentions)
+    return data
+
+
+def seed_user(user, size='small', seed=1, today=None, **overrides):
+    '''
+    Seed a user with synthetic habits, habit days, projects, tasks,
+    journals (with tags), readables, quotes, goals and events
+
+    Args:
+        size (str): key of SIZES
+        overrides: per-collection counts replacing the size defaults
+
+    Returns:
+        dict: counts of entities created by collection
+    '''
+    rnd = random.Random(seed)
+    spec = dict(SIZES.get(size, SIZES['small']))
+    spec.update(overrides)
+    if not today:
+        today = datetime.today()
+    start = today - timedelta(days=spec['days'] - 1)
+
+    habits = []
+    for i in range(spec['habits']):
+        h = Habit.Create(user)
+        h.Update(name=_title(rnd, 2))
+        habits.append(h)
+    _put(habits)
+
+    habitdays = []
+    for h in habits:
+        habitdays.extend(habit_days(rnd, user, h, start, spec['days']))
+    _put(habitdays)
+
+    projects = []
+    for i in range(spec['projects']):
+        p = Project.Create(user)
+        p.Update(title=_title(rnd), subhead=_title(rnd, 5))
+        projects.append(p)
+    _put(projects)
+
+    tasks = [task(rnd, user, start, spec['days'], today, projects) for i in range(spec['tasks'])]
+    _put(tasks)
+
+    questions = tools.getJson(user.settings, {}).get('journals', {}).get('questions') or \
+        DEFAULT_USER_SETTINGS['journals']['questions']
+    parse_questions = [q.get('name') for q in questions if q.get('parse_tags')]
+    journals = []
+    journal_tags = {}
+    for d in range(min(spec['journals'], spec['days'])):
+        if rnd.random() < 0.15:
+            continue  # Skipped day
+        jrnl = MiniJournal.Create(user, date=(today - timedelta(days=d)).date())
+        data = journal_data(rnd, questions)
+        tag_keys = []
+        for name in parse_questions:
+            for word in data.get(name, '').split(' '):
+                if word[:1] in ['@', '#']:
+                    key = JournalTag.Key(user, word[1:], prefix=word[0])
+                    if key not in tag_keys:
+                        tag_keys.append(key)
+        for key in tag_keys:
+            if key.id() not in journal_tags:
+                journal_tags[key.id()] = JournalTag(id=key.id(), name=key.id()[1:], parent=user.key,
+                                                    type=JOURNALTAG.HASHTAG if key.id()[0] == '#' else JOURNALTAG.PERSON)
+            journal_tags[key.id()].record_use(jrnl.date, today=today.date())
+        jrnl.Update(data=data, tags=tag_keys)
+        journals.append(jrnl)
+    _put(journals)
+    _put(journal_tags.values())
+
+    readables = []
+    for i in range(spec['readables']):
+        source_id = str(100000 + i)
+        read = rnd.random() < 0.4
+        dt_added = today - timedelta(days=rnd.randint(0, spec['days']))
+        r = Readable(id="synthetic:%s" % source_id, parent=user.key,
+                     source_id=source_id, source="synthetic",
+                     title=tools.capitalize(_title(rnd, 4)),
+                     author="Author %d" % rnd.randint(1, 50),
+                     type=READABLE.BOOK if rnd.random() < 0.2 else READABLE.ARTICLE,
+                     dt_added=dt_added, read=read,
+                     dt_read=dt_added + timedelta(days=int(rnd.expovariate(1 / 5.))) if read else None,
+                     favorite=rnd.random() < 0.1,
+                     tags=rnd.sample(READABLE_TAGS, rnd.randint(0, 3)),
+                     word_count=int(rnd.lognormvariate(7.5, 0.7)))
+        r.generate_slug()
+        readables.append(r)
+    ReadingStats.Write(user, readables)
+    Readable.put_sd_batch(readables)
+
+    quotes = []
+    for i in range(spec['quotes']):
+        readable = rnd.choice(readables) if readables else None
+        source = readable.title if readable else _title(rnd)
+        content = "%s %d" % (_title(rnd, 12), i)
+        quotes.append(Quote(id=hashlib.md5('|'.join([source, content])).hexdigest(),
+                            source=source, content=content, parent=user.key,
+                            readable=readable.key if readable else None,
+                            dt_added=today - timedelta(days=rnd.randint(0, spec['days']))))
+    _put(quotes)
+
+    goals = []
+    for year in range(start.year, today.year + 1):
+        g = Goal.Create(user, str(year))
+        g.Update(text=[_title(rnd, 4) for i in range(3)])
+        goals.append(g)
+    cursor = datetime(start.year, start.month, 1)
+    while cursor <= today:
+        g = Goal.CreateMonthly(user, date=cursor)
+        g.Update(text=[_title(rnd, 4) for i in range(3)], assessments=[rnd.randint(1, 5) for i in range(3)])
+        goals.append(g)
+        cursor = datetime(cursor.year + cursor.month / 12, cursor.month % 12 + 1, 1)
+    _put(goals)
+
+    events = []
+    for i in range(spec.get('events', spec['days'] / 10)):
+        date_start = (start + timedelta(days=rnd.randint(0, spec['days']))).date()
+        events.append(Event.Create(user, date_start, date_end=date_start + timedelta(days=rnd.randint(0, 5)),
+                                   title=tools.capitalize(_title(rnd)), color='#%06x' % rnd.randint(0, 0xFFFFFF)))
+    _put(events)
+
+    return {
+        'habits': len(habits),
+        'habitdays': len(habitdays),
+        'projects': len(projects),
+        'tasks': len(tasks),
+        'journals': len(journals),
+        'journaltags': len(journal_tags),
+        'readables': len(readables),
+        'quotes': len(quotes),
+        'goals': len(goals),
+        'events': len(events)
+    }
+
+
+def seed_users(n_users, size='small', seed=1, today=None):
+    '''
+    Create and seed n_users (password PASSWORD), each with its own RNG seed
+    derived from seed, so a workload can be rebuilt exactly
+
+    Returns:
+        list of tuples: (User(), counts)
+    '''
+    res = []
+    for i in range(n_users):
+        user = User.Create(email="synthetic_%d_%d@example.com" % (seed, i), password=PASSWORD)
+        user.put()
+        res.append((user, seed_user(user, size=size, seed=seed * 100000 + i, today=today)))
+    return res
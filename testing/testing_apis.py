@@ -6,8 +6,9 @@ from base_test_case import BaseTestCase
 from models import Goal
 from flow import app as tst_app
 from constants import USER, TASK
-from models import Habit, Task, Project, Event, Readable, Quote, Snapshot
+from models import Habit, Task, Project, Event, Readable, Quote, Snapshot, TrackingDay, UserVersioned
 from services.agent import ConversationAgent
+from mock import patch, Mock
 import json
 import tools
 
@@ -92,11 +93,159 @@ class APITestCase(BaseTestCase):
         habitdays = response.get('habitdays')
         self.assertTrue(hd.get('id') in habitdays)
 
+        # Range with field selection
+        params['fields'] = 'done'
+        response = self.get_json("/api/habit/range", params, headers=self.api_headers)
+        self.assertEqual(sorted(response.get('habitdays')[hd.get('id')].keys()), ['done', 'id'])
+        self.assertEqual(response.get('habits')[0].keys(), ['id'])
+
+        # Batch (offline replay): toggle yesterday back off, mark two earlier days
+        DAY_2 = tools.iso_date(today - timedelta(days=2))
+        ops = [
+            {'habit_id': hid, 'date': DAY, 'op': 'toggle'},
+            {'habit_id': hid, 'date': DAY_2, 'op': 'toggle'},
+            {'habit_id': hid, 'date': DAY_2, 'op': 'commit'}
+        ]
+        response = self.post_json("/api/habit/batch", {'ops': json.dumps(ops)}, headers=self.api_headers)
+        self.assertTrue(response.get('success'))
+        batch_habitdays = dict((_hd.get('id'), _hd) for _hd in response.get('habitdays'))
+        self.assertEqual(len(batch_habitdays), 2)
+        self.assertFalse(batch_habitdays[hd.get('id')].get('done'))
+        self.assertTrue(batch_habitdays["habit:%s_day:%s" % (hid, DAY_2)].get('done'))
+
+        # Invalid ops are reported per op, valid ones still applied
+        ops = [
+            "toggle",
+            {'habit_id': hid, 'date': DAY, 'op': 'toggle'},
+            {'habit_id': hid, 'date': "yesterday", 'op': 'toggle'},
+            {'habit_id': hid, 'date': DAY, 'op': 'delete'}
+        ]
+        response = self.post_json("/api/habit/batch", {'ops': json.dumps(ops)}, headers=self.api_headers)
+        self.assertFalse(response.get('success'))
+        self.assertEqual([e.get('index') for e in response.get('errors')], [0, 2, 3])
+        self.assertTrue(response.get('habitdays')[0].get('done'))
+
         # Delete
         response = self.post_json("/api/habit/delete", {'id': h.get('id')}, headers=self.api_headers)
         h = Habit.get_by_id(h.get('id'), parent=self.u.key)
         self.assertIsNone(h)  # Confirm deletion
 
+    def test_timing_header(self):
+        res = self.get("/api/habit", headers=self.api_headers)
+        timing = res.headers.get('X-Flow-Timing')
+        self.assertTrue(timing.startswith('total='))
+        self.assertTrue('datastore_v3=' in timing)
+
+    def test_instrumentation_samples(self):
+        from common import instrumentation
+        for ms in [10., 30., 20.]:
+            instrumentation.record("HabitAPI.list", {'total_ms': ms, 'rpcs': 2})
+        stats = instrumentation.route_stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0].get('n'), 3)
+        self.assertEqual(stats[0].get('ms_p50'), 20.)
+
+        # Production: tracked only when sampled
+        with patch.object(instrumentation, 'verbose', return_value=False), \
+                patch.object(instrumentation, 'INSTRUMENT_SAMPLE_RATE', 0.0):
+            res = self.get("/api/habit", headers=self.api_headers)
+            self.assertIsNone(res.headers.get('X-Flow-Timing'))
+        self.assertEqual(instrumentation.route_stats()[0].get('n'), 3)
+
+    def test_profiled_request(self):
+        from common import profiling
+        headers = dict(self.api_headers)
+        headers[profiling.HEADER] = '1'
+        res = self.get("/api/habit", headers=headers)
+        profile_id = res.headers.get('X-Flow-Profile-Id')
+        self.assertIsNotNone(profile_id)
+        profile = profiling.get(profile_id)
+        self.assertEqual(profile.get('route'), 'HabitAPI.list')
+        self.assertTrue('cumulative' in profile.get('stats'))
+        self.assertEqual(profiling.recent()[0].get('id'), profile_id)
+
+        # Not profiled without header
+        res = self.get("/api/habit", headers=self.api_headers)
+        self.assertIsNone(res.headers.get('X-Flow-Profile-Id'))
+
+    def test_conditional_get(self):
+        res = self.get("/api/habit/recent", headers=self.api_headers)
+        etag = res.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        # Unchanged collection
+        headers = dict(self.api_headers)
+        headers['If-None-Match'] = etag
+        res = self.get("/api/habit/recent", headers=headers, status=304)
+        self.assertEqual(res.status_int, 304)
+
+        # Write to HabitDay bumps the version
+        h = Habit.query(ancestor=self.u.key).get()
+        self.post_json("/api/habit/toggle", {'habit_id': h.key.id(), 'date': tools.iso_date(datetime.now())}, headers=self.api_headers)
+        res = self.get("/api/habit/recent", headers=headers)
+        self.assertOK(res)
+        self.assertNotEqual(res.headers.get('ETag'), etag)
+
+    def test_version_bumps(self):
+        from google.appengine.api import memcache
+        from google.appengine.ext import ndb
+        mck = UserVersioned.VERSION_MCK % (self.u.key.id(), 'Task')
+        version = UserVersioned.Versions(self.u.key, ['Task']).get('Task')
+
+        # One bump for a batch
+        UserVersioned.PutMulti([Task.Create(self.u, "Task %d" % i) for i in range(3)])
+        self.assertEqual(memcache.get(mck), version + 1)
+
+        # In a transaction, bumped once after commit
+        @ndb.transactional()
+        def put_tasks():
+            ndb.put_multi([Task.Create(self.u, "Task %d" % i) for i in range(3)])
+            self.assertEqual(memcache.get(mck), version + 1)
+        put_tasks()
+        self.assertEqual(memcache.get(mck), version + 2)
+
+    def test_dashboard_call(self):
+        response = self.get_json("/api/dashboard", {}, headers=self.api_headers)
+        self.assertTrue(response.get('success'))
+        self.assertEqual(response.get('habits')[0].get('name'), "Run")
+        self.assertEqual(response.get('tasks')[0].get('title'), "Dont forget the milk")
+        self.assertEqual(response.get('goals').get('monthly').get('text')[0], "Get it done")
+        self.assertIsNone(response.get('journal'))
+        self.assertEqual(response.get('projects'), [])
+        self.assertEqual(response.get('readables'), [])
+
+    def test_preload_dashboard(self):
+        from views.views import preload_dashboard
+        data = preload_dashboard(self.u)
+        self.assertEqual(data.get('tasks')[0].get('title'), "Dont forget the milk")
+        self.assertEqual(data.get('readables'), [])
+
+        # Served from cache while no dashboard collection changes
+        with patch('api.dashboard_data') as dashboard_data:
+            self.assertEqual(preload_dashboard(self.u), data)
+            self.assertFalse(dashboard_data.called)
+
+        # Writes to any preloaded collection (incl. readables) invalidate
+        r = Readable.CreateOrUpdate(self.u, '1', title="Crony Beliefs", source="test")
+        r.put()
+        data = preload_dashboard(self.u)
+        self.assertEqual(data.get('readables')[0].get('title'), "Crony Beliefs")
+
+    def test_preload_dashboard_script_safe(self):
+        import jinja2
+        from common import my_filters
+        from views.views import preload_dashboard
+        title = u"</script><script>alert('x & y')</script>\u2028"
+        Readable.CreateOrUpdate(self.u, '1', title=title, source="test").put()
+        env = jinja2.Environment(autoescape=True)
+        env.filters['printjson'] = my_filters.printjson
+        html = env.from_string("<script>var initial_data = {{ initial_data|printjson }};</script>").render(
+            initial_data=preload_dashboard(self.u))
+        embedded = html[len("<script>var initial_data = "):-len(";</script>")]
+        for char in ['<', '>', '&', u'\u2028']:
+            self.assertNotIn(char, embedded)
+        self.assertEqual(json.loads(embedded).get('readables')[0].get('title'), title)
+
     def test_goal_calls(self):
         response = self.get_json("/api/goal", {}, headers=self.api_headers)
         goal = response.get('goals')[0]
@@ -296,6 +445,12 @@ class APITestCase(BaseTestCase):
         self.assertEqual(len(listed_jrnls), 1)
         self.assertEqual(listed_jrnls[0].get('id'), jrnl.get('id'))
 
+        # Long range (date query) with data projection
+        response = self.get_json("/api/journal", {'days': 90, 'data_fields': 'other'}, headers=self.api_headers)
+        listed_jrnls = response.get('journals')
+        self.assertEqual(len(listed_jrnls), 1)
+        self.assertEqual(listed_jrnls[0].get('data'), {})
+
     def test_snapshot_calls(self):
         # Create
         snap = Snapshot.Create(self.u, activity="Eating", place="Restaurant", people=["Elizabeth"],
@@ -319,11 +474,56 @@ class APITestCase(BaseTestCase):
         self.assertIsNotNone(td)
         self.assertEqual(td.get('iso_date'), DATE)
         self.assertEqual(td.get('data', {}).get('foo'), 'bar')
+        foo_ts = td.get('key_ts').get('foo')
+
+        # Conditional updates: stale properties conflict, others merge
+        response = self.post_json("/api/tracking", {'date': DATE, 'data': json.dumps({'foo': 'baz', 'steps': 100}),
+                                                    'if_unmodified_since': foo_ts - 1}, headers=self.api_headers)
+        self.assertFalse(response.get('success'))
+        self.assertEqual(response.get('conflicts'), ['foo'])
+        self.assertEqual(response.get('tracking_day').get('data'), {'foo': 'bar', 'steps': 100})
+        response = self.post_json("/api/tracking", {'date': DATE, 'data': json.dumps({'foo': 'baz'}),
+                                                    'if_unmodified_since': foo_ts}, headers=self.api_headers)
+        self.assertTrue(response.get('success'))
+        self.assertEqual(response.get('tracking_day').get('data'), {'foo': 'baz', 'steps': 100})
+
+        # No data, stored day returned unchanged
+        response = self.post_json("/api/tracking", {'date': DATE, 'data': json.dumps({})}, headers=self.api_headers)
+        self.assertTrue(response.get('success'))
+        self.assertEqual(response.get('tracking_day').get('data'), {'foo': 'baz', 'steps': 100})
 
         # Malformed request with no date
         response = self.post_json("/api/tracking", {'data': json.dumps({'foo': 'bar'})}, headers=self.api_headers)
         self.assertFalse(response.get('success'))
 
+    @patch('services.github.urlfetch')
+    def test_github_contributions(self, urlfetch_mocked):
+        from services.github import GithubClient
+        CALENDAR_HTML = '<svg><g><rect class="day" data-count="4" data-date="2017-01-01"/>' \
+            '<rect class="day" data-count="0" data-date="2017-01-02"/>' \
+            '<rect class="day" data-count="2" data-date="2017-01-03"/></g></svg>'
+        urlfetch_mocked.create_rpc.return_value.get_result.return_value = Mock(status_code=200, content=CALENDAR_HTML)
+        self.u.set_integration_prop('github_username', 'octocat')
+        self.u.set_integration_prop('github_pat', 'pat')
+        self.u.put()
+        gh_client = GithubClient(self.u)
+        date_range = [datetime(2017, 1, 1).date(), datetime(2017, 1, 3).date(), datetime(2017, 1, 5).date()]
+        commits = gh_client.get_contributions_on_date_range(date_range)
+        self.assertEqual(commits, dict(zip(date_range, [4, 2, 0])))
+
+        # Calendar cached for the day, no new fetch
+        self.assertIsNone(gh_client.fetch_calendar_async())
+        self.assertEqual(gh_client.get_contribution_calendar().get('2017-01-01'), 4)
+        self.assertEqual(urlfetch_mocked.make_fetch_call.call_count, 1)
+
+        # Merged into existing and new tracking days
+        self.post_json("/api/tracking", {'date': "2017-01-01", 'data': json.dumps({'foo': 'bar'})}, headers=self.api_headers)
+        tds, conflicts = TrackingDay.MergeMany(self.u, dict((date, {'commits': n}) for date, n in commits.items()))
+        self.assertEqual(len(tds), 3)
+        td = TrackingDay.get_by_id("2017-01-01", parent=self.u.key)
+        self.assertEqual(td.json().get('data'), {'foo': 'bar', 'commits': 4})
+        self.assertEqual(td.date, datetime(2017, 1, 1).date())
+
     def test_flowapp_agent_api(self):
         response = self.post_json("/api/agent/flowapp/request", {'message': "hi"}, headers=self.api_headers)
         reply = response.get('reply')
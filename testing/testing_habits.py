@@ -1,10 +1,12 @@
 #!/usr/bin/python
 # -*- coding: utf8 -*-
 
-from datetime import datetime
+from datetime import datetime, timedelta, time
+from google.appengine.api import memcache
 from base_test_case import BaseTestCase
 from models import Habit, HabitDay
 from flow import app as tst_app
+import tools
 
 
 class HabitTestCase(BaseTestCase):
@@ -38,3 +40,102 @@ class HabitTestCase(BaseTestCase):
         self.assertIsNotNone(hd)
         self.assertFalse(hd.done)
 
+    def test_range_strategies(self):
+        u = self.users[0]
+        habit_read = Habit.Create(u)
+        habit_read.Update(name="Read")
+        habit_read.put()
+        today = datetime.today()
+        for days_ago in [0, 3, 40]:
+            HabitDay.Toggle(self.habit_run, today - timedelta(days=days_ago))
+        HabitDay.Toggle(habit_read, today - timedelta(days=3))
+        since = today - timedelta(days=60)
+        habits = [self.habit_run, habit_read]
+        results = []
+        # Fill 1.0 forces key gets, 0.0 forces the date query
+        for fill in [1.0, 0.0]:
+            memcache.set(HabitDay.FILL_MCK % u.key.id(), fill)
+            results.append(HabitDay.Range(u, habits, since))
+        by_keys, by_query = results
+        self.assertEqual(sorted(hd.key.id() for hd in by_keys), sorted(hd.key.id() for hd in by_query))
+        self.assertEqual(len(by_query), 4)
+
+        keyed = HabitDay.Range(u, [habit_read], since, keyed=True)
+        self.assertEqual(keyed.keys(), [(habit_read.key.id(), tools.iso_date(today - timedelta(days=3)))])
+
+        # Unrequested habits with more days in range don't crowd out the requested ones
+        for i in range(3):
+            other = Habit.Create(u)
+            other.Update(name="Other %d" % i)
+            other.put()
+            for days_ago in range(20):
+                HabitDay.Toggle(other, today - timedelta(days=days_ago))
+        memcache.set(HabitDay.FILL_MCK % u.key.id(), 0.0)
+        by_query = HabitDay.Range(u, [habit_read], today - timedelta(days=59))
+        self.assertEqual([hd.key.id() for hd in by_query], [HabitDay.ID(habit_read, today - timedelta(days=3))])
+
+    def test_counters(self):
+        today = datetime.combine(self.habit_run.local_today(), time())
+        for days_ago in [0, 1, 2, 5]:
+            HabitDay.Toggle(self.habit_run, today - timedelta(days=days_ago))
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.current_streak(), 3)
+        self.assertEqual(habit.streak_longest, 3)
+        self.assertEqual(habit.last_done, today.date())
+        monday = today.date() - timedelta(days=today.weekday())
+        self.assertEqual(habit.done_this_week(), len([d for d in [0, 1, 2, 5] if (today - timedelta(days=d)).date() >= monday]))
+
+        # Undo today, streak now ends yesterday (still current)
+        HabitDay.Toggle(self.habit_run, today)
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.current_streak(), 2)
+        self.assertEqual(habit.streak_longest, 2)
+        self.assertEqual(habit.json().get('last_done'), tools.iso_date(today - timedelta(days=1)))
+
+        # Filling the gap joins the runs
+        for days_ago in [3, 4]:
+            HabitDay.Toggle(self.habit_run, today - timedelta(days=days_ago))
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.current_streak(), 5)
+        self.assertEqual(habit.streak_longest, 5)
+
+    def test_counters_local_date(self):
+        # Far from UTC, "today" is the owner's local date
+        u = self.users[0]
+        u.timezone = "Pacific/Kiritimati"
+        u.put()
+        local_today = tools.local_time(u.get_timezone()).date()
+        self.assertEqual(self.habit_run.local_today(), local_today)
+        HabitDay.Toggle(self.habit_run, datetime.combine(local_today, time()))
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.last_done, local_today)
+        self.assertEqual(habit.current_streak(), 1)
+        self.assertEqual(habit.done_this_week(), 1)
+
+    def test_counters_old_dates(self):
+        today = datetime.combine(self.habit_run.local_today(), time())
+        for days_ago in [60, 61, 62, 63, 1]:
+            HabitDay.Toggle(self.habit_run, today - timedelta(days=days_ago))
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.streak_longest, 4)
+        self.assertEqual(habit.current_streak(), 1)
+        self.assertEqual(habit.last_done, (today - timedelta(days=1)).date())
+
+        # Undo inside the longest streak, before the counter window
+        HabitDay.Toggle(self.habit_run, today - timedelta(days=62))
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.streak_longest, 2)
+
+        # Undo the only day done in the window, last done falls back to history
+        HabitDay.Toggle(self.habit_run, today - timedelta(days=1))
+        habit = self.habit_run.key.get()
+        self.assertEqual(habit.current_streak(), 0)
+        self.assertEqual(habit.last_done, (today - timedelta(days=60)).date())
+
+        # Recount from history matches
+        habit.streak_longest = 0
+        habit.last_done = None
+        habit.put()
+        habit = Habit.Recount(habit.key)
+        self.assertEqual(habit.streak_longest, 2)
+        self.assertEqual(habit.last_done, (today - timedelta(days=60)).date())
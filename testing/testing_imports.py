@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+import json
+from base_test_case import BaseTestCase
+from models import Readable, Quote, Import
+from constants import IMPORT
+from flow import app as tst_app
+from mock import patch
+import imports
+
+READABLES_CSV = """title,author,type,tags,read
+Thinking in Systems,Donella Meadows,book,systems;science,1
+Crony Beliefs,Kevin Simler,article,,0
+Thinking in Systems,Donella Meadows,book,,1
+Seeing Like a State,James Scott,book,history,0
+,No Title,book,,0
+"""
+
+CLIPPINGS = """\xef\xbb\xbfCrony Beliefs (Kevin Simler)
+- Your Highlight on Location 40-42 | Added on Monday, March 6, 2017 10:10:10 PM
+
+Beliefs that have been hired for social kickbacks.
+==========
+Crony Beliefs (Kevin Simler)
+- Your Bookmark on Location 80 | Added on Monday, March 6, 2017 10:12:10 PM
+
+
+==========
+Crony Beliefs (Kevin Simler)
+- Your Highlight on Location 40-42 | Added on Monday, March 6, 2017 10:10:10 PM
+
+Beliefs that have been hired for social kickbacks.
+==========
+Thinking in Systems (Donella Meadows)
+- Your Highlight on page 12 | Location 180-182 | Added on Tuesday, March 7, 2017 8:00:00 AM
+
+A system is more than the sum of its parts.
+==========
+"""
+
+
+class ImportsTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.set_application(tst_app)
+        self.setup_testbed()
+        self.init_standard_stubs()
+        self.init_app_basics()
+        self.u = self.users[0]
+
+    def _upload(self, kind, ftype, filename, content):
+        res = self.app.post("/api/import/upload", {'kind': kind, 'ftype': ftype},
+                            upload_files=[('file', filename, content)],
+                            headers=self.api_headers)
+        self.assertOK(res)
+        key = json.loads(res.normal_body).get('import', {}).get('key')
+        self.execute_tasks_until_empty()
+        return self.get_json("/api/import/status", {'key': key}, headers=self.api_headers)
+
+    def test_csv_readables(self):
+        existing = Readable.CreateOrUpdate(self.u, None, title="Seeing Like a State", source="import")
+        existing.put()
+
+        res = self._upload(IMPORT.READABLES, IMPORT.CSV, "readings.csv", READABLES_CSV)
+        imp = res.get('import')
+        self.assertEqual(imp.get('status'), IMPORT.DONE)
+        counters = imp.get('counters')
+        self.assertEqual(counters.get('read'), 5)
+        self.assertEqual(counters.get('created'), 2)
+        self.assertEqual(counters.get('duplicates'), 2)
+        self.assertEqual(counters.get('invalid'), 1)
+        self.assertEqual(res.get('progress', {}).get('status'), IMPORT.DONE)
+
+        readables = Readable.Fetch(self.u)
+        self.assertEqual(len(readables), 3)
+        systems = [r for r in readables if r.title == "Thinking in Systems"][0]
+        self.assertTrue(systems.read)
+        self.assertEqual(systems.tags, ["systems", "science"])
+        self.assertEqual(systems.slug, "THINKING IN SYSTEMS (MEADOWS)")
+
+    def test_kindle_quotes(self):
+        res = self._upload(IMPORT.QUOTES, IMPORT.KINDLE, "My Clippings.txt", CLIPPINGS)
+        counters = res.get('import').get('counters')
+        self.assertEqual(counters.get('created'), 2)
+        self.assertEqual(counters.get('duplicates'), 1)
+        self.assertEqual(counters.get('invalid'), 1)  # Bookmark
+        quotes = Quote.Fetch(self.u)
+        self.assertEqual(len(quotes), 2)
+        self.assertEqual(sorted(q.location for q in quotes), ["Location 180-182", "Location 40-42"])
+
+        # Re-importing the same file creates nothing
+        res = self._upload(IMPORT.QUOTES, IMPORT.KINDLE, "My Clippings.txt", CLIPPINGS)
+        self.assertEqual(res.get('import').get('counters').get('created'), 0)
+        self.assertEqual(len(Quote.Fetch(self.u)), 2)
+
+    def test_continuations(self):
+        lines = [json.dumps({'title': "Article %d" % i, 'source_id': str(i), 'url': "http://example.com/%d" % i})
+                 for i in range(25)]
+        with patch.object(imports, 'BATCH_SIZE', 4), patch.object(imports, 'MAX_REQUEST_SECONDS', 0):
+            res = self._upload(IMPORT.READABLES, IMPORT.JSON, "articles.json", '\n'.join(lines))
+        imp = res.get('import')
+        self.assertEqual(imp.get('status'), IMPORT.DONE)
+        self.assertEqual(imp.get('counters').get('created'), 25)
+        self.assertEqual(imp.get('counters').get('continuations'), 6)
+        self.assertEqual(len(Readable.Fetch(self.u, limit=50)), 25)
+        self.assertEqual(len(Import.Fetch(self.u)), 1)
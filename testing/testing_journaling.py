@@ -1,6 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf8 -*-
 
+import json
 from google.appengine.api import memcache
 from google.appengine.ext import db
 from google.appengine.ext import testbed
@@ -43,4 +44,41 @@ class JournalingTestCase(BaseTestCase):
 
         self.assertEqual(len(JournalTag.All(self.u)), 7)
 
+    def test_journal_tag_counts(self):
+        self.u.settings = json.dumps({'journals': {'questions': [
+            {'name': 'highlight', 'response_type': 'text', 'parse_tags': True}
+        ]}})
+        self.u.put()
+        today = datetime.today().date()
+        volley = [
+            (today - timedelta(days=200), "Lunch with @KatyRoth #Tennis"),
+            (today - timedelta(days=10), "#Tennis again with @KatyRoth and @KatyRoth"),
+            (today - timedelta(days=2), "#Tennis"),
+        ]
+        for date, txt in volley:
+            jrnl = MiniJournal.Create(self.u, date=date)
+            jrnl.Update(data={'highlight': txt})
+            jrnl.parse_tags()
+            # Re-parsing an already tagged journal doesn't count again
+            jrnl.parse_tags()
+            jrnl.put()
+
+        tennis = JournalTag.Key(self.u, "Tennis", prefix="#").get()
+        self.assertEqual(tennis.count, 3)
+        self.assertEqual(tennis.first_used, volley[0][0])
+        self.assertEqual(tennis.last_used, volley[2][0])
+        self.assertEqual(tennis.recent_count(), 2)
+        katy = JournalTag.Key(self.u, "KatyRoth", prefix="@").get()
+        self.assertEqual(katy.count, 2)
+
+        tags, cursor, more = JournalTag.Frequent(self.u, limit=1)
+        self.assertEqual(tags[0].key, tennis.key)
+        self.assertTrue(more)
+        tags, cursor, more = JournalTag.Frequent(self.u, limit=1, cursor=cursor)
+        self.assertEqual(tags[0].key, katy.key)
 
+        # Recount from journals matches counters kept as journals were tagged
+        self.assertEqual(JournalTag.Recount(self.u.key), 2)
+        self.assertEqual(tennis.key.get().count, 3)
+        self.assertEqual(tennis.key.get().first_used, volley[0][0])
+        self.assertEqual(katy.key.get().count, 2)
@@ -1,10 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf8 -*-
 
+import json
+from datetime import datetime
 from base_test_case import BaseTestCase
-from models import Readable, Quote
+from models import Readable, Quote, ReadingStats
+from constants import READABLE
 from flow import app as tst_app
 from mock import patch
+import tools
 
 CRONY_TITLE = "Crony Beliefs"
 CRONY_AUTHOR = "Kevin Simler"
@@ -62,6 +66,248 @@ class ReadableTestCase(BaseTestCase):
         self.assertEqual(len(quotes), 1)
         self.assertEqual(quotes[0].source, source)
 
+    def test_quote_batch_readable_lookups(self):
+        r = Readable.CreateOrUpdate(self.u, '3000', title=CRONY_TITLE, author=CRONY_AUTHOR, source="test")
+        r.put()
+        Readable.put_sd_batch([r])
+        source = "%s (Simler, Kevin)" % CRONY_TITLE
+        quotes = [{'source': source, 'content': "Highlight %d" % i} for i in range(20)]
+        quotes += [{'source': "Unknown Book (Nobody)", 'content': "Highlight %d" % i} for i in range(5)]
+        with patch.object(Readable, 'Search', wraps=Readable.Search) as search:
+            self.post_json("/api/quote/batch", {'quotes': json.dumps(quotes)}, headers=self.api_headers)
+            # One search per distinct source
+            self.assertEqual(search.call_count, 2)
+        linked = Quote.Fetch(self.u, readable_id=r.key.id())
+        self.assertEqual(len(linked), 20)
+
+        # Later batches resolve from memcache
+        with patch.object(Readable, 'Search', wraps=Readable.Search) as search:
+            q = Quote.Create(self.u, source=source, content="Another")
+            self.assertEqual(q.readable, r.key)
+            self.assertFalse(search.called)
+
+    def test_random_sample(self):
+        from constants import READABLE
+        from datetime import datetime, timedelta
+        from google.appengine.ext import ndb
+        now = datetime.now()
+        readables = []
+        for i in range(120):
+            r = Readable.CreateOrUpdate(self.u, str(4000 + i), title="Readable %d" % i, source="test",
+                                        type=READABLE.BOOK if i % 4 == 0 else READABLE.ARTICLE,
+                                        notes="Notes" if i % 2 == 0 else None,
+                                        dt_added=now - timedelta(days=i * 10))
+            readables.append(r)
+        ndb.put_multi(readables)
+        self.assertTrue(all(r.rand is not None for r in readables))
+
+        sample = Readable.Sample(self.u, n=20)
+        self.assertEqual(len(sample), 20)
+        self.assertEqual(len(set(r.key for r in sample)), 20)
+
+        sample = Readable.Sample(self.u, n=50, has_notes=True, type=READABLE.BOOK)
+        self.assertEqual(len(sample), 30)  # All matching
+        self.assertTrue(all(r.has_notes and r.type == READABLE.BOOK for r in sample))
+
+        # Recency weighted sample skews newer
+        recent = Readable.Sample(self.u, n=20, half_life_days=30)
+        self.assertEqual(len(recent), 20)
+        mean_age = lambda items: sum((now - r.dt_added).days for r in items) / float(len(items))
+        self.assertLess(mean_age(recent), mean_age(readables))
+
+        res = self.get_json("/api/readable/random", {'with_notes': 1}, headers=self.api_headers)
+        self.assertEqual(len(res.get('readables')), 50)
+
+        # Quotes put before rand existed are still sampled
+        with patch.object(Quote, '_pre_put_hook'):
+            ndb.put_multi([Quote.Create(self.u, source="Old source", content="Old %d" % i) for i in range(5)])
+        quotes = Quote.Sample(self.u, n=10)
+        self.assertEqual(len(quotes), 5)
+        self.assertTrue(all(q.rand is None for q in quotes))
+
+    def test_create_or_update_multi(self):
+        existing = Readable.CreateOrUpdate(self.u, '2000', title=CRONY_TITLE, author=CRONY_AUTHOR, source="test")
+        existing.put()
+        items = [
+            {'source_id': '2000', 'title': "Changed Title", 'source': "test", 'update': {'favorite': True}},
+            {'source_id': '2001', 'title': MEDIUM_TITLE, 'url': MEDIUM_URL, 'source': "test", 'tags': ["Design"]},
+            {'source_id': '2001', 'title': "Repeated", 'source': "test"},
+            {'source_id': '2002', 'title': None, 'source': "test"}
+        ]
+        readables = Readable.CreateOrUpdateMulti(self.u, items)
+        self.assertEqual(len(readables), 4)
+        self.assertIsNone(readables[3])
+        self.assertEqual(readables[1].key, readables[2].key)
+
+        # Existing readable kept, with update applied
+        r = Readable.get_by_id('test:2000', parent=self.u.key)
+        self.assertEqual(r.title, CRONY_TITLE)
+        self.assertTrue(r.favorite)
+        r = Readable.get_by_id('test:2001', parent=self.u.key)
+        self.assertEqual(r.title, MEDIUM_TITLE)
+        self.assertEqual(r.tags, ["design"])
+        self.assertEqual(r.slug, "892 WAYS TO INSTANTLY WIN")
+
+        # Indexed in batch
+        results = Readable.Search(self.u, "Instantly")
+        self.assertEqual(len(results[2]), 1)
+
+    def test_reading_stats(self):
+        year = datetime.today().year
+        today = tools.iso_date(datetime.today())
+
+        # Marked read on creation
+        res = self.post_json("/api/readable", {'title': CRONY_TITLE, 'author': CRONY_AUTHOR,
+                                               'source': "test", 'word_count': 1200, 'read': 1},
+                             headers=self.api_headers)
+        crony_id = res.get('readable').get('id')
+        self.post_json("/api/readable/batch", {'readings': json.dumps([
+            {'title': MEDIUM_TITLE, 'type': 'book', 'word_count': 300}
+        ])}, headers=self.api_headers)  # Read date unknown, not counted
+        # Not served until history is counted
+        res = self.get_json("/api/readable/stats", {}, headers=self.api_headers)
+        self.assertFalse(res.get('success'))
+        self.assertIsNone(res.get('stats'))
+        self.execute_tasks_until_empty()
+        stats = self.get_json("/api/readable/stats", {}, headers=self.api_headers).get('stats')
+        self.assertEqual(stats.get('year'), year)
+        self.assertEqual(stats.get('totals').get('count'), 1)
+        day = stats.get('days').get(today)
+        self.assertEqual(day, {'count': 1, 'words': 1200, 'favorites': 0,
+                               'types': {str(READABLE.ARTICLE): 1}, 'sources': {'test': 1}})
+
+        # Favorite, then unread
+        self.post_json("/api/readable", {'id': crony_id, 'favorite': 1}, headers=self.api_headers)
+        stats = self.get_json("/api/readable/stats", {}, headers=self.api_headers).get('stats')
+        self.assertEqual(stats.get('days').get(today).get('favorites'), 1)
+        self.assertEqual(sum(week.get('count') for week in stats.get('weeks').values()), 1)
+        self.post_json("/api/readable", {'id': crony_id, 'read': 0}, headers=self.api_headers)
+        stats = self.get_json("/api/readable/stats", {}, headers=self.api_headers).get('stats')
+        self.assertEqual(stats.get('days'), {})
+
+        # Read again, then deleted
+        self.post_json("/api/readable", {'id': crony_id, 'read': 1}, headers=self.api_headers)
+        self.assertEqual(ReadingStats.Range(self.u, datetime(year, 1, 1), datetime.today()).keys(), [today])
+        self.post_json("/api/readable/delete", {'id': crony_id}, headers=self.api_headers)
+        self.assertEqual(ReadingStats.Get(self.u, year).get_days(), {})
+
+        # Recount matches tracked counters, rewrites aren't counted again
+        for i in range(3):
+            r = Readable.CreateOrUpdate(self.u, str(i), title="Article %d" % i, source="test", word_count=100)
+            r.Update(read=True, favorite=i == 0)
+            ReadingStats.Write(self.u, [r])
+            r.stats_counted = None
+            self.assertEqual(ReadingStats.Write(self.u, [r]), 0)
+        tracked = ReadingStats.Get(self.u, year).get_days()
+        self.assertIsNone(ReadingStats.RecountPage(self.u.key))
+        self.assertEqual(ReadingStats.Get(self.u, year).get_days(), tracked)
+        self.assertEqual(tracked.get(today).get('words'), 300)
+
+    def test_reading_stats_rebuild(self):
+        from tasks import rebuildReadingStats
+        today = datetime.today()
+        # Read before stats were tracked
+        for i in range(3):
+            r = Readable.CreateOrUpdate(self.u, str(i), title="Article %d" % i, source="test", word_count=100)
+            r.Update(read=True)
+            r.put()
+        self.assertIsNone(ReadingStats.Range(self.u, datetime(today.year, 1, 1), today))
+        with patch.object(ReadingStats, 'WRITE_BATCH', 2):
+            rebuildReadingStats(self.u.key.id())
+            self.assertFalse(ReadingStats.Rebuilt(self.u.key))  # Next page queued
+            self.execute_tasks_until_empty()
+        days = ReadingStats.Range(self.u, datetime(today.year, 1, 1), today)
+        self.assertEqual(days.get(tools.iso_date(today)).get('count'), 3)
+        # Running again counts nothing twice
+        rebuildReadingStats(self.u.key.id())
+        self.assertEqual(ReadingStats.Get(self.u, today.year).get_days(), {tools.iso_date(today): days.get(tools.iso_date(today))})
+
+    @patch('services.pocket.fetch_page')
+    def test_pocket_paged_sync(self, fetch_page_mocked):
+        from services import pocket
+
+        def article(id, time_updated, status='0'):
+            return {'item_id': id, 'resolved_title': "Article %s" % id, 'given_url': "http://example.com/%s" % id,
+                    'status': status, 'time_added': '1485774143', 'time_updated': str(time_updated)}
+
+        pages = {
+            0: {'1': article('1', 100), '2': article('2', 100)},
+            2: {'3': article('3', 100), '4': article('4', 100)},
+            4: {'5': article('5', 100)}
+        }
+        fetch_page_mocked.side_effect = lambda token, since=None, offset=0, count=None: (True, pages.get(offset, {}), 1000)
+        with patch.object(pocket, 'PAGE_SIZE', 2):
+            success, readables, latest, more = pocket.sync(self.u, 'token', max_pages=2)
+            self.assertTrue(success)
+            self.assertTrue(more)
+            self.assertEqual(len(readables), 4)
+            # Checkpointed, last sync timestamp not yet advanced
+            self.assertEqual(self.u.key.get().get_integration_prop(pocket.CHECKPOINT_KEY).get('offset'), 4)
+            self.assertIsNone(self.u.get_integration_prop(pocket.TS_KEY))
+
+            success, readables, latest, more = pocket.sync(self.u, 'token', max_pages=2)
+            self.assertFalse(more)
+            self.assertEqual(len(readables), 1)
+            self.assertIsNone(self.u.get_integration_prop(pocket.CHECKPOINT_KEY))
+            self.assertEqual(self.u.get_integration_prop(pocket.TS_KEY), 1000)
+
+            # Next sync: unchanged article skipped, archived one updated
+            pages = {0: {'1': article('1', 100), '2': article('2', 200, status='1')}}
+            with patch.object(Readable, 'put_sd_batch') as put_sd_batch:
+                success, readables, latest, more = pocket.sync(self.u, 'token')
+                self.assertEqual(len(put_sd_batch.call_args[0][0]), 1)
+            self.assertEqual(fetch_page_mocked.call_args[1].get('since'), 1000)
+        self.assertEqual(len(Readable.Fetch(self.u)), 5)
+        self.assertTrue(Readable.get_by_id('pocket:2', parent=self.u.key).read)
+        self.assertFalse(Readable.get_by_id('pocket:1', parent=self.u.key).read)
+
+        # Failed page keeps the checkpoint saved after the previous one
+        self.u.set_integration_prop(pocket.TS_KEY, None)
+        fetch_page_mocked.side_effect = lambda token, since=None, offset=0, count=None: \
+            (True, pages.get(offset), 1000) if offset == 0 else (False, {}, None)
+        with patch.object(pocket, 'PAGE_SIZE', 2):
+            success, readables, latest, more = pocket.sync(self.u, 'token')
+        self.assertFalse(success)
+        self.assertEqual(self.u.key.get().get_integration_prop(pocket.CHECKPOINT_KEY).get('offset'), 2)
+
+    @patch('services.goodreads.fetch_page')
+    def test_goodreads_shelf_sync(self, fetch_page_mocked):
+        from services import goodreads
+        from mock import Mock
+
+        def review(isbn, title):
+            return ("<review><book><isbn13>%s</isbn13><title>%s</title><link>http://gr/%s</link>"
+                    "<image_url/><authors><author><name>Ann Author</name></author></authors></book></review>") % (isbn, title, isbn)
+
+        def shelf(start, end, total, reviews):
+            return '<GoodreadsResponse><reviews start="%d" end="%d" total="%d">%s</reviews></GoodreadsResponse>' % (
+                start, end, total, ''.join(reviews))
+
+        pages = {
+            1: shelf(1, 2, 3, [review('100', "Book One"), review('101', "Book Two")]),
+            2: shelf(3, 3, 3, [review('102', "Book Three")])
+        }
+        fetch_page_mocked.side_effect = lambda gr_user_id, shelf, page=1, cached=None: Mock(
+            status_code=200, content=pages[page], headers={})
+        self.u.set_integration_prop('goodreads_user_id', '1234')
+        self.u.put()
+
+        success, readables = goodreads.get_books_on_shelf(self.u)
+        self.assertTrue(success)
+        self.assertEqual(len(readables), 3)
+        self.assertEqual(readables[0].author, "Ann Author")
+
+        # Unchanged content: not parsed or written again
+        with patch.object(Readable, 'CreateOrUpdateMulti') as create_multi:
+            success, readables = goodreads.get_books_on_shelf(self.u)
+            self.assertFalse(create_multi.called)
+        self.assertEqual(len(readables), 3)
+
+        # Changed second page only
+        pages[2] = shelf(3, 3, 3, [review('103', "Book Four")])
+        success, readables = goodreads.get_books_on_shelf(self.u)
+        self.assertEqual(sorted(r.title for r in readables), ["Book Four", "Book One", "Book Two"])
+
     @patch('services.flow_evernote.get_note')
     def test_evernote_webhook(self, get_note_mocked):
         EN_NOTE_GUID = "1000-0815-aefe-b8a0-8888"
@@ -82,6 +328,9 @@ class ReadableTestCase(BaseTestCase):
             'notebookGuid': EN_NOTEBOOK_ID,
             'userId': self.u.evernote_id
         }, headers=self.api_headers)
+        # Queued for the coalescing worker
+        self.assertEqual(len(Readable.Fetch(self.u)), 0)
+        self.execute_tasks_until_empty()
         readables = Readable.Fetch(self.u)
         self.assertEqual(len(readables), 1)
         r = readables[0]
@@ -97,10 +346,50 @@ class ReadableTestCase(BaseTestCase):
             'notebookGuid': EN_NOTEBOOK_ID,
             'userId': self.u.evernote_id
         }, headers=self.api_headers)
+        self.execute_tasks_until_empty()
         quotes = Quote.Fetch(self.u)
         self.assertEqual(len(quotes), 1)
         q = quotes[0]
         self.assertEqual(q.source, CRONY_TITLE)
         self.assertEqual(q.content, CRONY_QUOTE)
 
+    @patch('services.flow_evernote.get_note')
+    def test_evernote_webhook_burst(self, get_note_mocked):
+        EN_USER_ID = "1002"
+        self.u.evernote_id = EN_USER_ID
+        self.u.put()
+        get_note_mocked.side_effect = lambda user, guid: (guid, "Article %s" % guid, MEDIUM_FULL_CONTENT, MEDIUM_URL)
 
+        for i in range(5):
+            self.get_json("/api/integrations/evernote/webhook", {
+                'reason': 'create',
+                'guid': "note-%d" % i,
+                'userId': EN_USER_ID
+            }, headers=self.api_headers)
+        # Repeated notification for the same note
+        self.get_json("/api/integrations/evernote/webhook", {
+            'reason': 'create',
+            'guid': "note-0",
+            'userId': EN_USER_ID
+        }, headers=self.api_headers)
+
+        self.execute_tasks_until_empty()
+        self.assertEqual(get_note_mocked.call_count, 5)
+        self.assertEqual(len(Readable.Fetch(self.u)), 5)
+
+    @patch('services.flow_evernote.get_note')
+    def test_evernote_webhook_unconfigured_notebook(self, get_note_mocked):
+        EN_USER_ID = "1003"
+        self.u.evernote_id = EN_USER_ID
+        self.u.put()
+
+        # No notebooks configured: notes from any notebook are ignored
+        self.get_json("/api/integrations/evernote/webhook", {
+            'reason': 'create',
+            'guid': "note-0",
+            'notebookGuid': "ffff-0001",
+            'userId': EN_USER_ID
+        }, headers=self.api_headers)
+        self.execute_tasks_until_empty()
+        self.assertFalse(get_note_mocked.called)
+        self.assertEqual(len(Readable.Fetch(self.u)), 0)
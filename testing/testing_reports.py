@@ -2,10 +2,12 @@
 # -*- coding: utf8 -*-
 
 from datetime import datetime, date
+import json
 from base_test_case import BaseTestCase
 from models import Task, Project, Report, Goal, MiniJournal, Habit, HabitDay
 from constants import REPORT
 from flow import app as tst_app
+import reports
 import tools
 DATE_FMT = "%Y-%m-%d %H:%M:%S %Z"
 
@@ -187,4 +189,35 @@ class ReportsTestCases(BaseTestCase):
         # Delete
         reports[0].clean_delete()
         reports = Report.Fetch(self.u)
-        self.assertEqual(len(reports), 0)
\ No newline at end of file
+        self.assertEqual(len(reports), 0)
+
+    def test_streamed_export(self):
+        task = Task.Create(self.u, "New task", due=datetime(2017, 10, 2, 12, 0))
+        task.put()
+
+        # Small export streamed in the response, nothing stored or queued
+        response = self.get("/api/report/export?type=%d" % REPORT.TASK_REPORT, headers=self.api_headers)
+        self.assertEqual(response.content_type, 'text/csv')
+        rows = [r for r in response.body.replace('\r\n', '\n').split('\n') if r]
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith(tools.sdatetime(task.dt_created, fmt=DATE_FMT)))
+        self.assertEqual(len(Report.Fetch(self.u)), 0)
+        self.assertTasksInQueue(n=0)
+
+        response = self.get("/api/report/export?type=%d&ftype=%d" % (REPORT.TASK_REPORT, REPORT.NDJSON), headers=self.api_headers)
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        row = json.loads(response.body.strip())
+        self.assertEqual(row.get('Title'), "New task")
+
+        response = self.get("/api/report/export?type=%d&ftype=99" % REPORT.TASK_REPORT, headers=self.api_headers, status=400)
+        self.assertFalse(json.loads(response.body).get('success'))
+
+        # Over the streaming limit, generated in the background instead
+        reports.STREAM_MAX_ROWS = 0
+        try:
+            response = self.get_json("/api/report/export?type=%d" % REPORT.TASK_REPORT, headers=self.api_headers)
+        finally:
+            reports.STREAM_MAX_ROWS = 2000
+        self.assertIsNotNone(response.get('report'))
+        self.execute_tasks_until_empty()
+        self.assertTrue(Report.Fetch(self.u)[0].is_done())
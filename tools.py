@@ -203,6 +203,14 @@ def iso_date(date):
     return datetime.strftime(date, "%Y-%m-%d") if date else None
 
 
+def to_date(dt):
+    '''
+    >>> to_date(datetime(2017, 5, 1, 12, 30))
+    datetime.date(2017, 5, 1)
+    '''
+    return dt.date() if isinstance(dt, datetime) else dt
+
+
 def get_first_day(dt, d_years=0, d_months=0):
     '''
     d_years, d_months are "deltas" to apply to dt
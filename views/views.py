@@ -1,6 +1,33 @@
 import django_version
 import authorized
 import handlers
+import hashlib
+import tools
+from google.appengine.api import memcache
+from constants import PRELOAD_DASHBOARD
+
+DASHBOARD_MCK = "user:%s:dashboard:%s"
+DASHBOARD_CACHE_SECS = 60*10
+DASHBOARD_KINDS = ['Habit', 'HabitDay', 'Task', 'Project', 'Goal', 'MiniJournal', 'Readable']
+
+
+def preload_dashboard(user):
+    '''
+    Dashboard data to embed in the page (see api.dashboard_data)
+
+    Cached per user, keyed by the user's collection versions and local date
+    so any write to a dashboard collection invalidates it
+    '''
+    from api import dashboard_data
+    from models import UserVersioned
+    versions = UserVersioned.Versions(user.key, DASHBOARD_KINDS)
+    seed = [tools.iso_date(user.local_time())] + ["%s:%s" % (k, versions.get(k)) for k in DASHBOARD_KINDS]
+    mck = DASHBOARD_MCK % (user.key.id(), hashlib.md5('|'.join(seed)).hexdigest())
+    data = memcache.get(mck)
+    if data is None:
+        data = dashboard_data(user)
+        memcache.set(mck, data, time=DASHBOARD_CACHE_SECS)
+    return data
 
 
 class App(handlers.BaseRequestHandler):
@@ -19,6 +46,8 @@ class App(handlers.BaseRequestHandler):
                 'user': self.user.json(is_self=True) if self.user else None
             }
         }
+        if PRELOAD_DASHBOARD and self.user:
+            d['initial_data'] = preload_dashboard(self.user)
         # d['gautoload'] = urllib.quote_plus(json.dumps(gmods).replace(' ',''))
         d['gmap_api_key'] = G_MAPS_API_KEY
         self.render_template("index.html", **d)